@@ -1,23 +1,19 @@
 # app/session_context.py
-import json
-from app.redis_client import get_redis_client
+from app.utils.session_store import save_session_messages, get_session_history
 
 WINDOW_SIZE = 20
 TTL_SECONDS = 1800
 
 def save_message(user_id, text, role):
-    r = get_redis_client()
-    key = f"session:{user_id}"
-    msg = {"role": role, "text": text}
-    r.rpush(key, json.dumps(msg))
-    r.ltrim(key, -WINDOW_SIZE, -1)
-    r.expire(key, TTL_SECONDS)
+    # mesmo backend do histórico de sessão (SESSION_BACKEND): 1 round trip no Redis,
+    # nenhum no backend em memória; janela simples (RPUSH + LTRIM + EXPIRE), sem compactação
+    save_session_messages(
+        user_id, [{"role": role, "content": text}], max_len=WINDOW_SIZE, ttl_seconds=TTL_SECONDS, compact=False
+    )
 
 def get_context(user_id):
-    r = get_redis_client()
-    key = f"session:{user_id}"
-    msgs = r.lrange(key, 0, -1)
-    return [json.loads(m) for m in msgs]
+    msgs = get_session_history(user_id)[-WINDOW_SIZE:]
+    return [{"role": m["role"], "text": m["content"]} for m in msgs]
 
 def build_prompt(user_id):
     context = get_context(user_id)
@@ -1,23 +1,113 @@
 # app/redis_client.py
+"""
+Camada única de acesso ao Redis (sync + async) para todo o app.
+
+- Uma URL (redis:// ou rediss:// com TLS), um pool por processo para cada modo
+- Pool com tamanho explícito, socket timeouts, health check e retry com backoff (REDIS_RETRIES)
+- get_pool_stats(): uso dos pools (para dimensionar conexões por worker)
+- binary=True: cliente sem decode_responses (valores binários, ex.: histórico em msgpack)
+"""
 import os
 import redis
+import redis.asyncio as aioredis
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from redis.asyncio.retry import Retry as AsyncRetry
 from dotenv import load_dotenv
 
 load_dotenv()
 
 # Using single URL (redis:// or rediss://)
+# (checked on first use: with SESSION_BACKEND=memory the app can run without Redis)
 REDIS_URL = os.getenv("REDIS_URL")
-if not REDIS_URL:
-    raise RuntimeError("REDIS_URL not defined in .env")
-
-# Singleton
-_redis_instance = None
-
-def get_redis_client():
-    global _redis_instance
-    if _redis_instance is None:
-        _redis_instance = redis.from_url(
-            REDIS_URL,
-            decode_responses=True,   # strings instead of bytes
-        )
-    return _redis_instance
+
+REDIS_MAX_CONNECTIONS        = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_SOCKET_TIMEOUT         = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", "5"))
+REDIS_HEALTH_CHECK_INTERVAL  = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+REDIS_RETRIES                = int(os.getenv("REDIS_RETRIES", "3"))
+
+_RETRY_ERRORS = [RedisConnectionError, RedisTimeoutError]
+
+
+def _redis_url() -> str:
+    if not REDIS_URL:
+        raise RuntimeError("REDIS_URL not defined in .env")
+    return REDIS_URL
+
+
+def _pool_kwargs(retry, binary: bool = False) -> dict:
+    # retry/retry_on_error vão para o pool (cada conexão): no Redis(connection_pool=...) seriam ignorados
+    return dict(
+        max_connections=REDIS_MAX_CONNECTIONS,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        retry=retry,
+        retry_on_error=_RETRY_ERRORS,
+        decode_responses=not binary,   # strings instead of bytes (exceto binary)
+    )
+
+
+# Singletons (sync + async), um por modo de decode
+_redis_instances: dict = {}
+_async_redis_instances: dict = {}
+
+
+def get_redis_client(binary: bool = False) -> redis.Redis:
+    client = _redis_instances.get(binary)
+    if client is None:
+        retry = Retry(ExponentialBackoff(), REDIS_RETRIES)
+        pool = redis.ConnectionPool.from_url(_redis_url(), **_pool_kwargs(retry, binary))
+        client = redis.Redis(connection_pool=pool)
+        _redis_instances[binary] = client
+    return client
+
+
+def get_async_redis_client(binary: bool = False) -> aioredis.Redis:
+    client = _async_redis_instances.get(binary)
+    if client is None:
+        retry = AsyncRetry(ExponentialBackoff(), REDIS_RETRIES)
+        pool = aioredis.ConnectionPool.from_url(_redis_url(), **_pool_kwargs(retry, binary))
+        client = aioredis.Redis(connection_pool=pool)
+        _async_redis_instances[binary] = client
+    return client
+
+
+def _stats(client) -> dict:
+    if client is None:
+        return {"initialized": False}
+    pool = client.connection_pool
+    in_use = len(getattr(pool, "_in_use_connections", ()))
+    idle = len(getattr(pool, "_available_connections", ()))
+    created = in_use + idle  # o pool async não tem _created_connections: conta pelas duas listas
+    return {
+        "initialized": True,
+        "max_connections": pool.max_connections,
+        "created": created,
+        "in_use": in_use,
+        "idle": idle,
+        "utilization": round(in_use / pool.max_connections, 3) if pool.max_connections else None,
+    }
+
+
+def get_pool_stats() -> dict:
+    """Uso dos pools deste processo (sync e async; *_binary = clientes sem decode)."""
+    return {
+        "sync": _stats(_redis_instances.get(False)),
+        "async": _stats(_async_redis_instances.get(False)),
+        "sync_binary": _stats(_redis_instances.get(True)),
+        "async_binary": _stats(_async_redis_instances.get(True)),
+    }
+
+
+async def close_redis_clients() -> None:
+    """Fecha os pools (shutdown do app)."""
+    for client in list(_async_redis_instances.values()):
+        await client.aclose()
+    _async_redis_instances.clear()
+    for client in list(_redis_instances.values()):
+        client.close()
+        client.connection_pool.disconnect()
+    _redis_instances.clear()
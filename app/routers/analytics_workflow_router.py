@@ -19,10 +19,11 @@ class AnalyticsQueryResponse(BaseModel):
     meta: Optional[Dict[str, Any]] = None
 
 @router.post("/query", response_model=AnalyticsQueryResponse, status_code=status.HTTP_200_OK)
-def query(req: AnalyticsQueryRequest):
+async def query(req: AnalyticsQueryRequest):
     try:
         ctx = req.context or {}
         ctx["user_uuid"] = req.user_uuid   # garante presença
+        # workflow local e CPU-only (sem I/O): roda direto no event loop
         out = run_generate_query(question=req.user_text, session_id=req.session_id, context=ctx)
         return out
     except Exception as e:
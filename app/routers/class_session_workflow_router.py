@@ -1,7 +1,14 @@
 from fastapi import APIRouter, HTTPException, status
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any
-from app.workflows.class_session import run_class_session, finalize_session_with_plan
+from app.utils.agent_guard import AgentUnavailable
+import requests
+from app.utils.deadline import deadline_from
+from app.utils.sse import sse_response
+from app.workflows.class_session import (
+    run_class_session_async, stream_class_session_async, finalize_session_with_plan_async,
+)
+from app.utils.finalize_jobs import enqueue_finalize_job_async, get_finalize_job_async
 
 router = APIRouter(prefix="/workflows/class-session", tags=["workflows/class-session"])
 
@@ -9,6 +16,10 @@ class ClassRunRequest(BaseModel):
     user_text: str = Field(..., min_length=1)
     session_id: str = Field(..., min_length=1)
     student_uuid: str = Field(..., min_length=36)
+    # prazo total do turno (planner + professor); ausente → CLASS_TURN_DEADLINE_SECONDS
+    deadline_seconds: Optional[float] = Field(None, gt=0)
+    # ignora o plano LITE em cache da sessão e pede um novo ao planner
+    refresh_plan: bool = False
 
 class ClassRunResponse(BaseModel):
     status: str
@@ -16,10 +27,32 @@ class ClassRunResponse(BaseModel):
     professor: Optional[Dict[str, Any]] = None
 
 @router.post("/run", response_model=ClassRunResponse, status_code=status.HTTP_200_OK)
-def run(req: ClassRunRequest):
+async def run(req: ClassRunRequest):
     try:
-        out = run_class_session(aluno_uuid=req.student_uuid, question=req.user_text, session_id=req.session_id)
+        out = await run_class_session_async(
+            aluno_uuid=req.student_uuid, question=req.user_text, session_id=req.session_id,
+            deadline=deadline_from(req.deadline_seconds), refresh_plan=req.refresh_plan,
+        )
         return {"status": "ok", "planner": out.get("planner"), "professor": out.get("professor")}
+    except requests.Timeout as e:
+        raise HTTPException(status_code=504, detail=f"Class session workflow timed out: {e}")
+    except AgentUnavailable:
+        raise  # 503 + Retry-After (handler em main.py)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Class session workflow failed: {e}")
+
+@router.post("/run/stream", status_code=status.HTTP_200_OK)
+async def run_stream(req: ClassRunRequest):
+    # SSE: "plan" {"plan"}, "delta" {"text"} da aula conforme chega, "done" depois de gravar o turno
+    try:
+        return await sse_response(stream_class_session_async(
+            aluno_uuid=req.student_uuid, question=req.user_text, session_id=req.session_id,
+            deadline=deadline_from(req.deadline_seconds), refresh_plan=req.refresh_plan,
+        ))
+    except requests.Timeout as e:
+        raise HTTPException(status_code=504, detail=f"Class session workflow timed out: {e}")
+    except AgentUnavailable:
+        raise  # 503 + Retry-After (handler em main.py)
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"Class session workflow failed: {e}")
 
@@ -34,9 +67,36 @@ class ClassFinalizeResponse(BaseModel):
     plano: Optional[str] = None
 
 @router.post("/finalize", response_model=ClassFinalizeResponse, status_code=status.HTTP_200_OK)
-def finalize(req: ClassFinalizeRequest):
+async def finalize(req: ClassFinalizeRequest):
     try:
-        out = finalize_session_with_plan(aluno_uuid=req.student_uuid, session_id=req.session_id)
+        out = await finalize_session_with_plan_async(aluno_uuid=req.student_uuid, session_id=req.session_id)
         return out
+    except AgentUnavailable:
+        raise  # 503 + Retry-After (handler em main.py)
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"Finalize workflow failed: {e}")
+
+
+# ---- Finalize em modo job (Redis Stream + workers) ----
+
+class FinalizeJobResponse(BaseModel):
+    job_id: str
+    status: str
+    result: Optional[ClassFinalizeResponse] = None
+    error: Optional[str] = None
+
+@router.post("/finalize/jobs", response_model=FinalizeJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def finalize_job(req: ClassFinalizeRequest):
+    try:
+        job_id = await enqueue_finalize_job_async(aluno_uuid=req.student_uuid, session_id=req.session_id)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Finalize enqueue failed: {e}")
+    job = await get_finalize_job_async(job_id)
+    return job or {"job_id": job_id, "status": "queued"}
+
+@router.get("/finalize/jobs/{job_id}", response_model=FinalizeJobResponse, status_code=status.HTTP_200_OK)
+async def finalize_job_status(job_id: str):
+    job = await get_finalize_job_async(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Finalize job '{job_id}' not found or expired.")
+    return job
@@ -1,7 +1,9 @@
 from fastapi import APIRouter, HTTPException, status
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any
-from app.workflows.normal_session import run_natural_session
+from app.utils.agent_guard import AgentUnavailable
+from app.utils.sse import sse_response
+from app.workflows.normal_session import run_natural_session_async, stream_natural_session_async
 
 router = APIRouter(prefix="/workflows/natural", tags=["workflows/natural"])
 
@@ -14,9 +16,23 @@ class NaturalRunResponse(BaseModel):
     answer: Optional[str] = None
 
 @router.post("/run", response_model=NaturalRunResponse, status_code=status.HTTP_200_OK)
-def run(req: NaturalRunRequest):
+async def run(req: NaturalRunRequest):
     try:
-        out = run_natural_session(session_id=req.session_id or "session_default", question=req.user_text)
+        out = await run_natural_session_async(session_id=req.session_id or "session_default", question=req.user_text)
         return {"status": "ok", "answer": out.get("answer")}
+    except AgentUnavailable:
+        raise  # 503 + Retry-After (handler em main.py)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Natural workflow failed: {e}")
+
+@router.post("/run/stream", status_code=status.HTTP_200_OK)
+async def run_stream(req: NaturalRunRequest):
+    # SSE: "delta" {"text"} conforme o agente responde, "done" depois de gravar o turno ("error" se cair no meio)
+    try:
+        return await sse_response(
+            stream_natural_session_async(session_id=req.session_id or "session_default", question=req.user_text)
+        )
+    except AgentUnavailable:
+        raise  # 503 + Retry-After (handler em main.py)
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"Natural workflow failed: {e}")
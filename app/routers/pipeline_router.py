@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException, status
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any
-from app.workflows.guardrails_runner import handle_user_message
+from app.utils.agent_guard import AgentUnavailable
+from app.workflows.guardrails_runner import handle_user_message_async
 
 router = APIRouter(prefix="/workflows/pipeline", tags=["workflows/pipeline"])
 
@@ -12,14 +13,16 @@ class PipelineMessageRequest(BaseModel):
     context: Optional[Dict[str, Any]] = None
 
 @router.post("/message", status_code=status.HTTP_200_OK)
-def message(req: PipelineMessageRequest):
+async def message(req: PipelineMessageRequest):
     try:
-        out = handle_user_message(
+        out = await handle_user_message_async(
             user_text=req.user_text,
             context=req.context or {},
             user_id=req.user_id,
             session_id=req.session_id,
         )
         return out
+    except AgentUnavailable:
+        raise  # 503 + Retry-After (handler em main.py)
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"Pipeline failed: {e}")
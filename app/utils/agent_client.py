@@ -1,35 +1,356 @@
 # app/utils/agent_client.py
-from typing import Any, Dict
+"""
+Cliente HTTP dos agentes: um pool keep-alive por agent_key, sync (requests) e async (httpx)
+com os mesmos timeouts, retries e erros (exceções do requests).
+"""
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+import asyncio
+import copy
+import hashlib
+import json
 import os
+import threading
+import time
+import httpx
 import requests
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from config import AGENT_URLS
+from app.utils.deadline import Deadline, DeadlineExceeded
+from app.utils.agent_guard import AgentGuard, get_guard
 
-AGENT_DEBUG   = os.getenv("AGENT_DEBUG", "0") == "1"
-AGENT_TIMEOUT = float(os.getenv("AGENT_TIMEOUT", "60"))
-
-_session = requests.Session()
-_retry = Retry(
-    total=5,
-    backoff_factor=0.8,
-    status_forcelist=[502, 503, 504],
-    allowed_methods=["GET", "POST"],
-    raise_on_status=False,
-)
-_adapter = HTTPAdapter(max_retries=_retry, pool_maxsize=10, pool_block=False)
-_session.mount("http://", _adapter)
-_session.mount("https://", _adapter)
-
-def post_agent(agent_key: str, payload: Dict[str, Any], timeout: float | None = None) -> Dict[str, Any]:
+AGENT_DEBUG           = os.getenv("AGENT_DEBUG", "0") == "1"
+AGENT_CONNECT_TIMEOUT = float(os.getenv("AGENT_CONNECT_TIMEOUT", "10"))
+AGENT_TIMEOUT         = float(os.getenv("AGENT_TIMEOUT", "120"))  # read timeout
+AGENT_RETRIES         = int(os.getenv("AGENT_RETRIES", "3"))
+AGENT_BACKOFF         = float(os.getenv("AGENT_BACKOFF", "0.8"))
+AGENT_POOL_SIZE       = int(os.getenv("AGENT_POOL_SIZE", "10"))
+# async: conexões simultâneas por agente (0 = sem teto); o keep-alive fica em AGENT_POOL_SIZE
+AGENT_ASYNC_MAX_CONNECTIONS = int(os.getenv("AGENT_ASYNC_MAX_CONNECTIONS", "0"))
+AGENT_COALESCE        = os.getenv("AGENT_COALESCE", "1") == "1"
+# com deadline: não tenta de novo se, depois do backoff, sobrar menos que isto para a tentativa
+AGENT_MIN_ATTEMPT_SECONDS = float(os.getenv("AGENT_MIN_ATTEMPT_SECONDS", "1"))
+
+_RETRY_STATUS = (429, 502, 503, 504)
+_OVERLOAD_STATUS = (429, 503)
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+_async_clients: Dict[str, httpx.AsyncClient] = {}
+
+# contador de chamadas do contexto atual (ex.: execução especulativa mede o que desperdiçou)
+_call_counter: ContextVar[Optional[Dict[str, int]]] = ContextVar("agent_call_counter", default=None)
+
+
+def count_agent_calls(counter: Dict[str, int]) -> None:
+    """A partir daqui, neste contexto (task/thread), cada chamada a agente soma 1 em counter["calls"]."""
+    _call_counter.set(counter)
+
+
+def _count_call() -> None:
+    counter = _call_counter.get()
+    if counter is not None:
+        counter["calls"] = counter.get("calls", 0) + 1
+
+
+def pool_size_for(agent_key: str) -> int:
+    """Tamanho do pool do agente: AGENT_POOL_SIZE_<KEY> (ex.: AGENT_POOL_SIZE_PLANNER) ou AGENT_POOL_SIZE."""
+    return int(os.getenv(f"AGENT_POOL_SIZE_{agent_key.upper()}", str(AGENT_POOL_SIZE)))
+
+
+def _build_session(agent_key: str) -> requests.Session:
+    # retries ficam no laço de _post_agent_once (não no urllib3): o deadline decide quantos cabem
+    size = pool_size_for(agent_key)
+    adapter = HTTPAdapter(max_retries=0, pool_connections=1, pool_maxsize=size, pool_block=False)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(agent_key: str) -> requests.Session:
+    """Session (pool keep-alive) dedicada ao agent_key; criada sob demanda e reaproveitada."""
+    session = _sessions.get(agent_key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(agent_key)
+            if session is None:
+                session = _build_session(agent_key)
+                _sessions[agent_key] = session
+    return session
+
+
+def close_sessions() -> None:
+    """Fecha todos os pools (shutdown do app)."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def get_async_client(agent_key: str) -> httpx.AsyncClient:
+    """
+    AsyncClient (pool keep-alive) dedicado ao agent_key, no event loop do app.
+    Guarda até pool_size_for conexões ociosas, mas não limita as em andamento (chamadas de LLM
+    ficam quase todo o tempo esperando): quem limita é o AdaptiveLimiter do agente.
+    """
+    client = _async_clients.get(agent_key)
+    if client is None or client.is_closed:
+        size = pool_size_for(agent_key)
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=AGENT_ASYNC_MAX_CONNECTIONS or None, max_keepalive_connections=size
+            ),
+            timeout=httpx.Timeout(AGENT_TIMEOUT, connect=AGENT_CONNECT_TIMEOUT),
+        )
+        _async_clients[agent_key] = client
+    return client
+
+
+async def close_async_clients() -> None:
+    """Fecha os pools async (shutdown do app)."""
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def _resolve_timeout(
+    timeout: float | Tuple[float, float] | None, deadline: Optional[Deadline] = None
+) -> Tuple[float, float]:
+    if timeout is None:
+        t = (AGENT_CONNECT_TIMEOUT, AGENT_TIMEOUT)
+    elif isinstance(timeout, tuple):
+        t = timeout
+    else:
+        t = (min(AGENT_CONNECT_TIMEOUT, timeout), timeout)
+    if deadline is not None:
+        left = deadline.remaining()
+        t = (min(t[0], left), min(t[1], left))
+    return t
+
+
+def _retry_delay(attempt: int, deadline: Optional[Deadline], guard: Optional[AgentGuard] = None) -> Optional[float]:
+    """
+    Backoff antes da próxima tentativa, ou None se não há mais retries: limite por chamada,
+    prazo, circuito que deixou de estar fechado ou balde de retries do agente vazio.
+    """
+    if attempt >= AGENT_RETRIES:
+        return None
+    delay = AGENT_BACKOFF * (2 ** attempt)
+    if deadline is not None and deadline.remaining() < delay + AGENT_MIN_ATTEMPT_SECONDS:
+        return None
+    if guard is not None and not guard.may_retry():
+        return None
+    return delay
+
+
+def _guard_for(agent_key: str, deadline: Optional[Deadline]) -> AgentGuard:
+    """Guard do agente com o circuito checado (falha rápido se aberto)."""
+    guard = get_guard(agent_key)
+    guard.check_circuit()
+    guard.retry_budget.deposit()
+    return guard
+
+
+def _record_response(guard: AgentGuard, status_code: int, latency: float) -> None:
+    guard.record(status_code < 500 and status_code != 429, latency, overloaded=status_code in _OVERLOAD_STATUS)
+
+
+def _agent_url(agent_key: str) -> str:
     url = AGENT_URLS.get(agent_key)
     if not url:
         raise ValueError(f"AGENT_URLS sem entrada para '{agent_key}'")
-    t = timeout or AGENT_TIMEOUT
-    headers = {"Connection": "close"}  # ngrok gosta disso
-    if AGENT_DEBUG:
-        print(f"[agent_client] POST {url} timeout={t} payload={payload}")
-    resp = _session.post(url, json=payload, timeout=t, headers=headers)
+    return url
+
+
+# =========================
+# Single-flight (coalescing de chamadas idênticas em andamento)
+# =========================
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _AsyncFlight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0  # chamadores aguardando; chegando a 0 com a task em curso, ela é cancelada
+
+
+_flights: Dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+_async_flights: Dict[str, _AsyncFlight] = {}
+_coalesce_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _flight_key(agent_key: str, payload: Dict[str, Any]) -> str:
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return f"{agent_key}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+
+def _count_flight(agent_key: str, saved: bool) -> None:
+    with _flights_lock:
+        st = _coalesce_stats.setdefault(agent_key, {"calls": 0, "saved": 0})
+        st["calls"] += 1
+        st["saved"] += int(saved)
+
+
+def coalesce_stats() -> Dict[str, Any]:
+    """Chamadas por agente e quantas foram atendidas por uma requisição já em andamento."""
+    with _flights_lock:
+        per_agent = {k: dict(v) for k, v in _coalesce_stats.items()}
+    calls = sum(v["calls"] for v in per_agent.values())
+    saved = sum(v["saved"] for v in per_agent.values())
+    return {
+        "enabled": AGENT_COALESCE,
+        "calls": calls,
+        "saved": saved,
+        "saved_rate": round(saved / calls, 3) if calls else None,
+        "agents": per_agent,
+    }
+
+
+def post_agent(
+    agent_key: str,
+    payload: Dict[str, Any],
+    timeout: float | Tuple[float, float] | None = None,
+    deadline: Optional[Deadline] = None,
+) -> Dict[str, Any]:
+    """
+    POST ao agente; com AGENT_COALESCE, chamadas idênticas simultâneas (agent_key + payload,
+    hash canônico) viram uma só. deadline: timeout de cada tentativa e retries saem do prazo
+    restante (estourado → DeadlineExceeded). Circuito aberto/sem vaga → AgentUnavailable
+    (app/utils/agent_guard.py), sem chamar o agente.
+    """
+    if not AGENT_COALESCE:
+        return _post_agent_once(agent_key, payload, timeout, deadline)
+    key = _flight_key(agent_key, payload)
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    _count_flight(agent_key, saved=not leader)
+    if leader:
+        try:
+            flight.result = _post_agent_once(agent_key, payload, timeout, deadline)
+        except BaseException as e:
+            flight.error = e
+        finally:
+            with _flights_lock:
+                _flights.pop(key, None)
+            flight.done.set()
+    elif not flight.done.wait(deadline.remaining() if deadline is not None else None):
+        # o seguidor espera no máximo o próprio prazo; o líder segue com o dele
+        raise DeadlineExceeded(f"Deadline exceeded waiting for in-flight '{agent_key}' call")
+    if flight.error is not None:
+        if not leader and _own_budget_left(flight.error, deadline):
+            return post_agent(agent_key, payload, timeout, deadline)
+        raise flight.error
+    return copy.deepcopy(flight.result)  # cada chamador recebe o seu (os workflows mutam o dict)
+
+
+async def post_agent_async(
+    agent_key: str,
+    payload: Dict[str, Any],
+    timeout: float | Tuple[float, float] | None = None,
+    deadline: Optional[Deadline] = None,
+) -> Dict[str, Any]:
+    """Versão async de post_agent (single-flight entre tasks do event loop)."""
+    if not AGENT_COALESCE:
+        return await _post_agent_once_async(agent_key, payload, timeout, deadline)
+    key = _flight_key(agent_key, payload)
+    flight = _async_flights.get(key)
+    leader = flight is None
+    _count_flight(agent_key, saved=not leader)
+    if leader:
+        # task própria: cancelar um chamador não cancela a requisição dos outros
+        flight = _async_flights[key] = _AsyncFlight(
+            asyncio.ensure_future(_post_agent_once_async(agent_key, payload, timeout, deadline))
+        )
+        flight.task.add_done_callback(lambda _t: _drop_async_flight(key, flight))
+    flight.waiters += 1
+    own_call = False
+    try:
+        if deadline is None:
+            result = await asyncio.shield(flight.task)
+        else:
+            result = await asyncio.wait_for(asyncio.shield(flight.task), deadline.remaining())
+    except asyncio.TimeoutError:
+        # o seguidor espera no máximo o próprio prazo; o líder segue com o dele
+        raise DeadlineExceeded(f"Deadline exceeded waiting for in-flight '{agent_key}' call") from None
+    except DeadlineExceeded as e:
+        if leader or not _own_budget_left(e, deadline):
+            raise
+        own_call = True
+    finally:
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.task.done():
+            # ninguém mais quer a resposta (ex.: especulação descartada): cancela a requisição,
+            # liberando a vaga do limiter e a conexão; uma chamada nova abre outro flight
+            _drop_async_flight(key, flight)
+            flight.task.cancel()
+    if own_call:
+        return await post_agent_async(agent_key, payload, timeout, deadline)
+    return copy.deepcopy(result)
+
+
+def _own_budget_left(error: BaseException, deadline: Optional[Deadline]) -> bool:
+    """O líder estourou o PRAZO DELE, e este seguidor ainda tem tempo: faz a própria chamada."""
+    return isinstance(error, DeadlineExceeded) and (deadline is None or not deadline.expired())
+
+
+def _drop_async_flight(key: str, flight: _AsyncFlight) -> None:
+    if _async_flights.get(key) is flight:
+        del _async_flights[key]
+
+
+def _post_agent_once(
+    agent_key: str,
+    payload: Dict[str, Any],
+    timeout: float | Tuple[float, float] | None = None,
+    deadline: Optional[Deadline] = None,
+) -> Dict[str, Any]:
+    """Uma chamada: retries em 429/502/503/504 e falhas de rede, com backoff exponencial."""
+    url = _agent_url(agent_key)
+    _count_call()
+    session = get_session(agent_key)
+    guard = _guard_for(agent_key, deadline)
+    guard.acquire(deadline.remaining() if deadline is not None else None)
+    try:
+        attempt = 0
+        while True:
+            if deadline is not None:
+                deadline.check(f"calling '{agent_key}'")
+            t = _resolve_timeout(timeout, deadline)
+            if AGENT_DEBUG:
+                print(f"[agent_client] POST {url} timeout={t} attempt={attempt} payload={payload}")
+            started = time.monotonic()
+            try:
+                resp = session.post(url, json=payload, timeout=t)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                guard.record(False, time.monotonic() - started, overloaded=isinstance(e, requests.Timeout))
+                delay = _retry_delay(attempt, deadline, guard)
+                if delay is None:
+                    raise
+            else:
+                _record_response(guard, resp.status_code, time.monotonic() - started)
+                delay = _retry_delay(attempt, deadline, guard) if resp.status_code in _RETRY_STATUS else None
+                if delay is None:
+                    break
+            time.sleep(delay)
+            attempt += 1
+    finally:
+        guard.release()
+
     if AGENT_DEBUG:
         print(f"[agent_client] <- {resp.status_code} {resp.text[:500]}")
     if 500 <= resp.status_code <= 599:
@@ -42,4 +363,168 @@ def post_agent(agent_key: str, payload: Dict[str, Any], timeout: float | None =
     except requests.HTTPError as e:
         # inclui corpo no erro para debug de 4xx (ex.: 422)
         raise requests.HTTPError(f"{e}\nResponse body: {resp.text}", response=resp) from e
-    return resp.json()
+    try:
+        return resp.json()
+    except ValueError:
+        print(f"[WARN] [agent_client] Resposta não-JSON de {url}: {resp.text[:500]}")
+        return {"raw": resp.text}
+
+
+async def _post_agent_once_async(
+    agent_key: str,
+    payload: Dict[str, Any],
+    timeout: float | Tuple[float, float] | None = None,
+    deadline: Optional[Deadline] = None,
+) -> Dict[str, Any]:
+    """Uma chamada async: mesmos timeouts, retries (429/502/503/504 e falhas de rede) e erros de post_agent."""
+    url = _agent_url(agent_key)
+    _count_call()
+    client = get_async_client(agent_key)
+    guard = _guard_for(agent_key, deadline)
+    await guard.acquire_async(deadline.remaining() if deadline is not None else None)
+    try:
+        attempt = 0
+        while True:
+            if deadline is not None:
+                deadline.check(f"calling '{agent_key}'")
+            connect_t, read_t = _resolve_timeout(timeout, deadline)
+            if AGENT_DEBUG:
+                print(f"[agent_client] POST(async) {url} timeout={(connect_t, read_t)} attempt={attempt} payload={payload}")
+            started = time.monotonic()
+            try:
+                resp = await client.post(url, json=payload, timeout=httpx.Timeout(read_t, connect=connect_t))
+            except httpx.TimeoutException as e:
+                guard.record(False, time.monotonic() - started, overloaded=True)
+                delay = _retry_delay(attempt, deadline, guard)
+                if delay is None:
+                    raise requests.Timeout(f"Timeout at {url}: {e}") from e
+            except httpx.TransportError as e:
+                guard.record(False, time.monotonic() - started)
+                delay = _retry_delay(attempt, deadline, guard)
+                if delay is None:
+                    raise requests.ConnectionError(f"Network failure at {url}: {e}") from e
+            else:
+                _record_response(guard, resp.status_code, time.monotonic() - started)
+                delay = _retry_delay(attempt, deadline, guard) if resp.status_code in _RETRY_STATUS else None
+                if delay is None:
+                    break
+            await asyncio.sleep(delay)
+            attempt += 1
+    finally:
+        guard.release()
+
+    if AGENT_DEBUG:
+        print(f"[agent_client] <- {resp.status_code} {resp.text[:500]}")
+    if 500 <= resp.status_code <= 599:
+        raise requests.HTTPError(f"{resp.status_code} Server Error at {url}\nResponse: {resp.text}")
+    if resp.status_code >= 400:
+        raise requests.HTTPError(f"{resp.status_code} Client Error at {url}\nResponse body: {resp.text}")
+    try:
+        return resp.json()
+    except ValueError:
+        print(f"[WARN] [agent_client] Resposta não-JSON de {url}: {resp.text[:500]}")
+        return {"raw": resp.text}
+
+
+# =========================
+# Streaming (async)
+# =========================
+
+# endpoint de stream que não existe/não aceita POST → mesma resposta, sem streaming
+_STREAM_UNSUPPORTED = (404, 405, 501)
+
+
+def _stream_delta(data: str) -> str:
+    """Texto de um evento `data:` do agente: JSON {"delta"|"text": ...} ou texto puro."""
+    try:
+        obj = json.loads(data)
+    except ValueError:
+        return data
+    if isinstance(obj, dict):
+        return str(obj.get("delta") or obj.get("text") or "")
+    return obj if isinstance(obj, str) else ""
+
+
+async def stream_agent_async(
+    agent_key: str,
+    payload: Dict[str, Any],
+    text_of: Callable[[Any], Optional[str]],
+    deadline: Optional[Deadline] = None,
+) -> AsyncIterator[str]:
+    """
+    Pedaços de texto da resposta do agente, conforme chegam. O endpoint de stream
+    (AGENT_URLS["<agent_key>_stream"]) pode responder text/event-stream
+    (`data: {"delta": "..."}` ... `data: [DONE]`) ou texto chunked puro.
+    Sem URL de stream (ou 404/405/501 nela): post_agent_async, e text_of(resposta) vira um pedaço só.
+    Sem retries depois que o stream começou (não dá para repetir o que já foi repassado).
+    """
+    url = AGENT_URLS.get(f"{agent_key}_stream")
+    if not url:
+        yield text_of(await post_agent_async(agent_key, payload, deadline=deadline)) or ""
+        return
+
+    _count_call()
+    client = get_async_client(agent_key)
+    guard = _guard_for(agent_key, deadline)
+    await guard.acquire_async(deadline.remaining() if deadline is not None else None)
+    unsupported = False
+    started: Optional[float] = None
+    sampled = False  # resultado já registrado no guard
+    try:
+        if deadline is not None:
+            deadline.check(f"streaming '{agent_key}'")
+        connect_t, read_t = _resolve_timeout(None, deadline)
+        if AGENT_DEBUG:
+            print(f"[agent_client] POST(stream) {url} timeout={(connect_t, read_t)} payload={payload}")
+        started = time.monotonic()
+        try:
+            async with client.stream(
+                "POST", url, json=payload, timeout=httpx.Timeout(read_t, connect=connect_t)
+            ) as resp:
+                if resp.status_code >= 400:
+                    _record_response(guard, resp.status_code, time.monotonic() - started)
+                    sampled = True
+                if resp.status_code in _STREAM_UNSUPPORTED:
+                    unsupported = True
+                elif resp.status_code >= 400:
+                    body = (await resp.aread()).decode("utf-8", "replace")
+                    raise requests.HTTPError(f"{resp.status_code} Error at {url}\nResponse: {body}")
+                elif resp.headers.get("content-type", "").startswith("text/event-stream"):
+                    async for line in resp.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        delta = _stream_delta(data)
+                        if delta:
+                            yield delta
+                        if deadline is not None:
+                            deadline.check(f"finishing '{agent_key}' stream")
+                else:
+                    async for chunk in resp.aiter_text():
+                        if chunk:
+                            yield chunk
+                        if deadline is not None:
+                            deadline.check(f"finishing '{agent_key}' stream")
+                if not sampled:
+                    # latência só com o corpo inteiro: o tempo até o 1º byte não é comparável às amostras de /ask
+                    _record_response(guard, resp.status_code, time.monotonic() - started)
+                    sampled = True
+        except httpx.TimeoutException as e:
+            sampled = True
+            guard.record(False, time.monotonic() - started, overloaded=True)
+            raise requests.Timeout(f"Timeout at {url}: {e}") from e
+        except httpx.TransportError as e:
+            sampled = True
+            guard.record(False, time.monotonic() - started)
+            raise requests.ConnectionError(f"Network failure at {url}: {e}") from e
+    finally:
+        if started is not None and not sampled:
+            # stream interrompido do nosso lado (cliente saiu, prazo): o agente respondeu, sem amostra de latência
+            guard.record(True, None)
+        guard.release()
+
+    if unsupported:
+        print(f"[WARN] [agent_client] {url} sem suporte a streaming, usando a chamada normal")
+        yield text_of(await post_agent_async(agent_key, payload, deadline=deadline)) or ""
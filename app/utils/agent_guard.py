@@ -0,0 +1,376 @@
+# app/utils/agent_guard.py
+"""
+Proteção por agente no caminho comum de chamadas (post_agent / post_agent_async):
+
+- CircuitBreaker: closed → open depois de AGENT_BREAKER_FAILURES falhas seguidas; aberto,
+  falha na hora (CircuitOpenError) por AGENT_BREAKER_OPEN_SECONDS; depois half-open deixa
+  passar AGENT_BREAKER_HALF_OPEN_PROBES sondas: sucesso fecha, falha reabre
+- AdaptiveLimiter: limite de chamadas em andamento (AIMD, até AGENT_CONCURRENCY_MAX): sobe devagar a cada resposta boa,
+  cai 10% quando o agente sinaliza sobrecarga (429/5xx/timeout) ou quando a mediana de uma
+  janela de AGENT_LIMITER_WINDOW respostas passa de AGENT_LATENCY_TOLERANCE × linha de base
+  (média lenta dessas medianas); sem vaga em AGENT_QUEUE_TIMEOUT → AgentOverloaded
+- RetryBudget: retries vêm de um balde por agente (cada chamada deposita
+  AGENT_RETRY_BUDGET_RATIO, cada retry gasta 1): em pane, as chamadas param de se multiplicar
+- agent_load(): latência p50/p95 das últimas AGENT_LATENCY_WINDOW tentativas e fila de espera
+  por vaga (usado pelo roteamento de modelos, app/utils/model_router.py)
+
+Falha = timeout, erro de rede, 429 ou 5xx; outros 4xx mostram que o agente está de pé.
+CircuitOpenError/AgentOverloaded são requests.ConnectionError (os workflows já tratam) e os
+routers devolvem 503.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import requests
+
+AGENT_BREAKER_FAILURES = int(os.getenv("AGENT_BREAKER_FAILURES", "5"))
+AGENT_BREAKER_OPEN_SECONDS = float(os.getenv("AGENT_BREAKER_OPEN_SECONDS", "30"))
+AGENT_BREAKER_HALF_OPEN_PROBES = int(os.getenv("AGENT_BREAKER_HALF_OPEN_PROBES", "1"))
+AGENT_CONCURRENCY_MIN = int(os.getenv("AGENT_CONCURRENCY_MIN", "1"))
+# teto do limiter (AGENT_CONCURRENCY_MAX_<KEY> sobrescreve); independente do pool HTTP
+AGENT_CONCURRENCY_MAX = int(os.getenv("AGENT_CONCURRENCY_MAX", "100"))
+AGENT_LATENCY_TOLERANCE = float(os.getenv("AGENT_LATENCY_TOLERANCE", "2.0"))
+AGENT_LIMITER_WINDOW = int(os.getenv("AGENT_LIMITER_WINDOW", "20"))
+AGENT_QUEUE_TIMEOUT = float(os.getenv("AGENT_QUEUE_TIMEOUT", "10"))
+AGENT_RETRY_BUDGET_RATIO = float(os.getenv("AGENT_RETRY_BUDGET_RATIO", "0.2"))
+AGENT_RETRY_BUDGET_MIN = float(os.getenv("AGENT_RETRY_BUDGET_MIN", "3"))
+AGENT_RETRY_BUDGET_MAX = float(os.getenv("AGENT_RETRY_BUDGET_MAX", "10"))
+AGENT_LATENCY_WINDOW = int(os.getenv("AGENT_LATENCY_WINDOW", "200"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class AgentUnavailable(requests.ConnectionError):
+    """O agente não foi chamado: circuito aberto ou sem vaga de concorrência."""
+
+    def __init__(self, message: str, agent_key: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.agent_key = agent_key
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(AgentUnavailable):
+    pass
+
+
+class AgentOverloaded(AgentUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        failures: int = AGENT_BREAKER_FAILURES,
+        open_seconds: float = AGENT_BREAKER_OPEN_SECONDS,
+        half_open_probes: int = AGENT_BREAKER_HALF_OPEN_PROBES,
+    ):
+        self.failures = max(1, failures)
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.state = CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+        self.counters = {"opened": 0, "rejected": 0}
+
+    def retry_after(self) -> float:
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        """True se a chamada pode seguir (em half-open, ocupa uma das sondas)."""
+        with self._lock:
+            if self.state != CLOSED and self.retry_after() <= 0:
+                # open → half-open; em half-open, sondas sem resposta há open_seconds
+                # (task cancelada, sem vaga no limiter) são liberadas de novo
+                self.state, self._probes, self._opened_at = HALF_OPEN, 0, time.monotonic()
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+            self.counters["rejected"] += 1
+            return False
+
+    def can_retry(self) -> bool:
+        return self.state == CLOSED
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._consecutive = 0
+            self.state = CLOSED
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._consecutive >= self.failures):
+                self.state, self._opened_at = OPEN, time.monotonic()
+                self.counters["opened"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self._consecutive, **self.counters}
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = AGENT_CONCURRENCY_MIN,
+        tolerance: float = AGENT_LATENCY_TOLERANCE,
+        window: int = AGENT_LIMITER_WINDOW,
+    ):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.tolerance = tolerance
+        self.window = max(1, window)
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.waiting = 0  # chamadas esperando vaga (profundidade da fila)
+        self.baseline: Optional[float] = None  # mediana de longo prazo (média lenta das medianas por janela)
+        self._window: List[float] = []
+        self._slow = False  # a última janela fechou lenta: sem aumentos até uma janela normal
+        self._cond = threading.Condition()
+        self.counters = {"rejected": 0, "decreases": 0}
+
+    def _try_acquire(self) -> bool:
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+        return False
+
+    def acquire(self, timeout: float) -> bool:
+        with self._cond:
+            if self._try_acquire():
+                return True
+            self.waiting += 1
+            try:
+                ok = self._cond.wait_for(self._try_acquire, timeout)
+            finally:
+                self.waiting -= 1
+            if not ok:
+                self.counters["rejected"] += 1
+            return ok
+
+    async def acquire_async(self, timeout: float) -> bool:
+        # o limite é compartilhado com threads (avaliação em background): espera por polling curto
+        end = time.monotonic() + timeout
+        delay = 0.005
+        with self._cond:
+            if self._try_acquire():
+                return True
+            self.waiting += 1
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.1)
+                with self._cond:
+                    if self._try_acquire():
+                        return True
+                    if time.monotonic() >= end:
+                        self.counters["rejected"] += 1
+                        return False
+        finally:
+            with self._cond:
+                self.waiting -= 1
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def _decrease(self) -> None:
+        self.limit = max(float(self.min_limit), self.limit * 0.9)
+        self.counters["decreases"] += 1
+
+    def _slow_window(self) -> bool:
+        """Fecha a janela: a mediana dela passou de tolerance × linha de base?"""
+        median = sorted(self._window)[len(self._window) // 2]
+        self._window.clear()
+        if self.baseline is None:
+            self.baseline = median
+            return False
+        slow = median > self.tolerance * self.baseline
+        # a base segue devagar (mais devagar ainda sob lentidão): uma mudança duradoura vira o novo normal
+        self.baseline += (median - self.baseline) * (0.05 if slow else 0.1)
+        return slow
+
+    def on_sample(self, latency: float, overloaded: bool = False) -> None:
+        """
+        Latência de uma resposta boa (ou sinal de sobrecarga) → ajusta o limite.
+        Uma resposta lenta sozinha não conta (a geração de LLM varia 5–10× sem sobrecarga):
+        só a mediana de uma janela inteira contra a linha de base.
+        """
+        with self._cond:
+            if overloaded:
+                self._decrease()
+                return
+            self._window.append(latency)
+            if len(self._window) >= self.window:
+                self._slow = self._slow_window()
+                if self._slow:
+                    self._decrease()
+            if not self._slow:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+                self._cond.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "baseline_latency": round(self.baseline, 3) if self.baseline is not None else None,
+            **self.counters,
+        }
+
+
+class RetryBudget:
+    def __init__(
+        self,
+        ratio: float = AGENT_RETRY_BUDGET_RATIO,
+        min_tokens: float = AGENT_RETRY_BUDGET_MIN,
+        max_tokens: float = AGENT_RETRY_BUDGET_MAX,
+    ):
+        self.ratio = ratio
+        self.max_tokens = max(max_tokens, min_tokens)
+        self.tokens = min_tokens
+        self._lock = threading.Lock()
+        self.counters = {"retries": 0, "denied": 0}
+
+    def deposit(self) -> None:
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.counters["retries"] += 1
+                return True
+            self.counters["denied"] += 1
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"tokens": round(self.tokens, 2), **self.counters}
+
+
+class AgentGuard:
+    def __init__(self, agent_key: str, max_concurrency: int):
+        self.agent_key = agent_key
+        self.breaker = CircuitBreaker()
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self.retry_budget = RetryBudget()
+        self.latencies: deque = deque(maxlen=AGENT_LATENCY_WINDOW)
+
+    def check_circuit(self) -> None:
+        if not self.breaker.allow():
+            wait = self.breaker.retry_after()
+            raise CircuitOpenError(
+                f"Agent '{self.agent_key}' unavailable: circuit open, retry in {wait:.0f}s",
+                self.agent_key, retry_after=wait,
+            )
+
+    def _queue_timeout(self, max_wait: Optional[float]) -> float:
+        return AGENT_QUEUE_TIMEOUT if max_wait is None else min(AGENT_QUEUE_TIMEOUT, max_wait)
+
+    def _overloaded(self) -> AgentOverloaded:
+        return AgentOverloaded(
+            f"Agent '{self.agent_key}' overloaded: {self.limiter.in_flight} calls in flight "
+            f"(limit {int(self.limiter.limit)})",
+            self.agent_key,
+        )
+
+    def acquire(self, max_wait: Optional[float] = None) -> None:
+        if not self.limiter.acquire(self._queue_timeout(max_wait)):
+            raise self._overloaded()
+
+    async def acquire_async(self, max_wait: Optional[float] = None) -> None:
+        if not await self.limiter.acquire_async(self._queue_timeout(max_wait)):
+            raise self._overloaded()
+
+    def release(self) -> None:
+        self.limiter.release()
+
+    def record(self, ok: bool, latency: Optional[float], overloaded: bool = False) -> None:
+        """
+        Resultado de UMA tentativa (ok = o agente respondeu sem sinal de pane).
+        latency=None: só o resultado, sem amostra (ex.: stream interrompido antes do fim).
+        """
+        if latency is not None and (ok or overloaded):  # timeouts/sobrecarga também são latência vista pelo cliente
+            self.latencies.append(latency)
+        if ok:
+            self.breaker.record_success()
+            if latency is not None:
+                self.limiter.on_sample(latency)
+        else:
+            self.breaker.record_failure()
+            if overloaded and latency is not None:
+                self.limiter.on_sample(latency, overloaded=True)
+
+    def may_retry(self) -> bool:
+        return self.breaker.can_retry() and self.retry_budget.withdraw()
+
+    def latency_percentile(self, p: float) -> Optional[float]:
+        samples = sorted(self.latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+
+    def load(self) -> Dict[str, Any]:
+        return {
+            "p50": self.latency_percentile(50),
+            "p95": self.latency_percentile(95),
+            "in_flight": self.limiter.in_flight,
+            "queue_depth": self.limiter.waiting,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        p50, p95 = self.latency_percentile(50), self.latency_percentile(95)
+        return {
+            "latency": {
+                "p50": round(p50, 3) if p50 is not None else None,
+                "p95": round(p95, 3) if p95 is not None else None,
+                "samples": len(self.latencies),
+            },
+            "circuit": self.breaker.stats(),
+            "concurrency": self.limiter.stats(),
+            "retry_budget": self.retry_budget.stats(),
+        }
+
+
+_guards: Dict[str, AgentGuard] = {}
+_guards_lock = threading.Lock()
+
+
+def concurrency_max_for(agent_key: str) -> int:
+    """Teto do limiter do agente: AGENT_CONCURRENCY_MAX_<KEY> (ex.: AGENT_CONCURRENCY_MAX_PLANNER) ou AGENT_CONCURRENCY_MAX."""
+    return int(os.getenv(f"AGENT_CONCURRENCY_MAX_{agent_key.upper()}", str(AGENT_CONCURRENCY_MAX)))
+
+
+def get_guard(agent_key: str, max_concurrency: Optional[int] = None) -> AgentGuard:
+    guard = _guards.get(agent_key)
+    if guard is None:
+        with _guards_lock:
+            guard = _guards.get(agent_key)
+            if guard is None:
+                guard = _guards[agent_key] = AgentGuard(
+                    agent_key, max_concurrency if max_concurrency is not None else concurrency_max_for(agent_key)
+                )
+    return guard
+
+
+def agent_load(agent_key: str) -> Dict[str, Any]:
+    """Carga atual do agente (p50/p95 em segundos, em andamento, fila); vazio se ainda não foi chamado."""
+    guard = _guards.get(agent_key)
+    if guard is None:
+        return {"p50": None, "p95": None, "in_flight": 0, "queue_depth": 0}
+    return guard.load()
+
+
+def guard_stats() -> Dict[str, Dict[str, Any]]:
+    """Estado do circuito, limite de concorrência e balde de retries de cada agente."""
+    return {key: guard.stats() for key, guard in list(_guards.items())}
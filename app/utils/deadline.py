@@ -0,0 +1,50 @@
+# app/utils/deadline.py
+"""
+Prazo total (deadline) de uma requisição, repartido entre as chamadas aos agentes.
+
+- Deadline.after(segundos) marca o fim absoluto (relógio monotônico)
+- share(fração) dá a um passo (ex.: planner) só parte do que resta, sem passar do prazo pai
+- post_agent/post_agent_async recebem deadline=...: timeout e retries de cada hop saem do restante
+- DeadlineExceeded é um requests.Timeout: quem já trata timeout de agente trata prazo estourado igual
+"""
+import time
+from typing import Optional
+
+import requests
+
+
+class DeadlineExceeded(requests.Timeout):
+    """O prazo total da requisição acabou antes (ou durante) a chamada."""
+
+
+class Deadline:
+    __slots__ = ("expires_at",)
+
+    def __init__(self, expires_at: float):
+        self.expires_at = expires_at
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        return cls(time.monotonic() + seconds)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def share(self, fraction: float) -> "Deadline":
+        """Sub-prazo com `fraction` do tempo restante (0 < fraction <= 1)."""
+        return Deadline(time.monotonic() + self.remaining() * fraction)
+
+    def check(self, what: str = "") -> None:
+        if self.expired():
+            raise DeadlineExceeded(f"Deadline exceeded{f' before {what}' if what else ''}")
+
+    def __repr__(self) -> str:
+        return f"Deadline(remaining={self.remaining():.3f}s)"
+
+
+def deadline_from(seconds: Optional[float]) -> Optional[Deadline]:
+    """Deadline para `seconds` (None/<=0 → sem prazo)."""
+    return Deadline.after(seconds) if seconds and seconds > 0 else None
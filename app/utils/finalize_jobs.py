@@ -0,0 +1,191 @@
+# app/utils/finalize_jobs.py
+"""
+Finalize em modo job (Redis Streams):
+
+- enqueue_finalize_job(_async): grava o job (hash) e publica no stream; devolve job_id na hora.
+  Um mesmo session_id em andamento devolve o MESMO job (retries do cliente não duplicam trabalho).
+- Workers (threads no processo da API e/ou `python -m app.utils.finalize_jobs`) consomem o stream
+  via consumer group, rodam finalize_session_with_plan e gravam o resultado no hash do job.
+- get_finalize_job(_async): status (queued/running/done/error) + resultado.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from app.redis_client import REDIS_URL, get_redis_client, get_async_redis_client
+
+FINALIZE_STREAM       = os.getenv("FINALIZE_STREAM", "finalize:jobs")
+FINALIZE_GROUP        = os.getenv("FINALIZE_GROUP", "finalize-workers")
+FINALIZE_WORKERS      = int(os.getenv("FINALIZE_WORKERS", "2"))  # threads por processo da API (0 = só worker externo)
+FINALIZE_JOB_TTL      = int(os.getenv("FINALIZE_JOB_TTL", "86400"))
+FINALIZE_CLAIM_IDLE_MS = int(os.getenv("FINALIZE_CLAIM_IDLE_MS", "600000"))  # reassume jobs de worker morto
+FINALIZE_STOP_TIMEOUT = float(os.getenv("FINALIZE_STOP_TIMEOUT", "5"))  # shutdown: espera as threads até isto (s)
+
+_stop = threading.Event()
+_threads: List[threading.Thread] = []
+
+
+def _job_key(job_id: str) -> str:
+    return f"finalize:job:{job_id}"
+
+
+def _session_job_key(session_id: str) -> str:
+    return f"finalize:session:{session_id}"
+
+
+def _decode_job(job_id: str, data: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    if not data:
+        return None
+    return {
+        "job_id": job_id,
+        "status": data.get("status"),
+        "session_id": data.get("session_id"),
+        "result": json.loads(data["result"]) if data.get("result") else None,
+        "error": data.get("error") or None,
+    }
+
+
+# =========================
+# API side
+# =========================
+
+# Dedupe + publicação num passo atômico: se a sessão já tem job, devolve o id dele; senão grava
+# sessão → job, o hash do job e publica no stream. (SET NX seguido de GET em duas idas podia
+# ver a chave sumir no meio e publicar um job sem a chave de dedupe.)
+# KEYS: sessão→job, hash do job, stream; ARGV: job_id, ttl, session_id, aluno_uuid
+_ENQUEUE_LUA = """
+local existing = redis.call('GET', KEYS[1])
+if existing then return existing end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('HSET', KEYS[2], 'status', 'queued', 'session_id', ARGV[3], 'aluno_uuid', ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+redis.call('XADD', KEYS[3], '*', 'job_id', ARGV[1], 'aluno_uuid', ARGV[4], 'session_id', ARGV[3])
+return ARGV[1]
+"""
+
+
+def _enqueue_args(aluno_uuid: str, session_id: str):
+    job_id = uuid.uuid4().hex
+    keys = [_session_job_key(session_id), _job_key(job_id), FINALIZE_STREAM]
+    return keys, [job_id, FINALIZE_JOB_TTL, session_id, aluno_uuid]
+
+
+def enqueue_finalize_job(aluno_uuid: str, session_id: str) -> str:
+    """Job do session_id (um já em andamento, se existir; retries do cliente não duplicam trabalho)."""
+    keys, args = _enqueue_args(aluno_uuid, session_id)
+    return get_redis_client().register_script(_ENQUEUE_LUA)(keys=keys, args=args)
+
+
+async def enqueue_finalize_job_async(aluno_uuid: str, session_id: str) -> str:
+    """Versão async de enqueue_finalize_job."""
+    keys, args = _enqueue_args(aluno_uuid, session_id)
+    return await get_async_redis_client().register_script(_ENQUEUE_LUA)(keys=keys, args=args)
+
+
+def get_finalize_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return _decode_job(job_id, get_redis_client().hgetall(_job_key(job_id)))
+
+
+async def get_finalize_job_async(job_id: str) -> Optional[Dict[str, Any]]:
+    return _decode_job(job_id, await get_async_redis_client().hgetall(_job_key(job_id)))
+
+
+# =========================
+# Worker side
+# =========================
+
+def _ensure_group(r) -> None:
+    try:
+        r.xgroup_create(FINALIZE_STREAM, FINALIZE_GROUP, id="0", mkstream=True)
+    except Exception as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _process(r, msg_id: str, fields: Dict[str, str]) -> None:
+    from app.workflows.class_session import finalize_session_with_plan
+
+    job_id = fields["job_id"]
+    session_id = fields["session_id"]
+    r.hset(_job_key(job_id), "status", "running")
+    try:
+        out = finalize_session_with_plan(aluno_uuid=fields["aluno_uuid"], session_id=session_id)
+        r.hset(_job_key(job_id), mapping={"status": "done", "result": json.dumps(out, ensure_ascii=False)})
+    except Exception as e:
+        print(f"[ERROR] Finalize job {job_id} failed: {e}")
+        r.hset(_job_key(job_id), mapping={"status": "error", "error": str(e)})
+    finally:
+        # libera o session_id para um novo finalize; o resultado segue no hash do job
+        r.delete(_session_job_key(session_id))
+        r.expire(_job_key(job_id), FINALIZE_JOB_TTL)
+        r.xack(FINALIZE_STREAM, FINALIZE_GROUP, msg_id)
+
+
+def run_worker(consumer: str, stop: threading.Event = _stop) -> None:
+    """
+    Loop de consumo do stream (bloqueante). Reassume jobs parados há FINALIZE_CLAIM_IDLE_MS.
+    Redis fora do ar (no boot ou depois) não derruba o worker: cliente e grupo são
+    (re)criados dentro do loop de retry.
+    """
+    r = None
+    while not stop.is_set():
+        try:
+            if r is None:
+                r = get_redis_client()
+                _ensure_group(r)  # o stream/grupo pode ter sumido (ex.: Redis reiniciado sem persistência)
+                print(f"[finalize_jobs] worker {consumer} up (stream={FINALIZE_STREAM})")
+            _, claimed, *_ = r.xautoclaim(
+                FINALIZE_STREAM, FINALIZE_GROUP, consumer, min_idle_time=FINALIZE_CLAIM_IDLE_MS, count=1
+            )
+            batch = [(FINALIZE_STREAM, claimed)] if claimed else r.xreadgroup(
+                FINALIZE_GROUP, consumer, {FINALIZE_STREAM: ">"}, count=1, block=2000  # < REDIS_SOCKET_TIMEOUT
+            )
+            for _stream, messages in batch or []:
+                for msg_id, fields in messages:
+                    if fields:
+                        _process(r, msg_id, fields)
+        except Exception as e:
+            print(f"[WARN] [finalize_jobs] worker {consumer} error: {e}")
+            r = None
+            stop.wait(1)
+
+
+def start_workers(n: int = FINALIZE_WORKERS) -> None:
+    """Sobe n threads de worker no processo atual (lifespan do app). Sem REDIS_URL, não sobe nenhuma."""
+    if n <= 0:
+        return
+    if not REDIS_URL:
+        print("[WARN] [finalize_jobs] REDIS_URL not set: finalize workers not started")
+        return
+    _stop.clear()
+    base = f"{socket.gethostname()}-{os.getpid()}"
+    for i in range(n):
+        t = threading.Thread(target=run_worker, args=(f"{base}-{i}",), name=f"finalize-worker-{i}", daemon=True)
+        t.start()
+        _threads.append(t)
+
+
+def stop_workers(timeout: float = FINALIZE_STOP_TIMEOUT) -> None:
+    """
+    Sinaliza as threads e espera até `timeout` segundos (no total) por elas.
+    Um job ainda rodando depois disso fica pendente no grupo e é reassumido por outro worker.
+    """
+    _stop.set()
+    end = time.monotonic() + timeout
+    for t in _threads:
+        t.join(max(0.0, end - time.monotonic()))
+        if t.is_alive():
+            print(f"[WARN] [finalize_jobs] {t.name} still running after {timeout}s (job will be reclaimed)")
+    _threads.clear()
+
+
+if __name__ == "__main__":
+    # worker dedicado: python -m app.utils.finalize_jobs
+    try:
+        run_worker(f"{socket.gethostname()}-{os.getpid()}")
+    except KeyboardInterrupt:
+        pass
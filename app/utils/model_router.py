@@ -0,0 +1,138 @@
+# app/utils/model_router.py
+"""
+Roteamento de modelo (model_name/temperature) para os payloads dos agentes.
+
+Cada builder de payload chama model_params(workflow, agent_key, texto_de_entrada):
+- BASE_MODELS: modelo/temperatura padrão por workflow (o que era fixo no código)
+- RULES, em ordem, a primeira que casar ganha; cada regra olha workflow, tamanho da
+  entrada (chars) e a carga do agente (p95 de latência e fila, ver agent_guard.agent_load)
+- padrão: sob sobrecarga (fila >= MODEL_ROUTING_QUEUE_DEPTH ou p95 >= MODEL_ROUTING_P95_SECONDS)
+  qualquer workflow vai para MODEL_ROUTING_FAST_MODEL
+
+Regras extras: MODEL_ROUTING_RULES_FILE → lista JSON de
+  {"name": ..., "model_name": ..., "temperature": <opcional>, "workflows": [<opcional>],
+   "min_input_chars": <opcional>, "max_input_chars": <opcional>,
+   "min_p95_seconds": <opcional>, "min_queue_depth": <opcional>}
+(avaliadas antes das padrão). Cada decisão é contada e as últimas ficam em routing_report().
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.utils.agent_guard import agent_load
+
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "1") == "1"
+MODEL_ROUTING_FAST_MODEL = os.getenv("MODEL_ROUTING_FAST_MODEL", "gemini-1.5-flash")
+MODEL_ROUTING_QUEUE_DEPTH = int(os.getenv("MODEL_ROUTING_QUEUE_DEPTH", "4"))
+MODEL_ROUTING_P95_SECONDS = float(os.getenv("MODEL_ROUTING_P95_SECONDS", "30"))
+MODEL_ROUTING_RULES_FILE = os.getenv("MODEL_ROUTING_RULES_FILE", "")
+MODEL_ROUTING_RECENT = int(os.getenv("MODEL_ROUTING_RECENT", "100"))
+
+# workflow → (model_name, temperature); temperature None = não enviada (padrão do agente)
+BASE_MODELS: Dict[str, Tuple[str, Optional[float]]] = {
+    "class_lite_plan":    ("gemini-1.5-flash", 0.2),
+    "class_teacher":      ("gemini-1.5-flash", 0.4),
+    "class_compact_plan": ("gemini-1.5-flash", 0.2),
+    "schema_eval":        ("gemini-1.5-flash", 0.2),
+    "natural":            ("gemini-1.5-flash", 0.4),
+    "lesson_plan":        ("gemini-2.5-pro", None),
+}
+
+
+@dataclass
+class RoutingRule:
+    name: str
+    model_name: str
+    temperature: Optional[float] = None           # None = mantém a do workflow
+    workflows: Optional[Sequence[str]] = None     # None = todos
+    min_input_chars: int = 0
+    max_input_chars: Optional[int] = None
+    min_p95_seconds: Optional[float] = None
+    min_queue_depth: Optional[int] = None
+
+    def matches(self, workflow: str, input_chars: int, load: Dict[str, Any]) -> bool:
+        if self.workflows is not None and workflow not in self.workflows:
+            return False
+        if input_chars < self.min_input_chars:
+            return False
+        if self.max_input_chars is not None and input_chars > self.max_input_chars:
+            return False
+        if self.min_p95_seconds is not None and (load["p95"] is None or load["p95"] < self.min_p95_seconds):
+            return False
+        if self.min_queue_depth is not None and load["queue_depth"] < self.min_queue_depth:
+            return False
+        return True
+
+
+DEFAULT_RULES: List[RoutingRule] = [
+    RoutingRule("queue_overload", MODEL_ROUTING_FAST_MODEL, min_queue_depth=MODEL_ROUTING_QUEUE_DEPTH),
+    RoutingRule("latency_overload", MODEL_ROUTING_FAST_MODEL, min_p95_seconds=MODEL_ROUTING_P95_SECONDS),
+]
+
+
+def _load_rules() -> List[RoutingRule]:
+    rules: List[RoutingRule] = []
+    if MODEL_ROUTING_RULES_FILE:
+        with open(MODEL_ROUTING_RULES_FILE, encoding="utf-8") as f:
+            rules = [RoutingRule(**r) for r in json.load(f)]
+    return rules + DEFAULT_RULES
+
+
+RULES = _load_rules()
+
+_decisions: Dict[str, Dict[str, int]] = {}
+_recent: deque = deque(maxlen=MODEL_ROUTING_RECENT)
+_decisions_lock = threading.Lock()
+
+
+def _record(workflow: str, agent_key: str, input_chars: int, load: Dict[str, Any], rule: str, model: str, temperature) -> None:
+    with _decisions_lock:
+        per_wf = _decisions.setdefault(workflow, {})
+        label = f"{model} ({rule})"
+        per_wf[label] = per_wf.get(label, 0) + 1
+        _recent.append({
+            "ts": time.time(),
+            "workflow": workflow,
+            "agent": agent_key,
+            "input_chars": input_chars,
+            "p95": load["p95"],
+            "queue_depth": load["queue_depth"],
+            "rule": rule,
+            "model_name": model,
+            "temperature": temperature,
+        })
+
+
+def model_params(workflow: str, agent_key: str, input_text: str = "") -> Dict[str, Any]:
+    """{"model_name", "temperature"?} para o payload do workflow, conforme as regras e a carga do agente."""
+    model, temperature = BASE_MODELS[workflow]
+    input_chars = len(input_text or "")
+    load = agent_load(agent_key)
+    rule = "base"
+    if MODEL_ROUTING:
+        for r in RULES:
+            if r.matches(workflow, input_chars, load):
+                model = r.model_name
+                temperature = r.temperature if r.temperature is not None else temperature
+                rule = r.name
+                break
+    _record(workflow, agent_key, input_chars, load, rule, model, temperature)
+    params: Dict[str, Any] = {"model_name": model}
+    if temperature is not None:
+        params["temperature"] = temperature
+    return params
+
+
+def routing_report() -> Dict[str, Any]:
+    """Decisões por workflow ("modelo (regra)": n) e as últimas decisões com a carga vista."""
+    with _decisions_lock:
+        return {
+            "enabled": MODEL_ROUTING,
+            "rules": [r.name for r in RULES],
+            "decisions": {wf: dict(c) for wf, c in _decisions.items()},
+            "recent": list(_recent),
+        }
@@ -0,0 +1,798 @@
+# app/utils/session_backends.py
+"""
+Backends do histórico de sessão (usados por app.utils.session_store).
+
+Todos implementam SessionBackend; as entradas têm ids opacos e crescentes
+(lista/memória: número de sequência absoluto; stream: id do XADD), então um leitor
+pode pedir só o que veio depois do último id que viu (cursores por consumidor).
+
+- RedisListBackend    → lista session:<id> (RPUSH/LRANGE)
+- RedisStreamBackend  → stream session:<id>:stream (XADD/XRANGE)
+- MemoryBackend       → dict no processo, LRU/TTL + teto de memória (um nó só, testes, benchmarks)
+
+Nos backends Redis, os metadados (bytes, resumo de compactação, avaliações parciais,
+cursores, lock) ficam em chaves ao lado da sessão, iguais para lista e stream.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.redis_client import get_redis_client, get_async_redis_client
+from app.utils.session_batch import flatten_text
+from app.utils.session_codec import encode_entry, decode_entry
+
+# Limites do histórico (por sessão). Ao passar do limite, turnos antigos são
+# compactados num resumo (hash :summary) em vez de descartados.
+SESSION_MAX_ENTRIES   = int(os.getenv("SESSION_MAX_ENTRIES", "200"))
+SESSION_MAX_BYTES     = int(os.getenv("SESSION_MAX_BYTES", "262144"))
+SESSION_TTL_SECONDS   = int(os.getenv("SESSION_TTL_SECONDS", "7200"))   # TTL deslizante (renovado a cada escrita)
+SESSION_SUMMARY_CHARS = int(os.getenv("SESSION_SUMMARY_CHARS", "2000"))
+
+# avaliações parciais (schema_creator em background) guardadas ao lado da sessão
+EVALS_TTL_SECONDS = int(os.getenv("SESSION_EVALS_TTL", str(SESSION_TTL_SECONDS)))
+
+# backend "memory": teto de memória do processo (entradas codificadas); acima dele, LRU por sessão
+SESSION_MEMORY_MAX_BYTES = int(os.getenv("SESSION_MEMORY_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# lock por sessão (avaliação incremental, compactação, finalize): expira sozinho se o dono morrer;
+# quem segura renova a cada lote avaliado (refresh_lock)
+SESSION_LOCK_TTL = int(os.getenv("SESSION_LOCK_TTL", "300"))
+
+EVAL_CONSUMER = "schema_eval"  # cursor da avaliação incremental
+
+Entry = Dict[str, Any]
+IdEntry = Tuple[str, Entry]
+
+# scripts Lua registrados por cliente (sync/async, texto/binário): EVALSHA, com SCRIPT LOAD só no NOSCRIPT
+_scripts: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _script(client, source: str):
+    """Script registrado uma vez por cliente (register_script); chamar com keys=/args=."""
+    per_client = _scripts.setdefault(client, {})
+    script = per_client.get(source)
+    if script is None:
+        script = per_client[source] = client.register_script(source)
+    return script
+
+
+def id_order(entry_id: str) -> Tuple[int, ...]:
+    """Chave de ordenação de ids ("17" da lista, "1700000000000-3" do stream)."""
+    return tuple(int(p) for p in str(entry_id).split("-"))
+
+
+# =========================
+# Compactação (puro, sem I/O)
+# =========================
+
+def over_cap(length: int, size: int, max_len: Optional[int]) -> bool:
+    return length > (max_len or SESSION_MAX_ENTRIES) or size > SESSION_MAX_BYTES
+
+
+def plan_compaction(sizes: List[int], length: int, size: int, max_len: Optional[int]) -> int:
+    """
+    sizes: bytes de cada entrada, do início do histórico.
+    Quantas entradas do início remover para voltar a ~metade dos limites
+    (histerese: não compacta a cada escrita).
+    """
+    target_len = (max_len or SESSION_MAX_ENTRIES) // 2
+    target_bytes = SESSION_MAX_BYTES // 2
+    drop = 0
+    for n in sizes:
+        if length - drop <= target_len and size <= target_bytes:
+            break
+        size -= n
+        drop += 1
+    return drop
+
+
+def fold_summary(summary: Dict[str, str], dropped: List[IdEntry], cursor: Optional[str]) -> Dict[str, str]:
+    """
+    Dobra as entradas removidas no resumo:
+      - summary: últimas falas do usuário (achatadas), limitado a SESSION_SUMMARY_CHARS
+      - pending_user_text: falas do usuário ainda NÃO avaliadas (após o cursor) — finalize/incremental avaliam depois
+      - compacted_entries: total de entradas compactadas
+    """
+    def _is_user(m: Entry) -> bool:
+        return (m.get("role") or "").lower() == "user" and bool((m.get("content") or "").strip())
+
+    done = id_order(cursor) if cursor else None
+    user_texts = [flatten_text(m["content"]) for _, m in dropped if _is_user(m)]
+    pending = [
+        flatten_text(m["content"])
+        for eid, m in dropped
+        if _is_user(m) and (done is None or id_order(eid) > done)
+    ]
+    rolling = " | ".join(t for t in [summary.get("summary", "")] + user_texts if t)
+    pending_text = "\n".join(t for t in [summary.get("pending_user_text", "")] + pending if t)
+    return {
+        "summary": rolling[-SESSION_SUMMARY_CHARS:],
+        "pending_user_text": pending_text,
+        "compacted_entries": str(int(summary.get("compacted_entries") or 0) + len(dropped)),
+    }
+
+
+# =========================
+# Interface
+# =========================
+
+class SessionBackend:
+    """
+    Interface dos backends. As versões *_async default chamam as síncronas
+    (backends sem I/O); os backends Redis sobrescrevem com redis.asyncio.
+    """
+    name = ""
+
+    def append(self, session_id: str, messages: List[Entry], max_len: Optional[int] = None,
+               ttl_seconds: Optional[int] = None, compact: bool = True) -> None:
+        """compact=False: só mantém as últimas max_len entradas (janela), sem resumo nem contagem de bytes."""
+        raise NotImplementedError
+
+    def read(self, session_id: str, after: Optional[str] = None, count: Optional[int] = None) -> List[IdEntry]:
+        raise NotImplementedError
+
+    def compact(self, session_id: str, max_len: Optional[int] = None) -> int:
+        raise NotImplementedError
+
+    def summary(self, session_id: str) -> Dict[str, str]:
+        raise NotImplementedError
+
+    def partial_evals(self, session_id: str) -> Tuple[Optional[str], List[Dict[str, str]]]:
+        raise NotImplementedError
+
+    def append_partial_evals(self, session_id: str, evals: List[Dict[str, str]], cursor: Optional[str],
+                             clear_pending: bool = False, lock_token: Optional[str] = None) -> bool:
+        """
+        False (nada gravado) se a sessão não existe mais (finalizada/expirada) ou,
+        com lock_token, se o lock da sessão não é mais deste dono.
+        """
+        raise NotImplementedError
+
+    def get_cursor(self, session_id: str, consumer: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set_cursor(self, session_id: str, consumer: str, entry_id: str) -> None:
+        raise NotImplementedError
+
+    def acquire_lock(self, session_id: str, ttl_seconds: int = SESSION_LOCK_TTL) -> Optional[str]:
+        """Token do dono (aleatório) se obteve o lock; None se já está ocupado."""
+        raise NotImplementedError
+
+    def refresh_lock(self, session_id: str, token: str, ttl_seconds: int = SESSION_LOCK_TTL) -> bool:
+        """Renova o TTL se o lock ainda é deste dono; False = perdido (expirou e outro pegou)."""
+        raise NotImplementedError
+
+    def release_lock(self, session_id: str, token: str) -> None:
+        """Solta o lock só se ainda é deste dono (compare-and-delete)."""
+        raise NotImplementedError
+
+    def clear(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    async def append_async(self, session_id: str, messages: List[Entry], max_len: Optional[int] = None,
+                           ttl_seconds: Optional[int] = None, compact: bool = True) -> None:
+        self.append(session_id, messages, max_len, ttl_seconds, compact)
+
+    async def read_async(self, session_id: str, after: Optional[str] = None,
+                         count: Optional[int] = None) -> List[IdEntry]:
+        return self.read(session_id, after, count)
+
+    async def summary_async(self, session_id: str) -> Dict[str, str]:
+        return self.summary(session_id)
+
+    async def partial_evals_async(self, session_id: str) -> Tuple[Optional[str], List[Dict[str, str]]]:
+        return self.partial_evals(session_id)
+
+    async def get_cursor_async(self, session_id: str, consumer: str) -> Optional[str]:
+        return self.get_cursor(session_id, consumer)
+
+    async def set_cursor_async(self, session_id: str, consumer: str, entry_id: str) -> None:
+        self.set_cursor(session_id, consumer, entry_id)
+
+    async def acquire_lock_async(self, session_id: str, ttl_seconds: int = SESSION_LOCK_TTL) -> Optional[str]:
+        return self.acquire_lock(session_id, ttl_seconds)
+
+    async def refresh_lock_async(self, session_id: str, token: str, ttl_seconds: int = SESSION_LOCK_TTL) -> bool:
+        return self.refresh_lock(session_id, token, ttl_seconds)
+
+    async def release_lock_async(self, session_id: str, token: str) -> None:
+        self.release_lock(session_id, token)
+
+    async def clear_async(self, session_id: str) -> None:
+        self.clear(session_id)
+
+
+# =========================
+# Base Redis (metadados compartilhados)
+# =========================
+
+# Avaliações parciais + cursor num round trip, só se o histórico (KEYS[1]) ainda existe
+# e, com token, se o lock (KEYS[5]) ainda é do chamador.
+# KEYS: histórico, evals, resumo, cursores, lock
+# ARGV: ttl, cursor ("" = mantém), clear_pending, consumidor, token ("" = sem checar), evals...
+_APPEND_EVALS_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+if ARGV[5] ~= '' and redis.call('GET', KEYS[5]) ~= ARGV[5] then return 0 end
+if #ARGV > 5 then redis.call('RPUSH', KEYS[2], unpack(ARGV, 6)) end
+if ARGV[3] == '1' then redis.call('HDEL', KEYS[3], 'pending_user_text') end
+if ARGV[2] ~= '' then redis.call('HSET', KEYS[4], ARGV[4], ARGV[2]) end
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[4], ARGV[1])
+return 1
+"""
+
+# Lock com dono: só quem tem o token renova (KEYS: lock; ARGV: token, ttl) ou solta (ARGV: token)
+_REFRESH_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('EXPIRE', KEYS[1], ARGV[2]) end
+return 0
+"""
+_RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+class _RedisBackendBase(SessionBackend):
+    name = "redis"
+
+    # ---- chaves ----
+    def history_key(self, session_id: str) -> str:
+        return f"session:{session_id}"
+
+    def _evals_key(self, session_id: str) -> str:
+        return f"session:{session_id}:evals"
+
+    def _cursors_key(self, session_id: str) -> str:
+        return f"session:{session_id}:cursors"
+
+    def _lock_key(self, session_id: str) -> str:
+        return f"session:{session_id}:eval_lock"
+
+    def _bytes_key(self, session_id: str) -> str:
+        return f"session:{session_id}:bytes"
+
+    def _summary_key(self, session_id: str) -> str:
+        return f"session:{session_id}:summary"
+
+    def _sliding_keys(self, session_id: str) -> List[str]:
+        # tudo que vive junto com a sessão expira junto (o lock tem TTL próprio)
+        return [
+            self.history_key(session_id), self._evals_key(session_id), self._cursors_key(session_id),
+            self._bytes_key(session_id), self._summary_key(session_id),
+        ]
+
+    def _all_keys(self, session_id: str) -> List[str]:
+        return self._sliding_keys(session_id) + [self._lock_key(session_id)]
+
+    # ---- escrita ----
+    def _queue_append(self, pipe, session_id: str, encoded: List[bytes]) -> int:
+        """
+        Enfileira a escrita das entradas; o ÚLTIMO comando deve devolver o tamanho
+        do histórico. Retorna quantos comandos foram enfileirados.
+        """
+        raise NotImplementedError
+
+    def _queue_write(self, pipe, session_id: str, encoded: List[bytes], ttl_seconds: Optional[int]) -> int:
+        """INCRBY bytes + append + TTL deslizante; resultados [0]=bytes. Retorna o índice do tamanho."""
+        pipe.incrby(self._bytes_key(session_id), sum(len(e) for e in encoded))
+        queued = self._queue_append(pipe, session_id, encoded)
+        ttl = ttl_seconds or SESSION_TTL_SECONDS
+        if ttl:
+            for key in self._sliding_keys(session_id):
+                pipe.expire(key, ttl)
+        return queued
+
+    def _queue_window(self, client, session_id: str, encoded: List[bytes], max_len: int, ttl: int):
+        """
+        Append + corte para as últimas max_len entradas + EXPIRE, num round trip.
+        Devolve o resultado do cliente (awaitable no cliente async).
+        """
+        raise NotImplementedError
+
+    def append(self, session_id: str, messages: List[Entry], max_len: Optional[int] = None,
+               ttl_seconds: Optional[int] = None, compact: bool = True) -> None:
+        encoded = [encode_entry(m["role"], m.get("content"), m.get("extra")) for m in messages]
+        if not compact:
+            self._queue_window(get_redis_client(binary=True), session_id, encoded,
+                               max_len or SESSION_MAX_ENTRIES, ttl_seconds or SESSION_TTL_SECONDS)
+            return
+        pipe = get_redis_client(binary=True).pipeline(transaction=True)
+        length_idx = self._queue_write(pipe, session_id, encoded, ttl_seconds)
+        results = pipe.execute()
+        if over_cap(int(results[length_idx]), int(results[0]), max_len):
+            self.compact(session_id, max_len)
+
+    async def append_async(self, session_id: str, messages: List[Entry], max_len: Optional[int] = None,
+                           ttl_seconds: Optional[int] = None, compact: bool = True) -> None:
+        encoded = [encode_entry(m["role"], m.get("content"), m.get("extra")) for m in messages]
+        if not compact:
+            await self._queue_window(get_async_redis_client(binary=True), session_id, encoded,
+                                     max_len or SESSION_MAX_ENTRIES, ttl_seconds or SESSION_TTL_SECONDS)
+            return
+        pipe = get_async_redis_client(binary=True).pipeline(transaction=True)
+        length_idx = self._queue_write(pipe, session_id, encoded, ttl_seconds)
+        results = await pipe.execute()
+        if over_cap(int(results[length_idx]), int(results[0]), max_len):
+            # compactação (rara) roda fora do event loop
+            await asyncio.to_thread(self.compact, session_id, max_len)
+
+    # ---- compactação ----
+    def _head(self, session_id: str, length: int) -> List[Tuple[str, bytes]]:
+        raise NotImplementedError
+
+    def _queue_drop(self, pipe, session_id: str, dropped: List[Tuple[str, bytes]]) -> None:
+        raise NotImplementedError
+
+    def _length(self, pipe, session_id: str) -> None:
+        raise NotImplementedError
+
+    def compact(self, session_id: str, max_len: Optional[int] = None) -> int:
+        """
+        Move os turnos mais antigos do histórico para o resumo da sessão.
+        Usa o mesmo lock da avaliação incremental; se estiver ocupado, tenta de novo
+        na próxima escrita. Retorna quantas entradas foram compactadas.
+        """
+        token = self.acquire_lock(session_id)
+        if not token:
+            return 0
+        try:
+            r = get_redis_client()
+            pipe = r.pipeline(transaction=False)
+            self._length(pipe, session_id)
+            pipe.get(self._bytes_key(session_id))
+            pipe.hget(self._cursors_key(session_id), EVAL_CONSUMER)
+            pipe.hgetall(self._summary_key(session_id))
+            length, size, cursor, summary = pipe.execute()
+            length, size = int(length or 0), int(size or 0)
+            if not over_cap(length, size, max_len):
+                return 0
+
+            # escritas concorrentes só mexem no fim: o início segue estável
+            head = self._head(session_id, length)
+            drop = plan_compaction([len(raw) for _, raw in head], length, size, max_len)
+            if drop <= 0:
+                return 0
+            dropped = head[:drop]
+            new_summary = fold_summary(summary, [(eid, decode_entry(raw)) for eid, raw in dropped], cursor)
+
+            pipe = r.pipeline(transaction=True)
+            self._queue_drop(pipe, session_id, dropped)
+            pipe.decrby(self._bytes_key(session_id), sum(len(raw) for _, raw in dropped))
+            pipe.hset(self._summary_key(session_id), mapping=new_summary)
+            for k in self._sliding_keys(session_id):
+                pipe.expire(k, SESSION_TTL_SECONDS)
+            pipe.execute()
+            print(f"[DEBUG] Compacted session={session_id} entries={drop}")
+            return drop
+        finally:
+            self.release_lock(session_id, token)
+
+    # ---- resumo / avaliações parciais / cursores ----
+    def summary(self, session_id: str) -> Dict[str, str]:
+        return get_redis_client().hgetall(self._summary_key(session_id)) or {}
+
+    async def summary_async(self, session_id: str) -> Dict[str, str]:
+        return await get_async_redis_client().hgetall(self._summary_key(session_id)) or {}
+
+    def partial_evals(self, session_id: str) -> Tuple[Optional[str], List[Dict[str, str]]]:
+        pipe = get_redis_client().pipeline(transaction=False)
+        pipe.hget(self._cursors_key(session_id), EVAL_CONSUMER)
+        pipe.lrange(self._evals_key(session_id), 0, -1)
+        cursor, evals = pipe.execute()
+        return cursor, [json.loads(e) for e in evals]
+
+    async def partial_evals_async(self, session_id: str) -> Tuple[Optional[str], List[Dict[str, str]]]:
+        pipe = get_async_redis_client().pipeline(transaction=False)
+        pipe.hget(self._cursors_key(session_id), EVAL_CONSUMER)
+        pipe.lrange(self._evals_key(session_id), 0, -1)
+        cursor, evals = await pipe.execute()
+        return cursor, [json.loads(e) for e in evals]
+
+    def append_partial_evals(self, session_id: str, evals: List[Dict[str, str]], cursor: Optional[str],
+                             clear_pending: bool = False, lock_token: Optional[str] = None) -> bool:
+        # só grava se o histórico ainda existe: uma avaliação em andamento quando a sessão foi
+        # finalizada não recria avaliações/cursor para a próxima sessão com o mesmo id
+        keys = [
+            self.history_key(session_id), self._evals_key(session_id),
+            self._summary_key(session_id), self._cursors_key(session_id), self._lock_key(session_id),
+        ]
+        args = [EVALS_TTL_SECONDS, cursor or "", "1" if clear_pending else "0", EVAL_CONSUMER, lock_token or ""]
+        args += [json.dumps(e) for e in evals]
+        return bool(_script(get_redis_client(), _APPEND_EVALS_LUA)(keys=keys, args=args))
+
+    def get_cursor(self, session_id: str, consumer: str) -> Optional[str]:
+        return get_redis_client().hget(self._cursors_key(session_id), consumer)
+
+    def set_cursor(self, session_id: str, consumer: str, entry_id: str) -> None:
+        pipe = get_redis_client().pipeline(transaction=True)
+        pipe.hset(self._cursors_key(session_id), consumer, entry_id)
+        pipe.expire(self._cursors_key(session_id), SESSION_TTL_SECONDS)
+        pipe.execute()
+
+    async def get_cursor_async(self, session_id: str, consumer: str) -> Optional[str]:
+        return await get_async_redis_client().hget(self._cursors_key(session_id), consumer)
+
+    async def set_cursor_async(self, session_id: str, consumer: str, entry_id: str) -> None:
+        pipe = get_async_redis_client().pipeline(transaction=True)
+        pipe.hset(self._cursors_key(session_id), consumer, entry_id)
+        pipe.expire(self._cursors_key(session_id), SESSION_TTL_SECONDS)
+        await pipe.execute()
+
+    # ---- lock / limpeza ----
+    def acquire_lock(self, session_id: str, ttl_seconds: int = SESSION_LOCK_TTL) -> Optional[str]:
+        token = uuid.uuid4().hex
+        return token if get_redis_client().set(self._lock_key(session_id), token, nx=True, ex=ttl_seconds) else None
+
+    async def acquire_lock_async(self, session_id: str, ttl_seconds: int = SESSION_LOCK_TTL) -> Optional[str]:
+        token = uuid.uuid4().hex
+        ok = await get_async_redis_client().set(self._lock_key(session_id), token, nx=True, ex=ttl_seconds)
+        return token if ok else None
+
+    def refresh_lock(self, session_id: str, token: str, ttl_seconds: int = SESSION_LOCK_TTL) -> bool:
+        r = get_redis_client()
+        return bool(_script(r, _REFRESH_LOCK_LUA)(keys=[self._lock_key(session_id)], args=[token, ttl_seconds]))
+
+    async def refresh_lock_async(self, session_id: str, token: str, ttl_seconds: int = SESSION_LOCK_TTL) -> bool:
+        r = get_async_redis_client()
+        return bool(await _script(r, _REFRESH_LOCK_LUA)(keys=[self._lock_key(session_id)], args=[token, ttl_seconds]))
+
+    def release_lock(self, session_id: str, token: str) -> None:
+        _script(get_redis_client(), _RELEASE_LOCK_LUA)(keys=[self._lock_key(session_id)], args=[token])
+
+    async def release_lock_async(self, session_id: str, token: str) -> None:
+        await _script(get_async_redis_client(), _RELEASE_LOCK_LUA)(keys=[self._lock_key(session_id)], args=[token])
+
+    def clear(self, session_id: str) -> None:
+        get_redis_client().delete(*self._all_keys(session_id))
+
+    async def clear_async(self, session_id: str) -> None:
+        await get_async_redis_client().delete(*self._all_keys(session_id))
+
+
+# =========================
+# Lista (RPUSH/LRANGE)
+# =========================
+
+# Lê a partir de um número de sequência absoluto num único round trip:
+# seq = compacted_entries + índice na lista (estável mesmo após LTRIM da compactação).
+_LIST_READ_LUA = """
+local off = tonumber(redis.call('HGET', KEYS[2], 'compacted_entries') or '0')
+local start = tonumber(ARGV[1]) - off
+if start < 0 then start = 0 end
+local stop = -1
+if tonumber(ARGV[2]) > 0 then stop = start + tonumber(ARGV[2]) - 1 end
+return {off + start, redis.call('LRANGE', KEYS[1], start, stop)}
+"""
+
+# Janela fixa (compact=False): RPUSH + LTRIM das mais antigas + EXPIRE; as descartadas
+# somam em compacted_entries para os ids (seq) continuarem estáveis.
+# KEYS: histórico, resumo; ARGV: max_len, ttl, entradas...
+_LIST_WINDOW_LUA = """
+local n = redis.call('RPUSH', KEYS[1], unpack(ARGV, 3))
+local drop = n - tonumber(ARGV[1])
+if drop > 0 then
+  redis.call('LTRIM', KEYS[1], drop, -1)
+  redis.call('HINCRBY', KEYS[2], 'compacted_entries', drop)
+  redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return n - math.max(drop, 0)
+"""
+
+
+class RedisListBackend(_RedisBackendBase):
+    name = "redis"
+
+    def _queue_append(self, pipe, session_id: str, encoded: List[bytes]) -> int:
+        pipe.rpush(self.history_key(session_id), *encoded)  # RPUSH devolve o LLEN
+        return 1
+
+    def _queue_window(self, client, session_id: str, encoded: List[bytes], max_len: int, ttl: int):
+        keys = [self.history_key(session_id), self._summary_key(session_id)]
+        return _script(client, _LIST_WINDOW_LUA)(keys=keys, args=[max_len, ttl, *encoded])
+
+    def _length(self, pipe, session_id: str) -> None:
+        pipe.llen(self.history_key(session_id))
+
+    def _read_args(self, session_id: str, after: Optional[str], count: Optional[int]):
+        start = int(after) + 1 if after is not None else 0
+        return [self.history_key(session_id), self._summary_key(session_id)], [start, count or 0]
+
+    @staticmethod
+    def _with_ids(first_seq: int, raws: List[bytes]) -> List[IdEntry]:
+        return [(str(first_seq + i), decode_entry(raw)) for i, raw in enumerate(raws)]
+
+    def read(self, session_id: str, after: Optional[str] = None, count: Optional[int] = None) -> List[IdEntry]:
+        keys, args = self._read_args(session_id, after, count)
+        first_seq, raws = _script(get_redis_client(binary=True), _LIST_READ_LUA)(keys=keys, args=args)
+        return self._with_ids(int(first_seq), raws)
+
+    async def read_async(self, session_id: str, after: Optional[str] = None,
+                         count: Optional[int] = None) -> List[IdEntry]:
+        keys, args = self._read_args(session_id, after, count)
+        first_seq, raws = await _script(get_async_redis_client(binary=True), _LIST_READ_LUA)(keys=keys, args=args)
+        return self._with_ids(int(first_seq), raws)
+
+    def _head(self, session_id: str, length: int) -> List[Tuple[str, bytes]]:
+        pipe = get_redis_client(binary=True).pipeline(transaction=False)
+        pipe.hget(self._summary_key(session_id), "compacted_entries")
+        pipe.lrange(self.history_key(session_id), 0, length - 1)
+        off, raws = pipe.execute()
+        off = int(off or 0)
+        return [(str(off + i), raw) for i, raw in enumerate(raws)]
+
+    def _queue_drop(self, pipe, session_id: str, dropped: List[Tuple[str, bytes]]) -> None:
+        pipe.ltrim(self.history_key(session_id), len(dropped), -1)
+
+
+# =========================
+# Stream (XADD/XRANGE)
+# =========================
+
+class RedisStreamBackend(_RedisBackendBase):
+    name = "redis_stream"
+
+    def history_key(self, session_id: str) -> str:
+        return f"session:{session_id}:stream"
+
+    def _queue_append(self, pipe, session_id: str, encoded: List[bytes]) -> int:
+        key = self.history_key(session_id)
+        for e in encoded:
+            pipe.xadd(key, {"e": e})
+        pipe.xlen(key)
+        return len(encoded) + 1
+
+    def _queue_window(self, client, session_id: str, encoded: List[bytes], max_len: int, ttl: int):
+        key = self.history_key(session_id)
+        pipe = client.pipeline(transaction=True)
+        for e in encoded:
+            pipe.xadd(key, {"e": e}, maxlen=max_len, approximate=False)
+        pipe.expire(key, ttl)
+        return pipe.execute()
+
+    def _length(self, pipe, session_id: str) -> None:
+        pipe.xlen(self.history_key(session_id))
+
+    @staticmethod
+    def _decode(items) -> List[IdEntry]:
+        out = []
+        for eid, fields in items:
+            eid = eid.decode() if isinstance(eid, bytes) else eid
+            out.append((eid, decode_entry(fields.get(b"e") or fields.get("e"))))
+        return out
+
+    def read(self, session_id: str, after: Optional[str] = None, count: Optional[int] = None) -> List[IdEntry]:
+        start = f"({after}" if after else "-"
+        return self._decode(get_redis_client(binary=True).xrange(self.history_key(session_id), start, "+", count=count))
+
+    async def read_async(self, session_id: str, after: Optional[str] = None,
+                         count: Optional[int] = None) -> List[IdEntry]:
+        start = f"({after}" if after else "-"
+        items = await get_async_redis_client(binary=True).xrange(self.history_key(session_id), start, "+", count=count)
+        return self._decode(items)
+
+    def _head(self, session_id: str, length: int) -> List[Tuple[str, bytes]]:
+        items = get_redis_client(binary=True).xrange(self.history_key(session_id), "-", "+", count=length)
+        return [(eid.decode() if isinstance(eid, bytes) else eid, fields[b"e"]) for eid, fields in items]
+
+    def _queue_drop(self, pipe, session_id: str, dropped: List[Tuple[str, bytes]]) -> None:
+        pipe.xdel(self.history_key(session_id), *[eid for eid, _ in dropped])
+
+
+# =========================
+# Memória do processo (LRU/TTL)
+# =========================
+
+class _MemorySession:
+    __slots__ = ("entries", "first_seq", "size", "summary", "evals", "cursors", "expires_at")
+
+    def __init__(self):
+        self.entries: List[Tuple[Entry, int]] = []  # (mensagem, bytes codificados)
+        self.first_seq = 0                            # seq da primeira entrada (= compacted_entries)
+        self.size = 0
+        self.summary: Dict[str, str] = {}
+        self.evals: List[Dict[str, str]] = []
+        self.cursors: Dict[str, str] = {}
+        self.expires_at = 0.0
+
+
+class MemoryBackend(SessionBackend):
+    """
+    Histórico no próprio processo: sem round trip, mesma semântica de ids, compactação,
+    cursores e lock dos backends Redis. Só serve para um processo (um worker uvicorn):
+    outro processo não enxerga as sessões.
+
+    - TTL deslizante por sessão (SESSION_TTL_SECONDS), verificado no acesso
+    - teto de memória (SESSION_MEMORY_MAX_BYTES, soma das entradas codificadas):
+      acima dele as sessões menos usadas recentemente são descartadas inteiras
+    - mensagens devolvidas por read() são as guardadas: tratar como somente leitura
+    """
+    name = "memory"
+
+    def __init__(self, max_bytes: int = SESSION_MEMORY_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._sessions: "OrderedDict[str, _MemorySession]" = OrderedDict()
+        self._locks: Dict[str, Tuple[str, float]] = {}  # session_id → (token do dono, expira em)
+        self._total = 0
+        self._evictions = 0
+        self._mutex = threading.RLock()
+
+    # ---- acesso / expiração / LRU ----
+    def _get(self, session_id: str, create: bool = False) -> Optional[_MemorySession]:
+        now = time.monotonic()
+        s = self._sessions.get(session_id)
+        if s is not None and s.expires_at <= now:
+            self._drop(session_id)
+            s = None
+        if s is None and create:
+            s = self._sessions[session_id] = _MemorySession()
+            s.expires_at = now + SESSION_TTL_SECONDS
+        if s is not None:
+            self._sessions.move_to_end(session_id)
+        return s
+
+    def _drop(self, session_id: str) -> None:
+        s = self._sessions.pop(session_id, None)
+        if s is not None:
+            self._total -= s.size
+
+    def _evict(self, keep: str) -> None:
+        while self._total > self.max_bytes and len(self._sessions) > 1:
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                break
+            self._drop(oldest)
+            self._evictions += 1
+
+    # ---- escrita / leitura ----
+    def append(self, session_id: str, messages: List[Entry], max_len: Optional[int] = None,
+               ttl_seconds: Optional[int] = None, compact: bool = True) -> None:
+        items = []
+        for m in messages:
+            raw = encode_entry(m["role"], m.get("content"), m.get("extra"))
+            items.append((decode_entry(raw), len(raw)))
+        with self._mutex:
+            s = self._get(session_id, create=True)
+            added = sum(n for _, n in items)
+            s.entries.extend(items)
+            s.size += added
+            self._total += added
+            s.expires_at = time.monotonic() + (ttl_seconds or SESSION_TTL_SECONDS)
+            if not compact:
+                drop = max(0, len(s.entries) - (max_len or SESSION_MAX_ENTRIES))
+                freed = sum(n for _, n in s.entries[:drop])
+                del s.entries[:drop]
+                s.first_seq += drop
+                s.size -= freed
+                self._total -= freed
+            needs_compaction = compact and over_cap(len(s.entries), s.size, max_len)
+            self._evict(keep=session_id)
+        if needs_compaction:
+            self.compact(session_id, max_len)
+
+    def read(self, session_id: str, after: Optional[str] = None, count: Optional[int] = None) -> List[IdEntry]:
+        with self._mutex:
+            s = self._get(session_id)
+            if s is None:
+                return []
+            start = max(0, int(after) + 1 - s.first_seq) if after is not None else 0
+            stop = start + count if count else len(s.entries)
+            return [(str(s.first_seq + i), m) for i, (m, _) in enumerate(s.entries[start:stop], start=start)]
+
+    def compact(self, session_id: str, max_len: Optional[int] = None) -> int:
+        token = self.acquire_lock(session_id)
+        if not token:
+            return 0
+        try:
+            with self._mutex:
+                s = self._get(session_id)
+                if s is None or not over_cap(len(s.entries), s.size, max_len):
+                    return 0
+                drop = plan_compaction([n for _, n in s.entries], len(s.entries), s.size, max_len)
+                if drop <= 0:
+                    return 0
+                dropped = [(str(s.first_seq + i), m) for i, (m, _) in enumerate(s.entries[:drop])]
+                s.summary = fold_summary(s.summary, dropped, s.cursors.get(EVAL_CONSUMER))
+                freed = sum(n for _, n in s.entries[:drop])
+                del s.entries[:drop]
+                s.first_seq += drop
+                s.size -= freed
+                self._total -= freed
+            print(f"[DEBUG] Compacted session={session_id} entries={drop}")
+            return drop
+        finally:
+            self.release_lock(session_id, token)
+
+    # ---- resumo / avaliações parciais / cursores ----
+    def summary(self, session_id: str) -> Dict[str, str]:
+        with self._mutex:
+            s = self._get(session_id)
+            return dict(s.summary) if s else {}
+
+    def partial_evals(self, session_id: str) -> Tuple[Optional[str], List[Dict[str, str]]]:
+        with self._mutex:
+            s = self._get(session_id)
+            return (s.cursors.get(EVAL_CONSUMER), list(s.evals)) if s else (None, [])
+
+    def append_partial_evals(self, session_id: str, evals: List[Dict[str, str]], cursor: Optional[str],
+                             clear_pending: bool = False, lock_token: Optional[str] = None) -> bool:
+        with self._mutex:
+            s = self._get(session_id)
+            if s is None:
+                return False  # sessão finalizada/expirada: não recria
+            if lock_token and self._lock_owner(session_id) != lock_token:
+                return False  # lock expirou e outro worker assumiu a sessão
+            s.evals.extend(evals)
+            if clear_pending:
+                s.summary.pop("pending_user_text", None)
+            if cursor:
+                s.cursors[EVAL_CONSUMER] = cursor
+            return True
+
+    def get_cursor(self, session_id: str, consumer: str) -> Optional[str]:
+        with self._mutex:
+            s = self._get(session_id)
+            return s.cursors.get(consumer) if s else None
+
+    def set_cursor(self, session_id: str, consumer: str, entry_id: str) -> None:
+        with self._mutex:
+            self._get(session_id, create=True).cursors[consumer] = entry_id
+
+    # ---- lock / limpeza ----
+    def _lock_owner(self, session_id: str) -> Optional[str]:
+        token, expires_at = self._locks.get(session_id, (None, 0.0))
+        return token if expires_at > time.monotonic() else None
+
+    def acquire_lock(self, session_id: str, ttl_seconds: int = SESSION_LOCK_TTL) -> Optional[str]:
+        with self._mutex:
+            if self._lock_owner(session_id):
+                return None
+            token = uuid.uuid4().hex
+            self._locks[session_id] = (token, time.monotonic() + ttl_seconds)
+            return token
+
+    def refresh_lock(self, session_id: str, token: str, ttl_seconds: int = SESSION_LOCK_TTL) -> bool:
+        with self._mutex:
+            if self._lock_owner(session_id) != token:
+                return False
+            self._locks[session_id] = (token, time.monotonic() + ttl_seconds)
+            return True
+
+    def release_lock(self, session_id: str, token: str) -> None:
+        with self._mutex:
+            if self._lock_owner(session_id) == token:
+                del self._locks[session_id]
+
+    def clear(self, session_id: str) -> None:
+        with self._mutex:
+            self._drop(session_id)
+            self._locks.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._mutex:
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions,
+            }
+
+
+BACKENDS = {
+    "redis": RedisListBackend,
+    "redis_stream": RedisStreamBackend,
+    "memory": MemoryBackend,
+}
+
+
+def make_backend(name: str):
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise RuntimeError(f"SESSION_BACKEND inválido: '{name}' (opções: {', '.join(BACKENDS)})")
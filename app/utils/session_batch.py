@@ -1,9 +1,15 @@
 # app/utils/session_batch.py
 import re
-from typing import List, Dict
+import unicodedata
+from typing import List, Dict, Optional, Set
 
 __all__ = [
     "flatten_text",
+    "estimate_tokens",
+    "split_sentences",
+    "topic_terms",
+    "topic_overlap",
+    "BatchPacker",
     "chunk_text",
     "merge_evaluations",
     "make_session_summary",
@@ -35,23 +41,136 @@ def flatten_text(s: str) -> str:
     s = s.replace("\x00", " ").replace("\r", " ").replace("\t", " ")
     return re.sub(r"\s+", " ", s).strip()
 
-def chunk_text(s: str, max_chars: int = 1800, overlap: int = 220) -> List[str]:
+CHARS_PER_TOKEN = 4  # estimativa grosseira (sem tokenizer)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+def estimate_tokens(s: str) -> int:
+    """Tokens estimados de um texto (~CHARS_PER_TOKEN caracteres por token)."""
+    return -(-len(s or "") // CHARS_PER_TOKEN)
+
+def split_sentences(s: str) -> List[str]:
+    """Quebra em frases (fim em . ! ? …); texto já achatado."""
+    return [p for p in _SENTENCE_END.split(s) if p]
+
+_STOPWORDS = frozenset(
+    "para como qual quais sobre isso essa esse este esta mais pode voce voces explica explique explicar "
+    "entao tambem porque quando onde muito minha meus minhas agora outra outro fazer seria "
+    "depois antes ainda mesmo melhor entendi entender exemplo exemplos certo coisa obrigado obrigada "
+    "what about this that with from have does could would please explain more tell there which "
+    "then again example examples understand thanks".split()
+)
+
+def topic_terms(s: str) -> Set[str]:
+    """Palavras de conteúdo (sem acento, 4+ letras, sem stopwords) que indicam o tema do texto."""
+    plain = unicodedata.normalize("NFKD", (s or "").lower()).encode("ascii", "ignore").decode()
+    return {w for w in re.findall(r"[a-z0-9]{4,}", plain) if w not in _STOPWORDS}
+
+def topic_overlap(a: Set[str], b: Set[str]) -> Optional[float]:
+    """Coeficiente de sobreposição |a∩b| / min(|a|,|b|); None se um dos lados não tem termos."""
+    if not a or not b:
+        return None
+    return len(a & b) / min(len(a), len(b))
+
+class BatchPacker:
     """
-    Fatia texto longo em blocos <= max_chars com overlap p/ evitar perda na borda.
+    Empacota falas em lotes sob um orçamento de caracteres e/ou tokens estimados, sem overlap:
+      - achata whitespace (flatten_text) e descarta falas repetidas (sem diferenciar maiúsculas)
+      - enche o lote aberto na ordem das falas (next-fit: o mínimo de lotes sem reordenar)
+      - fala que não cabe no lote aberto entra frase a frase; frase maior que um lote, palavra a palavra
+    Incremental: add() devolve os lotes que fecharam; flush() devolve o último.
     """
-    s = s.strip()
-    if len(s) <= max_chars:
-        return [s]
-    chunks = []
-    i = 0
-    n = len(s)
-    while i < n:
-        end = min(i + max_chars, n)
-        chunks.append(s[i:end])
-        if end == n:
-            break
-        i = max(end - overlap, i + 1)
-    return chunks
+
+    def __init__(self, max_chars: int = 1800, max_tokens: Optional[int] = None, dedup: bool = True):
+        self.limit = min(max_chars, max_tokens * CHARS_PER_TOKEN) if max_tokens else max_chars
+        self.batches = 0   # lotes fechados
+        self.chars = 0     # caracteres nos lotes fechados
+        self.repeats = 0   # falas descartadas por repetição
+        self._parts: List[str] = []
+        self._size = 0
+        self._seen = set() if dedup else None  # hashes (memória pequena mesmo em sessões longas)
+
+    def _fits(self, piece: str) -> bool:
+        return self._size + (1 if self._parts else 0) + len(piece) <= self.limit
+
+    def _repeat(self, text: str, record: bool = True) -> bool:
+        if self._seen is None:
+            return False
+        key = hash(text.lower())
+        if key in self._seen:
+            return True
+        if record:
+            self._seen.add(key)
+        return False
+
+    def _close(self, out: List[str]) -> None:
+        if self._parts:
+            batch = "\n".join(self._parts)
+            out.append(batch)
+            self.batches += 1
+            self.chars += len(batch)
+            self._parts, self._size = [], 0
+
+    def _put(self, piece: str, out: List[str]) -> None:
+        if not self._fits(piece):
+            self._close(out)
+        self._size += len(piece) + (1 if self._parts else 0)
+        self._parts.append(piece)
+
+    def _pieces(self, text: str):
+        for sentence in split_sentences(text):
+            if len(sentence) <= self.limit:
+                yield sentence
+                continue
+            run = ""
+            for word in sentence.split(" "):
+                while len(word) > self.limit:  # palavra gigante (ex.: URL): corte seco
+                    if run:
+                        yield run
+                        run = ""
+                    yield word[: self.limit]
+                    word = word[self.limit :]
+                if run and len(run) + 1 + len(word) > self.limit:
+                    yield run
+                    run = ""
+                run = f"{run} {word}" if run else word
+            if run:
+                yield run
+
+    def fits(self, text: str) -> bool:
+        """A fala cabe inteira no lote aberto (repetidas/vazias sempre cabem: são descartadas)."""
+        text = flatten_text(text)
+        return not text or self._repeat(text, record=False) or self._fits(text)
+
+    def has_open_batch(self) -> bool:
+        return bool(self._parts)
+
+    def add(self, text: str) -> List[str]:
+        out: List[str] = []
+        text = flatten_text(text)
+        if not text:
+            return out
+        if self._repeat(text):
+            self.repeats += 1
+            return out
+        if self._fits(text):
+            self._put(text, out)
+        else:
+            for piece in self._pieces(text):
+                self._put(piece, out)
+        return out
+
+    def flush(self) -> List[str]:
+        out: List[str] = []
+        self._close(out)
+        return out
+
+def chunk_text(s: str, max_chars: int = 1800) -> List[str]:
+    """
+    Fatia texto longo em blocos <= max_chars em limites de frase/palavra (sem overlap).
+    """
+    packer = BatchPacker(max_chars, dedup=False)
+    return packer.add(s) + packer.flush()
 
 def merge_evaluations(evals: List[Dict[str, str]]) -> Dict[str, str]:
     sp = _dedup_join([e.get("strong_points", "") for e in evals], max_len=450)
@@ -0,0 +1,65 @@
+# app/utils/session_codec.py
+"""
+Codificação das entradas do histórico de sessão.
+
+- "json"    → JSON (formato original: timestamp ISO, role, content, extra)
+- "msgpack" → byte de versão + msgpack [epoch, role_code, content(, extra)]
+               (role como enum, timestamp numérico, extra omitido quando vazio)
+
+decode_entry lê os dois formatos (JSON sempre começa com "{"), então entradas antigas
+continuam legíveis depois de trocar SESSION_ENCODING.
+"""
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+SESSION_ENCODING = os.getenv("SESSION_ENCODING", "json").lower()
+
+try:
+    import msgpack
+except ImportError:  # opcional: só necessário com SESSION_ENCODING=msgpack
+    msgpack = None
+
+if SESSION_ENCODING not in ("json", "msgpack"):
+    raise RuntimeError(f"SESSION_ENCODING inválido: '{SESSION_ENCODING}' (use json ou msgpack)")
+if SESSION_ENCODING == "msgpack" and msgpack is None:
+    raise RuntimeError("SESSION_ENCODING=msgpack requer o pacote 'msgpack' (pip install msgpack)")
+
+MSGPACK_V1 = b"\x01"  # marcador de versão do formato compacto
+
+_ROLE_TO_CODE = {"user": 0, "agent": 1, "system": 2}
+_CODE_TO_ROLE = {v: k for k, v in _ROLE_TO_CODE.items()}
+
+
+def encode_entry(role: str, content: str, extra: Dict[str, Any] | None = None, ts: datetime | None = None) -> bytes:
+    ts = ts or datetime.utcnow()
+    if SESSION_ENCODING == "msgpack":
+        item = [ts.replace(tzinfo=timezone.utc).timestamp(), _ROLE_TO_CODE.get(role, role), content]
+        if extra:
+            item.append(extra)
+        return MSGPACK_V1 + msgpack.packb(item, use_bin_type=True)
+    entry = {
+        "timestamp": ts.isoformat(),
+        "role": role,
+        "content": content,
+        "extra": extra or {}
+    }
+    return json.dumps(entry).encode("utf-8")
+
+
+def decode_entry(raw: bytes | str) -> Dict[str, Any]:
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    if raw[:1] == MSGPACK_V1:
+        if msgpack is None:
+            raise RuntimeError("Entrada msgpack no histórico, mas o pacote 'msgpack' não está instalado")
+        item = msgpack.unpackb(raw[1:], raw=False)
+        ts, role, content = item[0], item[1], item[2]
+        return {
+            "timestamp": datetime.fromtimestamp(ts, tz=timezone.utc).replace(tzinfo=None).isoformat(),
+            "role": _CODE_TO_ROLE.get(role, role),
+            "content": content,
+            "extra": item[3] if len(item) > 3 else {},
+        }
+    return json.loads(raw)
@@ -1,28 +1,24 @@
+import asyncio
 import os
-import json
-import redis
-from urllib.parse import urlparse
-from datetime import datetime
-from typing import Dict, Any, List
-from dotenv import load_dotenv
+import time
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional, Tuple
 
-# Carrega variáveis do .env
-load_dotenv()
+from app.utils.session_backends import SESSION_LOCK_TTL, make_backend
 
-# pega REDIS_URL do ambiente (ex: redis://:senha@localhost:6379/0)
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Backend do histórico (ver app/utils/session_backends.py):
+#   redis        → lista (padrão)
+#   redis_stream → Redis Streams (XADD/XRANGE), leituras incrementais por id
+#   memory       → no processo (LRU/TTL + SESSION_MEMORY_MAX_BYTES); sem Redis, um worker só
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "redis").lower()
 
-# parse da URL
-url = urlparse(REDIS_URL)
+_backend = make_backend(SESSION_BACKEND)
 
-redis_client = redis.Redis(
-    host=url.hostname,
-    port=url.port or 6379,
-    db=int(url.path.replace("/", "")) if url.path else 0,
-    username=url.username,
-    password=url.password,
-    decode_responses=True
-)
+# entradas por página na leitura paginada (iter_session_messages)
+SESSION_PAGE_SIZE = int(os.getenv("SESSION_PAGE_SIZE", "200"))
+
+
+def get_backend():
+    return _backend
 
 
 def save_session_message(session_id: str, role: str, content: str, extra: Dict[str, Any] | None = None) -> None:
@@ -34,28 +30,238 @@ def save_session_message(session_id: str, role: str, content: str, extra: Dict[s
         content: mensagem em texto
         extra: metadados opcionais (dict)
     """
-    key = f"session:{session_id}"
-    entry = {
-        "timestamp": datetime.utcnow().isoformat(),
-        "role": role,
-        "content": content,
-        "extra": extra or {}
-    }
-    redis_client.rpush(key, json.dumps(entry))
+    save_session_messages(session_id, [{"role": role, "content": content, "extra": extra}])
+
+
+def save_session_messages(
+    session_id: str,
+    messages: List[Dict[str, Any]],
+    max_len: int | None = None,
+    ttl_seconds: int | None = None,
+    compact: bool = True,
+) -> None:
+    """
+    Salva várias mensagens de uma vez (1 round trip: append + INCRBY + EXPIRE em MULTI).
+    Se a sessão passar do limite (entradas/bytes), compacta os turnos antigos no resumo.
+    Args:
+        messages: [{"role": ..., "content": ..., "extra": {...}}, ...]
+        max_len: limite de entradas (default SESSION_MAX_ENTRIES)
+        ttl_seconds: TTL deslizante (default SESSION_TTL_SECONDS)
+        compact: False = janela simples (append + LTRIM + EXPIRE): as entradas além de
+                 max_len são descartadas, sem resumo nem contagem de bytes
+    """
+    if not messages:
+        return
+    _backend.append(session_id, messages, max_len, ttl_seconds, compact)
+
+
+def compact_session(session_id: str, max_len: int | None = None) -> int:
+    """
+    Move os turnos mais antigos do histórico para o resumo da sessão (ver session_backends).
+    """
+    return _backend.compact(session_id, max_len)
+
+
+def get_session_summary(session_id: str) -> Dict[str, str]:
+    """
+    Resumo dos turnos compactados: {"summary", "pending_user_text", "compacted_entries"} (vazio se nunca compactou).
+    """
+    return _backend.summary(session_id)
 
 
 def get_session_history(session_id: str) -> List[Dict[str, Any]]:
     """
     Recupera todo o histórico de uma sessão do Redis.
     """
-    key = f"session:{session_id}"
-    messages = redis_client.lrange(key, 0, -1)
-    return [json.loads(m) for m in messages]
+    return [entry for _, entry in _backend.read(session_id)]
+
+
+def get_session_messages_since(
+    session_id: str, after: Optional[str] = None, count: Optional[int] = None
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Entradas (id, mensagem) depois do id `after` (exclusivo); None = desde o início.
+    Lê só o que é novo: custo proporcional às entradas retornadas, não ao histórico.
+    """
+    return _backend.read(session_id, after, count)
+
+
+def iter_session_messages(
+    session_id: str, after: Optional[str] = None, page_size: Optional[int] = None
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Percorre o histórico (depois de `after`) em páginas de page_size entradas
+    (lista: janelas LRANGE; stream: XRANGE COUNT). Só uma página fica em memória.
+    """
+    page_size = page_size or SESSION_PAGE_SIZE
+    while True:
+        page = _backend.read(session_id, after, page_size)
+        yield from page
+        if len(page) < page_size:
+            return
+        after = page[-1][0]
+
+
+def read_session_updates(session_id: str, consumer: str, count: Optional[int] = None) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Novas entradas para um consumidor (ex.: "progress_view") e avança o cursor dele.
+    """
+    items = _backend.read(session_id, _backend.get_cursor(session_id, consumer), count)
+    if items:
+        _backend.set_cursor(session_id, consumer, items[-1][0])
+    return items
+
+
+def get_partial_evals(session_id: str) -> Tuple[Optional[str], List[Dict[str, str]]]:
+    """
+    Retorna (cursor, avaliações parciais): cursor = id da última entrada do histórico
+    cujas falas do usuário já foram avaliadas em background (None = nenhuma).
+    """
+    return _backend.partial_evals(session_id)
+
+
+def append_partial_evals(
+    session_id: str,
+    evals: List[Dict[str, str]],
+    cursor: Optional[str],
+    clear_pending: bool = False,
+    lock_token: Optional[str] = None,
+) -> bool:
+    """
+    Acrescenta avaliações parciais e avança o cursor (atômico, com TTL).
+    clear_pending: o texto pendente do resumo (turnos compactados) foi avaliado.
+    lock_token: só grava se o lock da sessão ainda é deste dono.
+    Retorna False (nada gravado) se o histórico da sessão não existe mais ou o lock foi perdido.
+    """
+    return _backend.append_partial_evals(session_id, evals, cursor, clear_pending, lock_token)
+
+
+def acquire_eval_lock(session_id: str, ttl_seconds: int = SESSION_LOCK_TTL) -> Optional[str]:
+    """
+    Lock por sessão (SET NX EX com token do dono): avaliação incremental, compactação
+    e finalize não rodam ao mesmo tempo. Retorna o token (None = ocupado).
+    """
+    return _backend.acquire_lock(session_id, ttl_seconds)
+
+
+def refresh_eval_lock(session_id: str, token: str, ttl_seconds: int = SESSION_LOCK_TTL) -> bool:
+    """Renova o TTL do lock (a cada lote avaliado); False se ele não é mais deste dono."""
+    return _backend.refresh_lock(session_id, token, ttl_seconds)
+
+
+def release_eval_lock(session_id: str, token: str) -> None:
+    """Solta o lock só se ainda é deste dono (nunca apaga o lock de outro worker)."""
+    _backend.release_lock(session_id, token)
+
+
+def wait_eval_lock(session_id: str, timeout: float, poll_seconds: float = 0.1) -> Optional[str]:
+    """
+    Espera até `timeout` segundos pelo lock (ex.: finalize esperando a avaliação incremental
+    em andamento terminar). Retorna o token, ou None se não conseguiu.
+    """
+    end = time.monotonic() + timeout
+    while True:
+        token = acquire_eval_lock(session_id)
+        if token or time.monotonic() >= end:
+            return token
+        time.sleep(poll_seconds)
 
 
 def clear_session(session_id: str) -> None:
     """
-    Remove todo o histórico de uma sessão no Redis.
+    Remove todo o histórico de uma sessão no Redis (inclui avaliações parciais).
     """
-    key = f"session:{session_id}"
-    redis_client.delete(key)
+    _backend.clear(session_id)
+
+
+# =========================
+# Async (redis.asyncio)
+# =========================
+
+async def save_session_message_async(session_id: str, role: str, content: str, extra: Dict[str, Any] | None = None) -> None:
+    """Versão async de save_session_message."""
+    await save_session_messages_async(session_id, [{"role": role, "content": content, "extra": extra}])
+
+
+async def save_session_messages_async(
+    session_id: str,
+    messages: List[Dict[str, Any]],
+    max_len: int | None = None,
+    ttl_seconds: int | None = None,
+    compact: bool = True,
+) -> None:
+    """Versão async de save_session_messages."""
+    if not messages:
+        return
+    await _backend.append_async(session_id, messages, max_len, ttl_seconds, compact)
+
+
+async def get_session_history_async(session_id: str) -> List[Dict[str, Any]]:
+    """Versão async de get_session_history."""
+    return [entry for _, entry in await _backend.read_async(session_id)]
+
+
+async def get_session_messages_since_async(
+    session_id: str, after: Optional[str] = None, count: Optional[int] = None
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """Versão async de get_session_messages_since."""
+    return await _backend.read_async(session_id, after, count)
+
+
+async def iter_session_messages_async(
+    session_id: str, after: Optional[str] = None, page_size: Optional[int] = None
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """Versão async de iter_session_messages."""
+    page_size = page_size or SESSION_PAGE_SIZE
+    while True:
+        page = await _backend.read_async(session_id, after, page_size)
+        for item in page:
+            yield item
+        if len(page) < page_size:
+            return
+        after = page[-1][0]
+
+
+async def read_session_updates_async(
+    session_id: str, consumer: str, count: Optional[int] = None
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """Versão async de read_session_updates."""
+    items = await _backend.read_async(session_id, await _backend.get_cursor_async(session_id, consumer), count)
+    if items:
+        await _backend.set_cursor_async(session_id, consumer, items[-1][0])
+    return items
+
+
+async def wait_eval_lock_async(session_id: str, timeout: float, poll_seconds: float = 0.1) -> Optional[str]:
+    """Versão async de wait_eval_lock."""
+    end = time.monotonic() + timeout
+    while True:
+        token = await _backend.acquire_lock_async(session_id)
+        if token or time.monotonic() >= end:
+            return token
+        await asyncio.sleep(poll_seconds)
+
+
+async def refresh_eval_lock_async(session_id: str, token: str, ttl_seconds: int = SESSION_LOCK_TTL) -> bool:
+    """Versão async de refresh_eval_lock."""
+    return await _backend.refresh_lock_async(session_id, token, ttl_seconds)
+
+
+async def release_eval_lock_async(session_id: str, token: str) -> None:
+    """Versão async de release_eval_lock."""
+    await _backend.release_lock_async(session_id, token)
+
+
+async def get_partial_evals_async(session_id: str) -> Tuple[Optional[str], List[Dict[str, str]]]:
+    """Versão async de get_partial_evals."""
+    return await _backend.partial_evals_async(session_id)
+
+
+async def get_session_summary_async(session_id: str) -> Dict[str, str]:
+    """Versão async de get_session_summary."""
+    return await _backend.summary_async(session_id)
+
+
+async def clear_session_async(session_id: str) -> None:
+    """Versão async de clear_session."""
+    await _backend.clear_async(session_id)
@@ -0,0 +1,41 @@
+# app/utils/sse.py
+"""
+Server-Sent Events para os endpoints /run/stream.
+
+Os workflows de streaming geram (evento, dados); aqui viram
+    event: <evento>
+    data: <json>
+e sse_response pega o primeiro evento ANTES de responder: falhas no início
+(circuito aberto, agente fora) ainda viram o status HTTP certo, não um 200 com erro.
+"""
+import json
+from typing import Any, AsyncIterator, Tuple
+
+from fastapi.responses import StreamingResponse
+
+Event = Tuple[str, Any]
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _relay(first: Event, events: AsyncIterator[Event]) -> AsyncIterator[str]:
+    yield sse_event(*first)
+    try:
+        async for event in events:
+            yield sse_event(*event)
+    except Exception as e:
+        # o status 200 já foi enviado: o erro vai como evento
+        print(f"[WARN] [sse] stream interrupted: {e}")
+        yield sse_event("error", {"status": "error", "message": str(e)})
+
+
+async def sse_response(events: AsyncIterator[Event]) -> StreamingResponse:
+    """StreamingResponse text/event-stream; exceções antes do 1º evento sobem para o router."""
+    first = await events.__anext__()
+    return StreamingResponse(
+        _relay(first, events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,204 @@
+# app/utils/tiered_cache.py
+"""
+Cache de dois níveis para resultados de agentes (valores JSON):
+
+- L1: LRU no processo, com TTL e teto de entradas (e, opcional, de bytes por entrada)
+- L2: Redis compartilhado entre workers/instâncias (chave cache:<nome>:<hash>, TTL próprio)
+
+Falha do Redis nunca quebra a chamada: conta em redis_errors e segue como miss
+(o aviso sai só na primeira falha de cada cache). Sem REDIS_URL, o L2 fica desligado.
+Valor ilegível no L2 (JSON corrompido/truncado) conta em decode_errors e também é miss.
+Cada cache se registra por nome; cache_stats() devolve os contadores de todos.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.redis_client import REDIS_URL, get_redis_client, get_async_redis_client
+
+_registry: Dict[str, "TieredCache"] = {}
+
+
+def cache_key(parts: Dict[str, Any]) -> str:
+    """Hash estável de um dict (JSON canônico: chaves ordenadas, sem espaços)."""
+    canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LocalCache:
+    """LRU com TTL por entrada, seguro entre threads."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (ttl_seconds or self.ttl_seconds))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class TieredCache:
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 1000,
+        ttl_seconds: float = 300,
+        redis_ttl_seconds: int = 3600,
+        use_redis: bool = True,
+        max_entry_bytes: Optional[int] = None,
+    ):
+        self.name = name
+        self.local = LocalCache(max_entries, ttl_seconds)
+        self.redis_ttl_seconds = redis_ttl_seconds
+        self.use_redis = use_redis and bool(REDIS_URL)  # sem Redis configurado: só L1, sem erro por chamada
+        self.max_entry_bytes = max_entry_bytes
+        self._counters = {
+            "hits_local": 0, "hits_redis": 0, "misses": 0, "sets": 0, "too_large": 0,
+            "redis_errors": 0, "decode_errors": 0,
+        }
+        _registry[name] = self
+
+    def _redis_key(self, key: str) -> str:
+        return f"cache:{self.name}:{key}"
+
+    def _count(self, name: str) -> None:
+        self._counters[name] += 1  # contadores aproximados (sem lock) bastam para métricas
+
+    def _redis_failed(self, e: Exception) -> None:
+        self._count("redis_errors")
+        if self._counters["redis_errors"] == 1:  # as seguintes só aparecem em cache_stats()
+            print(f"[WARN] [cache:{self.name}] Redis tier unavailable (next errors only counted): {e}")
+
+    def _decode(self, raw: str) -> Optional[Any]:
+        try:
+            return json.loads(raw)
+        except ValueError:
+            self._count("decode_errors")
+            return None
+
+    def _encode(self, value: Any) -> Optional[str]:
+        raw = json.dumps(value, ensure_ascii=False)
+        if self.max_entry_bytes and len(raw.encode("utf-8")) > self.max_entry_bytes:
+            self._count("too_large")
+            return None
+        return raw
+
+    # ---- sync ----
+    def get(self, key: str) -> Optional[Any]:
+        value = self.local.get(key)
+        if value is not None:
+            self._count("hits_local")
+            return value
+        if self.use_redis:
+            try:
+                raw = get_redis_client().get(self._redis_key(key))
+            except Exception as e:
+                self._redis_failed(e)
+                raw = None
+            value = self._decode(raw) if raw is not None else None
+            if value is not None:
+                self.local.set(key, value)
+                self._count("hits_redis")
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        raw = self._encode(value)
+        if raw is None:
+            return
+        self.local.set(key, value)
+        self._count("sets")
+        if self.use_redis:
+            try:
+                get_redis_client().set(self._redis_key(key), raw, ex=self.redis_ttl_seconds)
+            except Exception as e:
+                self._redis_failed(e)
+
+    def delete(self, key: str) -> None:
+        self.local.delete(key)
+        if self.use_redis:
+            try:
+                get_redis_client().delete(self._redis_key(key))
+            except Exception as e:
+                self._redis_failed(e)
+
+    # ---- async (L1 é memória: só o L2 usa redis.asyncio) ----
+    async def get_async(self, key: str) -> Optional[Any]:
+        value = self.local.get(key)
+        if value is not None:
+            self._count("hits_local")
+            return value
+        if self.use_redis:
+            try:
+                raw = await get_async_redis_client().get(self._redis_key(key))
+            except Exception as e:
+                self._redis_failed(e)
+                raw = None
+            value = self._decode(raw) if raw is not None else None
+            if value is not None:
+                self.local.set(key, value)
+                self._count("hits_redis")
+                return value
+        self._count("misses")
+        return None
+
+    async def set_async(self, key: str, value: Any) -> None:
+        raw = self._encode(value)
+        if raw is None:
+            return
+        self.local.set(key, value)
+        self._count("sets")
+        if self.use_redis:
+            try:
+                await get_async_redis_client().set(self._redis_key(key), raw, ex=self.redis_ttl_seconds)
+            except Exception as e:
+                self._redis_failed(e)
+
+    async def delete_async(self, key: str) -> None:
+        self.local.delete(key)
+        if self.use_redis:
+            try:
+                await get_async_redis_client().delete(self._redis_key(key))
+            except Exception as e:
+                self._redis_failed(e)
+
+    def stats(self) -> Dict[str, Any]:
+        c = dict(self._counters)
+        lookups = c["hits_local"] + c["hits_redis"] + c["misses"]
+        c["hit_rate"] = round((c["hits_local"] + c["hits_redis"]) / lookups, 3) if lookups else None
+        c["local_entries"] = len(self.local)
+        c["redis_enabled"] = self.use_redis
+        return c
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Contadores de todos os caches registrados neste processo."""
+    return {name: cache.stats() for name, cache in _registry.items()}
@@ -2,12 +2,16 @@
 from typing import Any, Dict, Optional
 
 # Workflows locais
-from app.workflows.normal_session import run_natural_session
-from app.workflows.class_session import run_class_session
+from app.workflows.normal_session import (
+    run_natural_session, run_natural_session_async, natural_answer_async, commit_natural_turn_async,
+)
+from app.workflows.class_session import (
+    run_class_session, run_class_session_async, class_turn_async, commit_class_turn_async,
+)
 from app.workflows.generate_query import run_generate_query  # <- workflow local (fake analytics)
 
 # Fallback para chamadas diretas (se algum intent não tiver workflow dedicado)
-from app.utils.agent_client import post_agent
+from app.utils.agent_client import post_agent, post_agent_async
 
 # Intent → workflow (preferimos workflows quando existem)
 INTENT_TO_WORKFLOW = {
@@ -24,6 +28,25 @@ INTENT_TO_AGENT = {
     # Não mapeamos 'generate_query' para agente porque é local (fake)
 }
 
+def _class_aluno_uuid(context: Dict[str, Any]) -> str:
+    return context.get("aluno_uuid") or context.get("user_uuid") or context.get("user_id") or "aluno_generico"
+
+def _fallback_payload(
+    intent: str,
+    user_text: str,
+    context: Dict[str, Any],
+    user_id: Optional[str],
+    session_id: Optional[str],
+) -> Dict[str, Any]:
+    payload = {
+        "question": user_text,
+        "user_id": user_id,
+        "session_id": session_id,
+        "context": context,
+        "metadata": {"intent": intent},
+    }
+    return {k: v for k, v in payload.items() if v is not None}
+
 def execute_workflow(
     intent: str,
     *,
@@ -45,7 +68,7 @@ def execute_workflow(
         return {"status": "ok", "workflow": "normal_session", "result": res}
 
     if INTENT_TO_WORKFLOW.get(intent) == "class_session":
-        aluno_uuid = context.get("aluno_uuid") or context.get("user_uuid") or context.get("user_id") or "aluno_generico"
+        aluno_uuid = _class_aluno_uuid(context)
         res = run_class_session(aluno_uuid=aluno_uuid, question=user_text, session_id=session_id or "sessao_padrao")
         return {"status": "ok", "workflow": "class_session", "result": res}
 
@@ -64,14 +87,84 @@ def execute_workflow(
     if not agent_key:
         return {"status": "error", "error": f"Workflow/Agente não encontrado para intent '{intent}'."}
 
-    payload = {
-        "question": user_text,
-        "user_id": user_id,
-        "session_id": session_id,
-        "context": context,
-        "metadata": {"intent": intent},
-    }
-    payload = {k: v for k, v in payload.items() if v is not None}
-
+    payload = _fallback_payload(intent, user_text, context, user_id, session_id)
     data = post_agent(agent_key, payload)
     return {"status": "ok", "workflow": intent, "result": data}
+
+async def execute_workflow_async(
+    intent: str,
+    *,
+    user_text: str,
+    context: Optional[Dict[str, Any]] = None,
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Versão async de execute_workflow (mesmo roteamento intent → workflow/agente)."""
+    context = context or {}
+
+    if INTENT_TO_WORKFLOW.get(intent) == "normal_session":
+        res = await run_natural_session_async(session_id=session_id or "sessao_padrao", question=user_text)
+        return {"status": "ok", "workflow": "normal_session", "result": res}
+
+    if INTENT_TO_WORKFLOW.get(intent) == "class_session":
+        aluno_uuid = _class_aluno_uuid(context)
+        res = await run_class_session_async(aluno_uuid=aluno_uuid, question=user_text, session_id=session_id or "sessao_padrao")
+        return {"status": "ok", "workflow": "class_session", "result": res}
+
+    if INTENT_TO_WORKFLOW.get(intent) == "generate_query":
+        # local e CPU-only: roda direto no event loop
+        res = run_generate_query(question=user_text, user_id=user_id, session_id=session_id, context=context)
+        return {"status": "ok", "workflow": "generate_query", "result": res}
+
+    agent_key = INTENT_TO_AGENT.get(intent)
+    if not agent_key:
+        return {"status": "error", "error": f"Workflow/Agente não encontrado para intent '{intent}'."}
+
+    payload = _fallback_payload(intent, user_text, context, user_id, session_id)
+    data = await post_agent_async(agent_key, payload)
+    return {"status": "ok", "workflow": intent, "result": data}
+
+# =========================
+# Execução especulativa (async)
+# =========================
+# Intents cujo workflow separa "calcular" (só agentes, sem efeito colateral) de "gravar" (histórico)
+SPECULATIVE_INTENTS = ("normal_session", "class_session")
+
+async def speculate_workflow_async(
+    intent: str,
+    *,
+    user_text: str,
+    context: Optional[Dict[str, Any]] = None,
+    session_id: Optional[str] = None,
+) -> Any:
+    """
+    Só as chamadas de agente do workflow, sem gravar nada: o rascunho pode ser
+    descartado se o guardrails não liberar este intent.
+    """
+    if intent == "normal_session":
+        return await natural_answer_async(user_text)
+    if intent == "class_session":
+        return await class_turn_async(
+            user_text, session_id=session_id or "sessao_padrao", aluno_uuid=_class_aluno_uuid(context or {})
+        )
+    raise ValueError(f"Intent '{intent}' não suporta execução especulativa.")
+
+async def commit_workflow_async(
+    intent: str,
+    draft: Any,
+    *,
+    user_text: str,
+    context: Optional[Dict[str, Any]] = None,
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Grava o rascunho de speculate_workflow_async; mesmo retorno de execute_workflow_async."""
+    if intent == "normal_session":
+        res = await commit_natural_turn_async(session_id or "sessao_padrao", user_text, *draft)
+        return {"status": "ok", "workflow": "normal_session", "result": res}
+    if intent == "class_session":
+        res = await commit_class_turn_async(
+            session_id or "sessao_padrao", user_text, *draft, aluno_uuid=_class_aluno_uuid(context or {})
+        )
+        return {"status": "ok", "workflow": "class_session", "result": res}
+    raise ValueError(f"Intent '{intent}' não suporta execução especulativa.")
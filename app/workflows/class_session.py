@@ -4,17 +4,14 @@ from __future__ import annotations
 
 import sys
 import json
-import time
-from pathlib import Path
-from typing import Dict, Any, List, Tuple
+import asyncio
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, AsyncIterable, AsyncIterator, Iterable, List, NamedTuple, Optional, Tuple
 
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 
 # Ensure Python sees the project root
 ROOT_DIR = Path(__file__).resolve().parent.parent.parent
@@ -22,153 +19,223 @@ if str(ROOT_DIR) not in sys.path:
     sys.path.append(str(ROOT_DIR))
 
 from config import AGENT_URLS
+from database import SessionLocal, get_async_sessionmaker
 from app.models.sessao_aluno import SessaoAluno
+from app.utils.agent_client import post_agent, post_agent_async, stream_agent_async
+from app.utils.agent_guard import AgentUnavailable
+from app.utils.deadline import Deadline, deadline_from
+from app.utils.model_router import model_params
+from app.utils.session_batch import BatchPacker, topic_overlap, topic_terms
+from app.utils.tiered_cache import TieredCache, cache_key
 from app.utils.session_store import (
-    save_session_message,
-    get_session_history,
+    save_session_messages,
+    iter_session_messages,
+    get_partial_evals,
+    get_session_summary,
+    append_partial_evals,
+    acquire_eval_lock,
+    refresh_eval_lock,
+    release_eval_lock,
+    wait_eval_lock,
     clear_session,
+    save_session_messages_async,
+    iter_session_messages_async,
+    get_partial_evals_async,
+    get_session_summary_async,
+    wait_eval_lock_async,
+    refresh_eval_lock_async,
+    release_eval_lock_async,
+    clear_session_async,
 )
 
 # =========================
-# DB config
+# Finalize config
 # =========================
-DATABASE_URL = os.getenv("DATABASE_URL")
+# max schema_creator batches in flight per finalize (1 = sequential, as before)
+SCHEMA_EVAL_CONCURRENCY = max(1, int(os.getenv("SCHEMA_EVAL_CONCURRENCY", "4")))
+# budget per schema_creator batch: chars of user-only text and, optionally, estimated tokens (0 = off)
+SCHEMA_BATCH_CHARS = int(os.getenv("SCHEMA_BATCH_CHARS", "1800"))
+SCHEMA_BATCH_TOKENS = int(os.getenv("SCHEMA_BATCH_TOKENS", "0"))
+
+# Incremental evaluation: evaluate user utterances in background while the session runs
+INCREMENTAL_EVAL = os.getenv("INCREMENTAL_EVAL", "1") == "1"
+INCREMENTAL_EVAL_WORKERS = max(1, int(os.getenv("INCREMENTAL_EVAL_WORKERS", "2")))
+_incremental_pool = ThreadPoolExecutor(max_workers=INCREMENTAL_EVAL_WORKERS, thread_name_prefix="incremental_eval")
+# finalize waits this long for a background pass on the same session before reading/clearing it
+FINALIZE_EVAL_LOCK_WAIT = float(os.getenv("FINALIZE_EVAL_LOCK_WAIT", "30"))
 
 # =========================
-# HTTP session with Retry/Backoff
+# Turn deadline
 # =========================
-_session = requests.Session()
-_retry = Retry(
-    total=5,
-    connect=3,
-    read=3,
-    backoff_factor=1.5,
-    status_forcelist=(429, 500, 502, 503, 504),
-    allowed_methods=frozenset(["POST", "GET"]),
-)
-_adapter = HTTPAdapter(max_retries=_retry)
-_session.mount("https://", _adapter)
-_session.mount("http://", _adapter)
-
-
-def call_agent(url: str, payload: dict, timeout: Tuple[int, int] = (10, 120)) -> Dict[str, Any]:
-    """
-    Resilient HTTP call:
-      - Retry with backoff for 429/5xx and timeouts
-      - Timeout is a tuple: (connect, read)
-      - Logs raw response when not JSON-parseable
-    """
-    print(f"\n[DEBUG] Calling agent {url} with payload:")
-    try:
-        print(json.dumps(payload, ensure_ascii=False, indent=2))
-    except Exception:
-        print(payload)
-
-    try:
-        resp = _session.post(url, json=payload, timeout=timeout)
-    except requests.exceptions.ReadTimeout:
-        print(f"[ERROR] ReadTimeout on {url} (timeout={timeout}).")
-        raise
-    except requests.exceptions.RequestException as e:
-        print(f"[ERROR] Network failure when calling {url}: {e}")
-        raise
+# total budget for one class turn (planner + teacher, including retries); 0 = no deadline
+CLASS_TURN_DEADLINE_SECONDS = float(os.getenv("CLASS_TURN_DEADLINE_SECONDS", "60"))
+# share of the remaining budget the LITE planner may use; past it (or with the planner's
+# circuit open) the teacher gets FALLBACK_LITE_PLAN
+CLASS_PLANNER_BUDGET_SHARE = float(os.getenv("CLASS_PLANNER_BUDGET_SHARE", "0.35"))
 
-    try:
-        resp.raise_for_status()
-    except requests.HTTPError:
-        print(f"[DEBUG] HTTP {resp.status_code} body:")
-        print(resp.text[:2000])
-        raise
-
-    try:
-        return resp.json()
-    except ValueError:
-        print("[WARN] Response is not JSON. Raw body:")
-        print(resp.text[:2000])
-        return {"raw": resp.text}
+FALLBACK_LITE_PLAN = "Plano enxuto: objetivos, tópicos, prática, checagem."
 
+# =========================
+# Lite-plan cache (per session + student)
+# =========================
+# consecutive turns on the same topic reuse the last LITE plan (one LLM call per turn instead of two);
+# a new topic, PLAN_CACHE_TTL or refresh_plan=True generates a new one
+PLAN_CACHE = os.getenv("PLAN_CACHE", "1") == "1"
+PLAN_CACHE_TTL = int(os.getenv("PLAN_CACHE_TTL", "900"))
+# overlap coefficient between the question's topic terms and the plan's (below → new topic)
+PLAN_CACHE_TOPIC_OVERLAP = float(os.getenv("PLAN_CACHE_TOPIC_OVERLAP", "0.5"))
+_plan_cache = TieredCache(
+    "lite_plan",
+    max_entries=int(os.getenv("PLAN_CACHE_SIZE", "2000")),
+    ttl_seconds=PLAN_CACHE_TTL,
+    redis_ttl_seconds=PLAN_CACHE_TTL,
+    use_redis=os.getenv("PLAN_CACHE_REDIS", "1") == "1",
+    max_entry_bytes=int(os.getenv("PLAN_CACHE_MAX_ENTRY_BYTES", "16384")),
+)
 
 # =========================
 # Session / batching helpers
 # =========================
 
-def _user_only_text(history: List[Dict[str, Any]]) -> str:
+def _user_text(m: Dict[str, Any]) -> str:
     """
-    Extract only USER UTTERANCES from the history (less noise for schema_creator).
+    The entry's text if it is a USER UTTERANCE, else "" (less noise for schema_creator).
     """
-    parts: List[str] = []
-    for m in history:
-        role = (m.get("role") or "").lower()
-        content = (m.get("content") or "").strip()
-        if role == "user" and content:
-            parts.append(content)
-    return "\n".join(parts)
+    if (m.get("role") or "").lower() != "user":
+        return ""
+    return (m.get("content") or "").strip()
 
 
-def _chunk_text(s: str, max_chars: int) -> List[str]:
+def _new_packer() -> BatchPacker:
     """
-    Slice string into chunks of up to max_chars.
-    Simple and robust (does not rely on sentence boundaries).
+    schema_creator batches: whole utterances (sentences when needed) packed into as few
+    batches as the budget allows, repeated utterances dropped (see session_batch.BatchPacker).
     """
-    s = s or ""
-    if not s:
-        return []
-    chunks = []
-    i = 0
-    n = len(s)
-    while i < n:
-        chunks.append(s[i : i + max_chars])
-        i += max_chars
-    return chunks
+    return BatchPacker(SCHEMA_BATCH_CHARS, SCHEMA_BATCH_TOKENS or None)
 
 
-def _schema_eval_batch(batch_text: str) -> Dict[str, str]:
-    """
-    Sends ONE batch to schema_creator and returns a dict with guaranteed keys.
-    Uses quick local retries (in addition to requests' Retry).
-    """
+def _pack_pending(pending: str) -> List[str]:
+    """Batches for the compacted user text (one flattened utterance per line, see fold_summary)."""
+    packer = _new_packer()
+    out: List[str] = []
+    for line in (pending or "").split("\n"):
+        out += packer.add(line)
+    return out + packer.flush()
+
+
+def _require_schema_creator() -> None:
     if "schema_creator" not in AGENT_URLS:
         raise KeyError(
             "AGENT_URLS['schema_creator'] missing. Add in config.py: "
             "AGENT_URLS['schema_creator'] = f'{BASE_URL}/mirai_agents/schema_creator/ask'"
         )
 
-    payload = {
+
+def _schema_payload(batch_text: str) -> Dict[str, Any]:
+    return {
         "question": batch_text,
-        "model_name": "gemini-1.5-flash",
-        "temperature": 0.2,
+        **model_params("schema_eval", "schema_creator", batch_text),
     }
 
-    # light local attempts
-    last_err = None
-    for attempt in range(1, 3):  # 2 local attempts
-        try:
-            resp = call_agent(AGENT_URLS["schema_creator"], payload)
-            # Standardized API from the new router: returns direct keys
-            strong = (resp.get("strong_points") or "").strip()
-            weak = (resp.get("weak_points") or "").strip()
-            general = (resp.get("general_comments") or "").strip()
-            return {"strong_points": strong, "weak_points": weak, "general_comments": general}
-        except requests.HTTPError as e:
-            print(
-                f"[WARN] 502/5xx on {AGENT_URLS['schema_creator']}. "
-                f"Attempt {attempt}/2. Waiting {2**attempt:.1f}s…"
-            )
-            time.sleep(2**attempt)
-            last_err = e
-        except requests.RequestException as e:
-            print(
-                f"[WARN] Network error on {AGENT_URLS['schema_creator']} ({e}). "
-                f"Attempt {attempt}/2. Waiting {2**attempt:.1f}s…"
-            )
-            time.sleep(2**attempt)
-            last_err = e
 
-    # batch fallback: empty (does not interrupt the whole session)
-    print(f"[ERROR] schema_creator failed on batch: {last_err} — using empty placeholders.")
+def _parse_schema_eval(resp: Dict[str, Any]) -> Dict[str, str]:
+    # Standardized API from the new router: returns direct keys
+    strong = (resp.get("strong_points") or "").strip()
+    weak = (resp.get("weak_points") or "").strip()
+    general = (resp.get("general_comments") or "").strip()
+    return {"strong_points": strong, "weak_points": weak, "general_comments": general}
+
+
+def _empty_eval() -> Dict[str, str]:
     return {"strong_points": "", "weak_points": "", "general_comments": ""}
 
 
+def _schema_eval_failed(e: Exception) -> Dict[str, str]:
+    # batch fallback: empty (does not interrupt the whole session)
+    print(f"[ERROR] schema_creator failed on batch: {e} — using empty placeholders.")
+    return _empty_eval()
+
+
+def _schema_eval_batch(batch_text: str, fallback: bool = True) -> Dict[str, str]:
+    """
+    Sends ONE batch to schema_creator and returns a dict with guaranteed keys.
+    Retries come only from the agent client (shared per-agent retry budget, circuit breaker).
+    A failed call falls back to empty placeholders; fallback=False raises instead (incremental
+    eval retries the batch later). AgentUnavailable (circuit open / overloaded) always propagates:
+    finalize must not persist an empty evaluation and clear the session because of it.
+    """
+    _require_schema_creator()
+    try:
+        return _parse_schema_eval(post_agent("schema_creator", _schema_payload(batch_text)))
+    except AgentUnavailable:
+        raise
+    except requests.RequestException as e:
+        if not fallback:
+            raise
+        return _schema_eval_failed(e)
+
+
+async def _schema_eval_batch_async(batch_text: str) -> Dict[str, str]:
+    """Async version of _schema_eval_batch (same empty fallback; AgentUnavailable propagates)."""
+    _require_schema_creator()
+    try:
+        return _parse_schema_eval(await post_agent_async("schema_creator", _schema_payload(batch_text)))
+    except AgentUnavailable:
+        raise
+    except requests.RequestException as e:
+        return _schema_eval_failed(e)
+
+
+def _evaluate_chunks(chunks: Iterable[str], fallback: bool = True) -> List[Dict[str, str]]:
+    """
+    Evaluate batches concurrently (bounded by SCHEMA_EVAL_CONCURRENCY) as they are produced:
+    `chunks` may be a generator, at most SCHEMA_EVAL_CONCURRENCY batches are held at once.
+    Results keep the original chunk order; failed batches come back as empty placeholders
+    (fallback=False: the first failure is raised once the batches in flight finish).
+    """
+    def _one(idx: int, ch: str) -> Dict[str, str]:
+        print(f"[DEBUG] Evaluating batch {idx} | len={len(ch)}")
+        return _schema_eval_batch(ch, fallback)
+
+    if SCHEMA_EVAL_CONCURRENCY <= 1:
+        return [_one(idx, ch) for idx, ch in enumerate(chunks, start=1)]
+    evals: List[Dict[str, str]] = []
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=SCHEMA_EVAL_CONCURRENCY, thread_name_prefix="schema_eval") as pool:
+        for idx, ch in enumerate(chunks, start=1):
+            if len(in_flight) >= SCHEMA_EVAL_CONCURRENCY:
+                evals.append(in_flight.popleft().result())
+            in_flight.append(pool.submit(_one, idx, ch))
+        evals.extend(f.result() for f in in_flight)
+    return evals
+
+
+async def _evaluate_chunks_async(chunks: AsyncIterable[str]) -> List[Dict[str, str]]:
+    """Async version of _evaluate_chunks (semaphore-bounded tasks, order preserved)."""
+    sem = asyncio.Semaphore(SCHEMA_EVAL_CONCURRENCY)
+    tasks: List[asyncio.Task] = []
+
+    async def _one(idx: int, ch: str) -> Dict[str, str]:
+        try:
+            print(f"[DEBUG] Evaluating batch {idx} | len={len(ch)}")
+            return await _schema_eval_batch_async(ch)
+        finally:
+            sem.release()
+
+    try:
+        idx = 0
+        async for ch in chunks:
+            await sem.acquire()  # do not pull the next page/batch while the window is full
+            idx += 1
+            tasks.append(asyncio.create_task(_one(idx, ch)))
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        # a batch raised (e.g. AgentUnavailable) or we were cancelled: drop the rest
+        for t in tasks:
+            t.cancel()
+        raise
+
+
 def _aggregate_evals(evals: List[Dict[str, str]]) -> Dict[str, str]:
     """
     Merge lists of strengths/weaknesses/comments across batches.
@@ -194,149 +261,582 @@ def _aggregate_evals(evals: List[Dict[str, str]]) -> Dict[str, str]:
     return {"strong_points": strengths, "weak_points": weaknesses, "general_comments": comments}
 
 
+# =========================
+# Payload builders (shared by sync/async flows)
+# =========================
+
+def _lite_planner_payload(question: str) -> Dict[str, Any]:
+    # Planner LITE (less work): 5–7 bullets, max ~120–150 words
+    # we pass the instruction in the planner's "question" (its prompt uses this field)
+    planner_question = (
+        "Generate an ULTRA-COMPACT lesson plan (max ~120–150 words) in 5–7 bullets. "
+        "Focus on objectives, essential topics, practical activity, and comprehension check. "
+        "Avoid long text; keep bullets short."
+    )
+    return {
+        "question": planner_question,
+        "tema": "Aula personalizada",
+        "context_schema": f"Última pergunta do aluno: {question}",
+        **model_params("class_lite_plan", "planner", question),
+    }
+
+
+def _teacher_payload(question: str, plan_text: str | None) -> Dict[str, Any]:
+    return {
+        "question": question,
+        "plan": plan_text or FALLBACK_LITE_PLAN,
+        "context_schema": "Contexto mínimo; adaptar ao aluno.",
+        **model_params("class_teacher", "professor", question),
+    }
+
+
+def _compact_planner_payload(avaliacao: Dict[str, str]) -> Dict[str, Any]:
+    planner_question = (
+        "Based on the student's points below, generate a COMPACT PLAN (max ~150–200 words) "
+        "in short bullets (5–8 items), including: 1) objectives, 2) essential topics, "
+        "3) practical activity, 4) simple evaluation, 5) next steps."
+    )
+    compact_context = (
+        f"Pontos fortes: {avaliacao.get('strong_points','')}\n"
+        f"Pontos fracos: {avaliacao.get('weak_points','')}\n"
+        f"Observações: {avaliacao.get('general_comments','')}"
+    )
+    return {
+        "question": planner_question,
+        "tema": "Plano consolidado da sessão",
+        "context_schema": compact_context[:6000],  # avoid huge payloads
+        **model_params("class_compact_plan", "planner", compact_context[:6000]),
+    }
+
+
+def _plan_from(planner_resp: Any) -> str:
+    return planner_resp.get("plan") if isinstance(planner_resp, dict) else str(planner_resp)
+
+
+def _lesson_from(teacher_resp: Any) -> str:
+    return teacher_resp.get("lesson") if isinstance(teacher_resp, dict) else str(teacher_resp)
+
+
+def _turn_deadline(deadline: Optional[Deadline]) -> Optional[Deadline]:
+    return deadline if deadline is not None else deadline_from(CLASS_TURN_DEADLINE_SECONDS)
+
+
+def _planner_deadline(deadline: Optional[Deadline]) -> Optional[Deadline]:
+    return deadline.share(CLASS_PLANNER_BUDGET_SHARE) if deadline is not None else None
+
+
+def _plan_cache_key(session_id: Optional[str], aluno_uuid: Optional[str]) -> Optional[str]:
+    if not PLAN_CACHE or not session_id:
+        return None
+    return cache_key({"session_id": session_id, "aluno_uuid": aluno_uuid or ""})
+
+
+def _reusable_plan(entry: Optional[Dict[str, Any]], question: str) -> Optional[str]:
+    if not entry:
+        return None
+    terms = topic_terms(question)
+    if not terms:
+        # follow-ups without content words ("e depois?", "não entendi") stay on the topic
+        return entry.get("plan")
+    overlap = topic_overlap(terms, set(entry.get("terms") or []))
+    return entry.get("plan") if overlap is not None and overlap >= PLAN_CACHE_TOPIC_OVERLAP else None
+
+
+def _plan_entry(question: str, plan_text: str) -> Dict[str, Any]:
+    return {"plan": plan_text, "terms": sorted(topic_terms(question))}
+
+
+def _should_cache_plan(question: str, plan_text: Optional[str], plan_cached: bool) -> bool:
+    # only newly generated plans (a reused one is already there; the fallback is not a plan)
+    # for a question with a topic ("oi", "bom dia!" have none to match the next turns against)
+    return (
+        not plan_cached and bool(plan_text) and plan_text != FALLBACK_LITE_PLAN
+        and bool(topic_terms(question))
+    )
+
+
+class ClassTurn(NamedTuple):
+    plan_text: str
+    teacher_text: str
+    plan_cached: bool = False  # plan reused from the lite-plan cache (nothing to store on commit)
+
+
+def _warn_plan_fallback(e: Exception) -> None:
+    print(f"[WARN] [class_session] Planner LITE over its budget or unavailable, teacher uses the fallback plan: {e}")
+
+
+def _finalize_packer(summary: Dict[str, str]) -> Tuple[BatchPacker, List[str]]:
+    """
+    Packer for finalize, seeded with the compacted-but-not-evaluated user text
+    (see session_store.compact_session). Returns (packer, batches already full).
+    """
+    packer = _new_packer()
+    ready: List[str] = []
+    for line in (summary or {}).get("pending_user_text", "").split("\n"):
+        ready += packer.add(line)
+    return packer, ready
+
+
+def _finalize_rest(packer: BatchPacker, seen: int, summary: Dict[str, str], has_partial: bool) -> List[str]:
+    """
+    Last batch once the history pages are exhausted.
+    has_partial: background evaluations already exist, so an empty tail needs no placeholder.
+    """
+    out = packer.flush()
+    if not packer.batches:
+        if not (seen or has_partial or summary):
+            raise ValueError("No history found for this session.")
+        if has_partial:
+            print("[DEBUG] Nothing left to evaluate (all covered by incremental evals)")
+            return []
+        # ensure there is always something for schema_creator
+        out = ["No user utterances recorded in this session."]
+    print(
+        f"[DEBUG] Total chars (user-only)={packer.chars} | batches={packer.batches} "
+        f"| batch_limit={packer.limit} | repeats_dropped={packer.repeats}"
+    )
+    return out
+
+
+def _finalize_batches(session_id: str, cursor: Optional[str], summary: Dict[str, str], has_partial: bool):
+    """
+    Generator of schema_creator batches for the not-yet-evaluated history: pages through
+    the entries after `cursor` and packs user text as it goes (memory stays ~one page + one batch).
+    """
+    packer, ready = _finalize_packer(summary)
+    yield from ready
+    seen = 0
+    for _, m in iter_session_messages(session_id, cursor):
+        seen += 1
+        text = _user_text(m)
+        if text:
+            yield from packer.add(text)
+    yield from _finalize_rest(packer, seen, summary, has_partial)
+
+
+async def _finalize_batches_async(session_id: str, cursor: Optional[str], summary: Dict[str, str], has_partial: bool):
+    """Async version of _finalize_batches."""
+    packer, ready = _finalize_packer(summary)
+    for b in ready:
+        yield b
+    seen = 0
+    async for _, m in iter_session_messages_async(session_id, cursor):
+        seen += 1
+        text = _user_text(m)
+        if text:
+            for b in packer.add(text):
+                yield b
+    for b in _finalize_rest(packer, seen, summary, has_partial):
+        yield b
+
+
+def _lock_refreshing(chunks: Iterable[str], session_id: str, token: Optional[str], stop_on_loss: bool = True):
+    """
+    Pass batches through, renewing the session lock's TTL before each one, so a long pass
+    never outlives it. If the lock was lost (expired and taken by another worker), stop
+    (stop_on_loss) — the token-fenced append then writes nothing.
+    """
+    for ch in chunks:
+        if token and not refresh_eval_lock(session_id, token):
+            print(f"[WARN] Eval lock lost for session={session_id}")
+            if stop_on_loss:
+                return
+            token = None
+        yield ch
+
+
+async def _lock_refreshing_async(chunks: AsyncIterable[str], session_id: str, token: Optional[str]):
+    """Async version of _lock_refreshing (finalize: keeps going if the lock was lost)."""
+    async for ch in chunks:
+        if token and not await refresh_eval_lock_async(session_id, token):
+            print(f"[WARN] Eval lock lost for session={session_id}")
+            token = None
+        yield ch
+
+
+def _warn_finalize_lock(session_id: str) -> None:
+    print(
+        f"[WARN] Finalize session={session_id}: background evaluation still running after "
+        f"{FINALIZE_EVAL_LOCK_WAIT}s, finalizing anyway (its writes are dropped once the session is cleared)"
+    )
+
+
+def _question_only(question: str) -> List[Dict[str, Any]]:
+    # a turn whose agents failed still keeps what the student asked (history + later evaluation)
+    return [{"role": "user", "content": question}]
+
+
+def _turn_messages(question: str, plan_text: str | None, teacher_text: str | None) -> List[Dict[str, Any]]:
+    return [
+        {"role": "user", "content": question},
+        {"role": "agent", "content": f"[PLANO LITE]\n{plan_text}"},
+        {"role": "agent", "content": f"[PROFESSOR]\n{teacher_text}"},
+    ]
+
+
+def _new_sessao(aluno_uuid: str, avaliacao: Dict[str, str], plan_text: str | None) -> SessaoAluno:
+    return SessaoAluno(
+        id_estudante=aluno_uuid,
+        strong_points=avaliacao.get("strong_points") or None,
+        weak_points=avaliacao.get("weak_points") or None,
+        general_comments=avaliacao.get("general_comments") or None,
+        tema=plan_text or "Plano compacto gerado",
+    )
+
+
+# =========================
+# Incremental (background) evaluation
+# =========================
+
+def _pending_user_batch(entries: Iterable[Tuple[str, Dict[str, Any]]]) -> Tuple[List[str], str | None]:
+    """
+    Pack whole history entries (id, message) until the next user utterance no longer fits
+    in the open batch, i.e. until one batch is full.
+    Returns (batches, id of the last entry taken); ([], None) while no batch is full yet.
+    """
+    packer = _new_packer()
+    ready: List[str] = []
+    last_id = None
+    for entry_id, m in entries:
+        text = _user_text(m)
+        if text and packer.has_open_batch() and not packer.fits(text):
+            return ready + packer.flush(), last_id
+        if text:
+            ready += packer.add(text)
+        last_id = entry_id
+    return [], None
+
+
+def evaluate_pending(session_id: str) -> int:
+    """
+    Evaluate every full batch of un-evaluated user text and store the partial
+    evaluations next to the session. Returns how many batches were evaluated.
+    The cursor (and the compacted pending text) only move once every batch of a step
+    succeeded: on an agent failure the pass stops and the next one (or finalize) retries.
+    """
+    token = acquire_eval_lock(session_id)
+    if not token:
+        return 0  # another worker is already on this session
+    done = 0
+    try:
+        # user text of compacted turns (moved out of the history before being evaluated)
+        pending = get_session_summary(session_id).get("pending_user_text", "")
+        if pending:
+            cursor, _ = get_partial_evals(session_id)
+            chunks = _pack_pending(pending)
+            evals = _evaluate_chunks(_lock_refreshing(chunks, session_id, token), fallback=False)
+            if not append_partial_evals(session_id, evals, cursor, clear_pending=True, lock_token=token):
+                return done  # session finalized/expired (or lock lost) meanwhile: nothing to keep
+            done += len(chunks)
+
+        while True:
+            # only entries after the cursor are read, page by page, up to one batch of user text
+            cursor, _ = get_partial_evals(session_id)
+            chunks, last_id = _pending_user_batch(iter_session_messages(session_id, cursor))
+            if last_id is None:
+                break
+            evals = _evaluate_chunks(_lock_refreshing(chunks, session_id, token), fallback=False)
+            if not append_partial_evals(session_id, evals, last_id, lock_token=token):
+                return done
+            done += len(chunks)
+            print(f"[DEBUG] Incremental eval session={session_id} batches={len(chunks)} cursor={last_id}")
+    except AgentUnavailable:
+        raise
+    except requests.RequestException as e:
+        print(f"[WARN] Incremental eval stopped for session={session_id}, cursor kept: {e}")
+    finally:
+        release_eval_lock(session_id, token)
+    return done
+
+
+def _evaluate_pending_safe(session_id: str) -> None:
+    try:
+        evaluate_pending(session_id)
+    except Exception as e:
+        # background stage must never break the session; finalize evaluates whatever is left
+        print(f"[WARN] Incremental evaluation failed for session={session_id}: {e}")
+
+
+def schedule_incremental_eval(session_id: str) -> None:
+    """Fire-and-forget: queue a background evaluation pass for this session (no-op if disabled)."""
+    if INCREMENTAL_EVAL:
+        _incremental_pool.submit(_evaluate_pending_safe, session_id)
+
+
+def shutdown_incremental_eval() -> None:
+    """Stop accepting background passes (app shutdown); pending ones are dropped."""
+    _incremental_pool.shutdown(wait=False, cancel_futures=True)
+
+
 # =========================
 # Session flows
 # =========================
 
-def run_class_session(aluno_uuid: str, question: str, session_id: str) -> Dict[str, Any]:
+def _lite_plan(
+    question: str, deadline: Optional[Deadline], cache_key_: Optional[str], refresh: bool
+) -> Tuple[str, bool]:
+    """(plan_text, reused from cache)."""
+    if cache_key_ and not refresh:
+        plan_text = _reusable_plan(_plan_cache.get(cache_key_), question)
+        if plan_text:
+            return plan_text, True
+    try:
+        planner_resp = post_agent("planner", _lite_planner_payload(question), deadline=_planner_deadline(deadline))
+        return _plan_from(planner_resp), False
+    except (requests.Timeout, AgentUnavailable) as e:
+        _warn_plan_fallback(e)
+        return FALLBACK_LITE_PLAN, False
+
+
+def run_class_session(
+    aluno_uuid: str,
+    question: str,
+    session_id: str,
+    deadline: Optional[Deadline] = None,
+    refresh_plan: bool = False,
+) -> Dict[str, Any]:
     """
     “Online” study session:
-      - Saves the question in Redis
-      - Requests a LITE PLAN from the Planner (ultra-compact) to reduce cost/latency
+      - Requests a LITE PLAN from the Planner (ultra-compact) to reduce cost/latency,
+        or reuses the session's cached one while the topic stays the same (refresh_plan forces a new one)
       - Calls Teacher with that plan
-      - Saves responses in Redis (no Postgres persistence yet)
+      - Saves question + responses in Redis in one round trip (no Postgres access in this phase);
+        if the teacher fails or runs out of time, only the question is saved and the error propagates
+    The whole turn shares `deadline` (default CLASS_TURN_DEADLINE_SECONDS): the planner gets
+    CLASS_PLANNER_BUDGET_SHARE of it and, if it can't make it, the teacher uses FALLBACK_LITE_PLAN.
     """
-    engine = create_engine(DATABASE_URL)
-    SessionLocal = sessionmaker(bind=engine)
-    db = SessionLocal()
+    deadline = _turn_deadline(deadline)
+    plan_key = _plan_cache_key(session_id, aluno_uuid)
 
     try:
-        # 1) User message
-        save_session_message(session_id, role="user", content=question)
-
-        # 2) Planner LITE (less work): 5–7 bullets, max ~120–150 words
-        #    we pass the instruction in the planner's "question" (its prompt uses this field)
-        planner_question = (
-            "Generate an ULTRA-COMPACT lesson plan (max ~120–150 words) in 5–7 bullets. "
-            "Focus on objectives, essential topics, practical activity, and comprehension check. "
-            "Avoid long text; keep bullets short."
-        )
-        planner_payload = {
-            "question": planner_question,
-            "tema": "Aula personalizada",
-            "context_schema": f"Última pergunta do aluno: {question}",
-            "model_name": "gemini-1.5-flash",
-            "temperature": 0.2,
-        }
-        planner_resp = call_agent(AGENT_URLS["planner"], planner_payload)
-        plan_text = planner_resp.get("plan") if isinstance(planner_resp, dict) else str(planner_resp)
-
-        save_session_message(session_id, role="agent", content=f"[PLANO LITE]\n{plan_text}")
-
-        # 3) Teacher with LITE plan
-        teacher_payload = {
-            "question": question,
-            "plan": plan_text or "Plano enxuto: objetivos, tópicos, prática, checagem.",
-            "context_schema": "Contexto mínimo; adaptar ao aluno.",
-            "model_name": "gemini-1.5-flash",
-            "temperature": 0.4,
-        }
-        teacher_resp = call_agent(AGENT_URLS["professor"], teacher_payload)
-        teacher_text = teacher_resp.get("lesson") if isinstance(teacher_resp, dict) else str(teacher_resp)
-        save_session_message(session_id, role="agent", content=f"[PROFESSOR]\n{teacher_text}")
-
-        return {"status": "ok", "planner": {"plan": plan_text}, "professor": {"lesson": teacher_text}}
+        # 1) Planner LITE (cached, or within its share of the budget)
+        plan_text, plan_cached = _lite_plan(question, deadline, plan_key, refresh_plan)
 
-    finally:
-        db.close()
+        # 2) Teacher with LITE plan (rest of the budget)
+        teacher_resp = post_agent("professor", _teacher_payload(question, plan_text), deadline=deadline)
+        teacher_text = _lesson_from(teacher_resp)
+    except Exception:
+        save_session_messages(session_id, _question_only(question))
+        raise
+
+    # 3) Whole turn (question, plan, lesson) in ONE Redis round trip
+    save_session_messages(session_id, _turn_messages(question, plan_text, teacher_text))
+    if plan_key and _should_cache_plan(question, plan_text, plan_cached):
+        _plan_cache.set(plan_key, _plan_entry(question, plan_text))
+
+    # 4) Background evaluation of user text accumulated so far (if past the batch size)
+    schedule_incremental_eval(session_id)
+
+    return {"status": "ok", "planner": {"plan": plan_text}, "professor": {"lesson": teacher_text}}
 
 
 def finalize_session_with_plan(aluno_uuid: str, session_id: str) -> Dict[str, Any]:
     """
     End of session:
-      - Retrieves history from Redis
-      - Sends ONLY USER UTTERANCES to schema_creator in BATCHES
+      - Pages through the history (never loaded whole; see session_store.iter_session_messages)
+      - Sends ONLY USER UTTERANCES not yet evaluated in background to schema_creator in BATCHES
       - Aggregates strong/weak/general
       - Calls COMPACT Planner (also lean)
       - Persists to Postgres
       - Clears Redis
+    Holds the session's eval lock (waiting up to FINALIZE_EVAL_LOCK_WAIT for a background
+    pass to finish), so no incremental evaluation writes between the read and the clear.
     """
-    engine = create_engine(DATABASE_URL)
-    SessionLocal = sessionmaker(bind=engine)
-    db = SessionLocal()
-
+    token = wait_eval_lock(session_id, FINALIZE_EVAL_LOCK_WAIT)
+    if not token:
+        _warn_finalize_lock(session_id)
     try:
-        history = get_session_history(session_id)
-        if not history:
-            raise ValueError("No history found for this session.")
-
-        # 1) Only user utterances
-        user_only = _user_only_text(history)
-        total_chars = len(user_only)
-        if total_chars == 0:
-            # ensure there is always something for schema_creator
-            user_only = "No user utterances recorded in this session."
-        print(f"[DEBUG] Total chars (user-only)={len(user_only)}")
-
-        # 2) Batches to schema_creator
-        BATCH = 1800
-        chunks = _chunk_text(user_only, BATCH)
-        print(f"[DEBUG] Batches={len(chunks)} | batch_size={BATCH}")
-        evals: List[Dict[str, str]] = []
-        for idx, ch in enumerate(chunks, start=1):
-            print(f"[DEBUG] Evaluating batch {idx}/{len(chunks)} | len={len(ch)}")
-            eval_result = _schema_eval_batch(ch)
-            evals.append(eval_result)
+        # only the tail not yet covered by incremental evaluation (+ compacted, un-evaluated turns),
+        # streamed page by page into batches (raises ValueError if the session has no history)
+        cursor, partial = get_partial_evals(session_id)
+        summary = get_session_summary(session_id)
+        batches = _finalize_batches(session_id, cursor, summary, bool(partial))
+        evals = partial + _evaluate_chunks(_lock_refreshing(batches, session_id, token, stop_on_loss=False))
 
         avaliacao = _aggregate_evals(evals)
 
         # 3) COMPACT Planner (less work)
-        planner_question = (
-            "Based on the student's points below, generate a COMPACT PLAN (max ~150–200 words) "
-            "in short bullets (5–8 items), including: 1) objectives, 2) essential topics, "
-            "3) practical activity, 4) simple evaluation, 5) next steps."
+        planner_resp = post_agent("planner", _compact_planner_payload(avaliacao))
+        plan_text = _plan_from(planner_resp)
+
+        # 4) Persist to DB (shared pool; connection held only for the insert)
+        with SessionLocal() as db:
+            nova_sessao = _new_sessao(aluno_uuid, avaliacao, plan_text)
+            db.add(nova_sessao)
+            db.commit()
+            db.refresh(nova_sessao)
+    except BaseException:
+        if token:
+            release_eval_lock(session_id, token)  # session kept: background passes may resume
+        raise
+
+    # 5) Clear Redis (history, evals and the lock; plus the session's cached LITE plan)
+    clear_session(session_id)
+    plan_key = _plan_cache_key(session_id, aluno_uuid)
+    if plan_key:
+        _plan_cache.delete(plan_key)
+
+    return {
+        "status": "finalizado",
+        "sessao_uuid": str(nova_sessao.uuid),
+        "avaliacao": avaliacao,
+        "plano": plan_text,
+    }
+
+
+# =========================
+# Session flows (async)
+# =========================
+
+async def _lite_plan_async(
+    question: str, deadline: Optional[Deadline], cache_key_: Optional[str], refresh: bool
+) -> Tuple[str, bool]:
+    """Async version of _lite_plan (reads the cache only; the plan is stored on commit)."""
+    if cache_key_ and not refresh:
+        plan_text = _reusable_plan(await _plan_cache.get_async(cache_key_), question)
+        if plan_text:
+            return plan_text, True
+    try:
+        planner_resp = await post_agent_async(
+            "planner", _lite_planner_payload(question), deadline=_planner_deadline(deadline)
         )
-        compact_context = (
-            f"Pontos fortes: {avaliacao.get('strong_points','')}\n"
-            f"Pontos fracos: {avaliacao.get('weak_points','')}\n"
-            f"Observações: {avaliacao.get('general_comments','')}"
+        return _plan_from(planner_resp), False
+    except (requests.Timeout, AgentUnavailable) as e:
+        _warn_plan_fallback(e)
+        return FALLBACK_LITE_PLAN, False
+
+
+async def class_turn_async(
+    question: str,
+    deadline: Optional[Deadline] = None,
+    *,
+    session_id: Optional[str] = None,
+    aluno_uuid: Optional[str] = None,
+    refresh_plan: bool = False,
+) -> ClassTurn:
+    """
+    Planner LITE (or the session's cached plan) + Teacher only, no side effects
+    (speculative execution commits it later).
+    """
+    deadline = _turn_deadline(deadline)
+    plan_text, plan_cached = await _lite_plan_async(
+        question, deadline, _plan_cache_key(session_id, aluno_uuid), refresh_plan
+    )
+
+    teacher_resp = await post_agent_async("professor", _teacher_payload(question, plan_text), deadline=deadline)
+    teacher_text = _lesson_from(teacher_resp)
+    return ClassTurn(plan_text, teacher_text, plan_cached)
+
+
+async def commit_class_turn_async(
+    session_id: str,
+    question: str,
+    plan_text: str,
+    teacher_text: str,
+    plan_cached: bool = False,
+    *,
+    aluno_uuid: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Persist a turn computed by class_turn_async (one round trip), remember a newly
+    generated plan for the next turns and queue the background eval.
+    """
+    await save_session_messages_async(session_id, _turn_messages(question, plan_text, teacher_text))
+    plan_key = _plan_cache_key(session_id, aluno_uuid)
+    if plan_key and _should_cache_plan(question, plan_text, plan_cached):
+        await _plan_cache.set_async(plan_key, _plan_entry(question, plan_text))
+
+    schedule_incremental_eval(session_id)
+
+    return {"status": "ok", "planner": {"plan": plan_text}, "professor": {"lesson": teacher_text}}
+
+
+async def run_class_session_async(
+    aluno_uuid: str,
+    question: str,
+    session_id: str,
+    deadline: Optional[Deadline] = None,
+    refresh_plan: bool = False,
+) -> Dict[str, Any]:
+    """Async version of run_class_session (httpx + redis.asyncio, no DB access)."""
+    try:
+        turn = await class_turn_async(
+            question, deadline, session_id=session_id, aluno_uuid=aluno_uuid, refresh_plan=refresh_plan
         )
-        planner_payload = {
-            "question": planner_question,
-            "tema": "Plano consolidado da sessão",
-            "context_schema": compact_context[:6000],  # avoid huge payloads
-            "model_name": "gemini-1.5-flash",
-            "temperature": 0.2,
-        }
-        planner_resp = call_agent(AGENT_URLS["planner"], planner_payload)
-        plan_text = planner_resp.get("plan") if isinstance(planner_resp, dict) else str(planner_resp)
-
-        # 4) Persist to DB
-        SessionCls = sessionmaker(bind=engine)
-        db = SessionCls()
-        nova_sessao = SessaoAluno(
-            id_estudante=aluno_uuid,
-            strong_points=avaliacao.get("strong_points") or None,
-            weak_points=avaliacao.get("weak_points") or None,
-            general_comments=avaliacao.get("general_comments") or None,
-            tema=plan_text or "Plano compacto gerado",
+    except Exception:
+        await save_session_messages_async(session_id, _question_only(question))
+        raise
+    return await commit_class_turn_async(session_id, question, *turn, aluno_uuid=aluno_uuid)
+
+
+async def stream_class_session_async(
+    aluno_uuid: str,
+    question: str,
+    session_id: str,
+    deadline: Optional[Deadline] = None,
+    refresh_plan: bool = False,
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Streaming version of run_class_session_async: ("plan", {"plan"}) once the LITE plan is
+    ready, ("delta", {"text"}) as the teacher writes the lesson, then the assembled turn is
+    persisted and ("done", ...) is yielded. If the stream is abandoned, nothing is saved.
+    """
+    deadline = _turn_deadline(deadline)
+    plan_text, plan_cached = await _lite_plan_async(
+        question, deadline, _plan_cache_key(session_id, aluno_uuid), refresh_plan
+    )
+    yield "plan", {"plan": plan_text}
+
+    parts = []
+    async for delta in stream_agent_async(
+        "professor", _teacher_payload(question, plan_text), _lesson_from, deadline=deadline
+    ):
+        parts.append(delta)
+        yield "delta", {"text": delta}
+
+    await commit_class_turn_async(session_id, question, plan_text, "".join(parts), plan_cached, aluno_uuid=aluno_uuid)
+    yield "done", {"status": "ok"}
+
+
+async def finalize_session_with_plan_async(aluno_uuid: str, session_id: str) -> Dict[str, Any]:
+    """Async version of finalize_session_with_plan (persists through the async SQLAlchemy engine)."""
+    token = await wait_eval_lock_async(session_id, FINALIZE_EVAL_LOCK_WAIT)
+    if not token:
+        _warn_finalize_lock(session_id)
+    try:
+        cursor, partial = await get_partial_evals_async(session_id)
+        summary = await get_session_summary_async(session_id)
+        evals = partial + await _evaluate_chunks_async(
+            _lock_refreshing_async(_finalize_batches_async(session_id, cursor, summary, bool(partial)), session_id, token)
         )
-        db.add(nova_sessao)
-        db.commit()
-        db.refresh(nova_sessao)
 
-        # 5) Clear Redis
-        clear_session(session_id)
+        avaliacao = _aggregate_evals(evals)
 
-        return {
-            "status": "finalizado",
-            "sessao_uuid": str(nova_sessao.uuid),
-            "avaliacao": avaliacao,
-            "plano": plan_text,
-        }
+        planner_resp = await post_agent_async("planner", _compact_planner_payload(avaliacao))
+        plan_text = _plan_from(planner_resp)
+
+        AsyncSessionLocal = get_async_sessionmaker()
+        async with AsyncSessionLocal() as db:
+            nova_sessao = _new_sessao(aluno_uuid, avaliacao, plan_text)
+            db.add(nova_sessao)
+            await db.commit()
+            await db.refresh(nova_sessao)
+    except BaseException:
+        if token:
+            await release_eval_lock_async(session_id, token)
+        raise
 
-    finally:
-        db.close()
+    await clear_session_async(session_id)
+    plan_key = _plan_cache_key(session_id, aluno_uuid)
+    if plan_key:
+        await _plan_cache.delete_async(plan_key)
+
+    return {
+        "status": "finalizado",
+        "sessao_uuid": str(nova_sessao.uuid),
+        "avaliacao": avaliacao,
+        "plano": plan_text,
+    }
 
 
 # =========================
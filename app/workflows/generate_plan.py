@@ -1,19 +1,16 @@
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import text
 import requests
-from config import AGENT_URLS
-import os
-
-DATABASE_URL = os.getenv("DATABASE_URL")
+from app.utils.agent_client import post_agent
+from app.utils.model_router import model_params
+from database import engine as shared_engine, SessionLocal
 
 
 def ping_db():
     try:
-        engine = create_engine(DATABASE_URL)
-        with engine.connect() as conn:
+        with shared_engine.connect() as conn:
             conn.execute(text("SELECT 1"))
         print("[OK] Database connection established.")
-        return engine
+        return shared_engine
     except Exception as e:
         print(f"[ERROR][1] Failed to connect to the database: {e}")
         exit(1)
@@ -33,7 +30,6 @@ def check_table_exists(engine):
 
 
 def get_last_sessao_aluno(engine, aluno_uuid: str):
-    SessionLocal = sessionmaker(bind=engine)
     db = SessionLocal()
     try:
         result = db.execute(
@@ -63,16 +59,17 @@ def get_last_sessao_aluno(engine, aluno_uuid: str):
         db.close()
 
 
-def gerar_plano_aula(contexto_aluno: str, model_name: str = "gemini-2.5-pro"):
-    url = AGENT_URLS["planner"]  # uses centralized endpoint
+def gerar_plano_aula(contexto_aluno: str, model_name: str | None = None):
+    # model_name explícito vence; senão o roteador escolhe (gemini-2.5-pro, ou o rápido sob carga)
     payload = {
         "question": contexto_aluno,
-        "model_name": model_name
+        "model_name": model_name or model_params("lesson_plan", "planner", contexto_aluno)["model_name"]
     }
-    resp = requests.post(url, json=payload, timeout=30)
-    if not resp.ok:
-        raise Exception(f"Error when calling Planner: {resp.status_code} {resp.text}")
-    return resp.json().get("plan", resp.text)
+    try:
+        data = post_agent("planner", payload)  # shared pooled client
+    except requests.HTTPError as e:
+        raise Exception(f"Error when calling Planner: {e}") from e
+    return data.get("plan", data.get("raw", ""))
 
 
 if __name__ == "__main__":
@@ -6,6 +6,35 @@ from datetime import datetime
 from app.data.fake_db import SESSOES_ALUNO
 
 
+# Query kinds recognized in free text (PT and EN), checked in this order.
+# Shared with the guardrails fast path (app.workflows.guardrails_fastpath).
+QUERY_PATTERNS = [
+    # PT: (minha|meu) ... (última|ultima) ... sessão | EN: my ... last ... session
+    ("last_session", re.compile(r"\b(minha|meu)\b.*\b(última|ultima)\b.*\bsess[aã]o|\bmy\b.*\blast\b.*\bsession\b")),
+    # PT: (resumo|minhas) ... sessão | EN: (summary|summarize) ... (my|of my) ... sessions
+    ("sessions_summary", re.compile(r"\b(resumo|minhas)\b.*\bsess[aã]o|\b(summary|summarize)\b.*\b(my|of my)\b.*\bsessions?\b")),
+    # PT: (meus|minhas) ... (pontos fortes|pontos fracos|forças|fraquezas) | EN: my ... (strengths|weaknesses|...)
+    ("my_points", re.compile(
+        r"\b(meus|minhas)\b.*\b(pontos fortes|pontos fracos|forças|fraquezas)"
+        r"|\bmy\b.*\b(strengths|weaknesses|strong points|weak points)\b"
+    )),
+    # PT: (tema|temas|assunto|assuntos) ... (frequentes|recorrentes|mais estudados)
+    # EN: (theme|themes|topic|topics) ... (frequent|most frequent|recurring|most studied)
+    ("top_themes", re.compile(
+        r"\b(temas?|assuntos?)\b.*\b(frequentes|recorrentes|mais estudados?)"
+        r"|\b(themes?|topics?)\b.*\b(frequent|most frequent|recurring|most studied)\b"
+    )),
+]
+
+
+def match_query_kind(text: str) -> Optional[str]:
+    """Kind of analytics query in the (lower-cased) text, or None if unsupported."""
+    for kind, pattern in QUERY_PATTERNS:
+        if pattern.search(text):
+            return kind
+    return None
+
+
 def _require_user_uuid(context: Dict[str, Any]) -> str:
     """
     Get the user (student) identifier from the given context.
@@ -101,16 +130,12 @@ def run_generate_query(
     """
     context = context or {}
     text = (question or "").strip().lower()
+    kind = match_query_kind(text)
 
     # -------------------------
     # 1) "my last session"
-    #    PT: (minha|meu) ... (última|ultima) ... sessão
-    #    EN: my ... last ... session
     # -------------------------
-    if (
-        re.search(r"\b(minha|meu)\b.*\b(última|ultima)\b.*\bsess[aã]o", text)
-        or re.search(r"\bmy\b.*\blast\b.*\bsession\b", text)
-    ):
+    if kind == "last_session":
         uid = _require_user_uuid(context)
         last = _last_sessions_for_user(uid, limit=1)
         if not last:
@@ -135,13 +160,8 @@ def run_generate_query(
 
     # -------------------------
     # 2) "summary of my sessions (N)"
-    #    PT: (resumo|minhas) ... sessão
-    #    EN: (summary|summarize) ... (my|of my) ... sessions
     # -------------------------
-    if (
-        re.search(r"\b(resumo|minhas)\b.*\bsess[aã]o", text)
-        or re.search(r"\b(summary|summarize)\b.*\b(my|of my)\b.*\bsessions?\b", text)
-    ):
+    if kind == "sessions_summary":
         uid = _require_user_uuid(context)
         top_n = _parse_top_n(text, default=5)
         rows = _last_sessions_for_user(uid, limit=top_n)
@@ -158,13 +178,8 @@ def run_generate_query(
 
     # -------------------------
     # 3) "my strengths/weaknesses (N)"
-    #    PT: (meus|minhas) ... (pontos fortes|pontos fracos|forças|fraquezas)
-    #    EN: my ... (strengths|weaknesses|strong points|weak points)
     # -------------------------
-    if (
-        re.search(r"\b(meus|minhas)\b.*\b(pontos fortes|pontos fracos|forças|fraquezas)", text)
-        or re.search(r"\bmy\b.*\b(strengths|weaknesses|strong points|weak points)\b", text)
-    ):
+    if kind == "my_points":
         uid = _require_user_uuid(context)
         top_n = _parse_top_n(text, default=5)
         rows = _last_sessions_for_user(uid, limit=top_n)
@@ -181,13 +196,8 @@ def run_generate_query(
 
     # -------------------------
     # 4) "most frequent themes (N)"
-    #    PT: (tema|temas|assunto|assuntos) ... (frequentes|recorrentes|mais estudados)
-    #    EN: (theme|themes|topic|topics) ... (frequent|most frequent|recurring|most studied)
     # -------------------------
-    if (
-        re.search(r"\b(temas?|assuntos?)\b.*\b(frequentes|recorrentes|mais estudados?)", text)
-        or re.search(r"\b(themes?|topics?)\b.*\b(frequent|most frequent|recurring|most studied)\b", text)
-    ):
+    if kind == "top_themes":
         uid = _require_user_uuid(context)
         rows = _last_sessions_for_user(uid, limit=50)  # take a generous window
         freq: Dict[str, int] = {}
@@ -0,0 +1,121 @@
+# app/workflows/guardrails_batcher.py
+"""
+Optional micro-batching of guardrails calls (async path).
+
+Requests arriving within GUARDRAILS_BATCH_WINDOW_MS (up to GUARDRAILS_BATCH_MAX)
+go to the agent as ONE payload:
+    POST AGENT_URLS["guardrails_batch"]  {"items": [<guardrails payload>, ...]}
+    → {"results": [<same body as the single endpoint>, ...]}   (same order)
+and each waiting caller gets its own result back.
+
+Fallback is transparent: batching off, no "guardrails_batch" URL, a batch of one,
+or a failed/malformed batch response → the usual single request per payload.
+Local stand-in agent with the batch endpoint: `python -m utils.guardrails_batch_agent`.
+"""
+import asyncio
+import os
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from config import AGENT_URLS
+from app.utils.agent_client import post_agent_async
+
+GUARDRAILS_BATCH = os.getenv("GUARDRAILS_BATCH", "0") == "1"
+GUARDRAILS_BATCH_WINDOW_MS = float(os.getenv("GUARDRAILS_BATCH_WINDOW_MS", "5"))
+GUARDRAILS_BATCH_MAX = int(os.getenv("GUARDRAILS_BATCH_MAX", "32"))
+
+_stats = {"batches": 0, "batched_items": 0, "singles": 0, "fallbacks": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(**deltas: int) -> None:
+    with _stats_lock:
+        for k, v in deltas.items():
+            _stats[k] += v
+
+
+class GuardrailsBatcher:
+    """Collects payloads on one event loop and flushes them by time window or size."""
+
+    def __init__(self, window_ms: float = GUARDRAILS_BATCH_WINDOW_MS, max_size: int = GUARDRAILS_BATCH_MAX):
+        self.loop = asyncio.get_running_loop()
+        self.window = window_ms / 1000.0
+        self.max_size = max(1, max_size)
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._sending: Set[asyncio.Task] = set()
+
+    async def submit(self, payload: Dict[str, Any]) -> Any:
+        fut = self.loop.create_future()
+        self._pending.append((payload, fut))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = self.loop.call_later(self.window, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = self.loop.create_task(self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        if len(batch) == 1:
+            _count(singles=1)
+            await _single(*batch[0])
+            return
+        try:
+            data = await post_agent_async("guardrails_batch", {"items": [p for p, _ in batch]})
+            results = data.get("results") if isinstance(data, dict) else None
+            if not isinstance(results, list) or len(results) != len(batch):
+                raise ValueError(f"expected {len(batch)} results, got {type(results).__name__}")
+        except Exception as e:
+            print(f"[WARN] [guardrails_batch] batch of {len(batch)} failed, falling back to single calls: {e}")
+            _count(fallbacks=1, singles=len(batch))
+            await asyncio.gather(*(_single(p, f) for p, f in batch))
+            return
+        _count(batches=1, batched_items=len(batch))
+        for (_, fut), res in zip(batch, results):
+            if not fut.done():  # caller may have been cancelled
+                fut.set_result(res)
+
+
+async def _single(payload: Dict[str, Any], fut: asyncio.Future) -> None:
+    try:
+        res = await post_agent_async("guardrails", payload)
+    except Exception as e:
+        if not fut.done():
+            fut.set_exception(e)
+        return
+    if not fut.done():
+        fut.set_result(res)
+
+
+_batcher: Optional[GuardrailsBatcher] = None
+
+
+def _get_batcher() -> GuardrailsBatcher:
+    global _batcher
+    if _batcher is None or _batcher.loop is not asyncio.get_running_loop():
+        _batcher = GuardrailsBatcher()
+    return _batcher
+
+
+async def post_guardrails_async(payload: Dict[str, Any]) -> Any:
+    """Guardrails call for the async path: micro-batched when enabled, single request otherwise."""
+    if not GUARDRAILS_BATCH or "guardrails_batch" not in AGENT_URLS:
+        return await post_agent_async("guardrails", payload)
+    return await _get_batcher().submit(payload)
+
+
+def batcher_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        out = dict(_stats)
+    out["enabled"] = GUARDRAILS_BATCH and "guardrails_batch" in AGENT_URLS
+    out["avg_batch_size"] = round(out["batched_items"] / out["batches"], 2) if out["batches"] else None
+    return out
@@ -0,0 +1,124 @@
+# app/workflows/guardrails_fastpath.py
+"""
+Local pre-classification ahead of the remote guardrails agent.
+
+Rules only answer clearly safe, high-confidence cases (short greetings/thanks,
+the analytics queries run_generate_query already recognizes); anything else,
+or any rule below GUARDRAILS_FASTPATH_THRESHOLD, goes to the agent as before.
+
+Extra rules: GUARDRAILS_FASTPATH_RULES_FILE → JSON list of
+  {"name": ..., "intent": ..., "pattern": <regex, matched on lower-cased flattened text>,
+   "confidence": 0.0-1.0, "max_chars": <optional>}
+"""
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from app.utils.session_batch import flatten_text
+from app.workflows.generate_query import match_query_kind
+
+GUARDRAILS_FASTPATH = os.getenv("GUARDRAILS_FASTPATH", "1") == "1"
+GUARDRAILS_FASTPATH_THRESHOLD = float(os.getenv("GUARDRAILS_FASTPATH_THRESHOLD", "0.9"))
+# comma-separated rule names to disable (ex.: "analytics_query")
+GUARDRAILS_FASTPATH_DISABLED = frozenset(
+    n.strip() for n in os.getenv("GUARDRAILS_FASTPATH_DISABLED", "").split(",") if n.strip()
+)
+GUARDRAILS_FASTPATH_RULES_FILE = os.getenv("GUARDRAILS_FASTPATH_RULES_FILE", "")
+
+_USER_KEYS = ("user_uuid", "user_id", "aluno_uuid")  # same lookup as generate_query._require_user_uuid
+
+
+@dataclass
+class FastPathRule:
+    name: str
+    intent: str
+    confidence: float
+    match: Callable[[str, Dict[str, Any]], bool]  # (normalized text, context) → bool
+    max_chars: Optional[int] = None               # long texts are never "obvious"
+
+
+def _regex_rule(name: str, intent: str, pattern: str, confidence: float, max_chars: Optional[int] = None) -> FastPathRule:
+    rx = re.compile(pattern)
+    return FastPathRule(name, intent, confidence, lambda text, _ctx: bool(rx.search(text)), max_chars)
+
+
+def _analytics_match(text: str, context: Dict[str, Any]) -> bool:
+    # individual queries need the student id; without it the agent decides
+    return match_query_kind(text) is not None and any(context.get(k) for k in _USER_KEYS)
+
+
+DEFAULT_RULES: List[FastPathRule] = [
+    _regex_rule(
+        "greeting", "normal_session",
+        r"^(oi+|ol[aá]|e a[ií]|bom dia|boa tarde|boa noite|hi|hello|hey|good (morning|afternoon|evening))"
+        r"(,? (professor(a)?|prof|tudo bem|tudo bom))*[!.?]*$",
+        0.97, max_chars=40,
+    ),
+    _regex_rule(
+        "thanks", "normal_session",
+        r"^(muito )?(obrigad[oa]|valeu|brigad[oa]|thanks?( you)?|thank you)(,? (professor(a)?|prof))?[!.]*$",
+        0.97, max_chars=40,
+    ),
+    FastPathRule("analytics_query", "generate_query", 0.95, _analytics_match, max_chars=160),
+]
+
+
+def _load_rules() -> List[FastPathRule]:
+    rules = list(DEFAULT_RULES)
+    if GUARDRAILS_FASTPATH_RULES_FILE:
+        with open(GUARDRAILS_FASTPATH_RULES_FILE, encoding="utf-8") as f:
+            for r in json.load(f):
+                rules.append(_regex_rule(r["name"], r["intent"], r["pattern"], float(r["confidence"]), r.get("max_chars")))
+    return [r for r in rules if r.name not in GUARDRAILS_FASTPATH_DISABLED]
+
+
+RULES = _load_rules()
+
+_counts: Dict[str, int] = {"total": 0, "remote": 0}
+_rule_hits: Dict[str, int] = {r.name: 0 for r in RULES}
+_counts_lock = threading.Lock()
+
+
+def preclassify(user_text: str, context: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    First rule (in order) that matches with confidence >= threshold, as
+    {"rule", "intent", "confidence"}; None → send to the remote agent.
+    """
+    if not GUARDRAILS_FASTPATH:
+        return None
+    text = flatten_text(user_text).lower()
+    context = context or {}
+    hit = None
+    for rule in RULES:
+        if rule.confidence < GUARDRAILS_FASTPATH_THRESHOLD:
+            continue
+        if rule.max_chars and len(text) > rule.max_chars:
+            continue
+        if rule.match(text, context):
+            hit = {"rule": rule.name, "intent": rule.intent, "confidence": rule.confidence}
+            break
+    with _counts_lock:
+        _counts["total"] += 1
+        if hit:
+            _rule_hits[hit["rule"]] += 1
+        else:
+            _counts["remote"] += 1
+    return hit
+
+
+def fastpath_report() -> Dict[str, Any]:
+    """Per-rule hit rate over every message seen by this process."""
+    with _counts_lock:
+        total = _counts["total"]
+        rate = lambda n: round(n / total, 3) if total else None
+        return {
+            "enabled": GUARDRAILS_FASTPATH,
+            "threshold": GUARDRAILS_FASTPATH_THRESHOLD,
+            "total": total,
+            "remote": _counts["remote"],
+            "remote_rate": rate(_counts["remote"]),
+            "rules": {name: {"hits": n, "hit_rate": rate(n)} for name, n in _rule_hits.items()},
+        }
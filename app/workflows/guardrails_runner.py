@@ -1,7 +1,57 @@
 # app/workflows/guardrails_runner.py
+import asyncio
+import os
+import threading
 from typing import Dict, Any, Optional
-from app.workflows.guardrails_session import run_guardrails_session
-from app.utils.triggers import execute_workflow
+from app.workflows.guardrails_session import GuardrailsResult, run_guardrails_session, run_guardrails_session_async
+from app.utils.agent_client import count_agent_calls
+from app.utils.tiered_cache import LocalCache
+from app.utils.triggers import (
+    execute_workflow, execute_workflow_async, speculate_workflow_async, commit_workflow_async, SPECULATIVE_INTENTS,
+)
+
+# Speculative mode (async pipeline only): start the likely workflow together with guardrails
+# and keep it only if guardrails allows that same intent
+PIPELINE_SPECULATE = os.getenv("PIPELINE_SPECULATE", "0") == "1"
+# intent to speculate on when the session has no history yet ("" = only with history)
+PIPELINE_SPECULATE_DEFAULT = os.getenv("PIPELINE_SPECULATE_DEFAULT", "")
+
+# session_id → last intent allowed by guardrails (the prediction for the next message)
+_last_intent = LocalCache(
+    max_entries=int(os.getenv("PIPELINE_SPECULATE_SESSIONS", "10000")),
+    ttl_seconds=float(os.getenv("SESSION_TTL_SECONDS", "7200")),
+)
+_spec = {"attempts": 0, "hits": 0, "misses": 0, "blocked": 0, "failed": 0, "wasted_agent_calls": 0}
+_spec_lock = threading.Lock()
+
+def _guardrails_out(gr: GuardrailsResult) -> Dict[str, Any]:
+    return {"guardrails": {"allowed": gr.allowed, "intent": gr.intent, "reason": gr.reason, "raw": gr.raw}}
+
+def _finish(out: Dict[str, Any], trig: Dict[str, Any]) -> Dict[str, Any]:
+    out["trigger"] = trig
+    out["final"] = trig if trig.get("status") == "ok" else {"status": "error", "message": trig.get("error")}
+    return out
+
+def _predict_intent(session_id: Optional[str]) -> Optional[str]:
+    intent = (_last_intent.get(session_id) if session_id else None) or PIPELINE_SPECULATE_DEFAULT
+    return intent if intent in SPECULATIVE_INTENTS else None
+
+def _remember_intent(session_id: Optional[str], gr: GuardrailsResult) -> None:
+    if session_id and gr.allowed and gr.intent:
+        _last_intent.set(session_id, gr.intent)
+
+def _record(outcome: str, wasted_calls: int = 0) -> None:
+    with _spec_lock:
+        _spec["attempts"] += 1
+        _spec[outcome] += 1
+        _spec["wasted_agent_calls"] += wasted_calls
+
+def speculation_report() -> Dict[str, Any]:
+    with _spec_lock:
+        out = dict(_spec)
+    out["enabled"] = PIPELINE_SPECULATE
+    out["hit_rate"] = round(out["hits"] / out["attempts"], 3) if out["attempts"] else None
+    return out
 
 def handle_user_message(
     user_text: str,
@@ -10,14 +60,79 @@ def handle_user_message(
     session_id: Optional[str] = None,
 ) -> Dict[str, Any]:
     gr = run_guardrails_session(user_text, user_id=user_id, session_id=session_id, context=context)
-    out: Dict[str, Any] = {
-        "guardrails": {"allowed": gr.allowed, "intent": gr.intent, "reason": gr.reason, "raw": gr.raw}
-    }
+    out = _guardrails_out(gr)
     if not gr.allowed or not gr.intent:
         out["final"] = {"status": "blocked", "message": gr.reason}
         return out
 
     trig = execute_workflow(gr.intent, user_text=user_text, context=context or {}, user_id=user_id, session_id=session_id)
-    out["trigger"] = trig
-    out["final"] = trig if trig.get("status") == "ok" else {"status": "error", "message": trig.get("error")}
-    return out
+    return _finish(out, trig)
+
+async def handle_user_message_async(
+    user_text: str,
+    context: Optional[Dict[str, Any]] = None,
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    predicted = _predict_intent(session_id) if PIPELINE_SPECULATE else None
+    if predicted:
+        return await _handle_speculative(predicted, user_text, context, user_id, session_id)
+
+    gr = await run_guardrails_session_async(user_text, user_id=user_id, session_id=session_id, context=context)
+    _remember_intent(session_id, gr)
+    out = _guardrails_out(gr)
+    if not gr.allowed or not gr.intent:
+        out["final"] = {"status": "blocked", "message": gr.reason}
+        return out
+
+    trig = await execute_workflow_async(gr.intent, user_text=user_text, context=context or {}, user_id=user_id, session_id=session_id)
+    return _finish(out, trig)
+
+async def _speculate(
+    intent: str, user_text: str, context: Optional[Dict[str, Any]], session_id: Optional[str], calls: Dict[str, int]
+) -> Any:
+    count_agent_calls(calls)  # runs in its own task context: counts only the speculative calls
+    return await speculate_workflow_async(intent, user_text=user_text, context=context, session_id=session_id)
+
+async def _handle_speculative(
+    predicted: str,
+    user_text: str,
+    context: Optional[Dict[str, Any]],
+    user_id: Optional[str],
+    session_id: Optional[str],
+) -> Dict[str, Any]:
+    """
+    Guardrails and the predicted workflow's agent calls run at the same time.
+    The draft is committed (history written) only if guardrails allows the predicted
+    intent; otherwise it is cancelled/discarded and the normal path runs.
+    """
+    calls: Dict[str, int] = {"calls": 0}
+    task = asyncio.create_task(_speculate(predicted, user_text, context, session_id, calls))
+    try:
+        gr = await run_guardrails_session_async(user_text, user_id=user_id, session_id=session_id, context=context)
+    except BaseException:
+        task.cancel()
+        raise
+    _remember_intent(session_id, gr)
+    out = _guardrails_out(gr)
+
+    if gr.allowed and gr.intent == predicted:
+        try:
+            draft = await task
+        except Exception as e:
+            print(f"[WARN] Speculative {predicted} failed, running it again: {e}")
+            _record("failed", calls["calls"])
+            trig = await execute_workflow_async(gr.intent, user_text=user_text, context=context or {}, user_id=user_id, session_id=session_id)
+            return _finish(out, trig)
+        _record("hits")
+        trig = await commit_workflow_async(predicted, draft, user_text=user_text, context=context or {}, user_id=user_id, session_id=session_id)
+        return _finish(out, trig)
+
+    task.cancel()
+    _record("misses" if gr.allowed and gr.intent else "blocked", calls["calls"])
+    if not gr.allowed or not gr.intent:
+        out["final"] = {"status": "blocked", "message": gr.reason}
+        return out
+
+    trig = await execute_workflow_async(gr.intent, user_text=user_text, context=context or {}, user_id=user_id, session_id=session_id)
+    return _finish(out, trig)
@@ -1,8 +1,27 @@
 # app/workflows/guardrails_session.py
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
 from typing import Optional, Dict, Any
-import json, re
+import json, os, re
 from app.utils.agent_client import post_agent  # (no need for 'requests' here)
+from app.utils.session_batch import flatten_text
+from app.utils.tiered_cache import TieredCache, cache_key
+from app.workflows.guardrails_fastpath import preclassify
+from app.workflows.guardrails_batcher import post_guardrails_async
+
+# Classification cache: same normalized text + same relevant context → same GuardrailsResult
+GUARDRAILS_CACHE = os.getenv("GUARDRAILS_CACHE", "1") == "1"
+# context keys that identify the caller, not the message (left out of the cache key)
+GUARDRAILS_CACHE_IGNORE_KEYS = frozenset(
+    k.strip() for k in os.getenv("GUARDRAILS_CACHE_IGNORE_KEYS", "aluno_uuid,user_uuid,user_id,session_id").split(",") if k.strip()
+)
+
+_guardrails_cache = TieredCache(
+    "guardrails",
+    max_entries=int(os.getenv("GUARDRAILS_CACHE_SIZE", "5000")),
+    ttl_seconds=float(os.getenv("GUARDRAILS_CACHE_TTL", "600")),
+    redis_ttl_seconds=int(os.getenv("GUARDRAILS_CACHE_REDIS_TTL", "3600")),
+    use_redis=os.getenv("GUARDRAILS_CACHE_REDIS", "1") == "1",
+)
 
 @dataclass
 class GuardrailsResult:
@@ -39,23 +58,21 @@ def _coerce_json(payload: Any) -> Dict[str, Any]:
 
     raise ValueError("Guardrails response is neither dict nor JSON string.")
 
-def run_guardrails_session(
+def _guardrails_payload(
     user_text: str,
-    user_id: Optional[str] = None,
-    session_id: Optional[str] = None,
-    context: Optional[Dict[str, Any]] = None,
-) -> GuardrailsResult:
+    user_id: Optional[str],
+    session_id: Optional[str],
+    context: Optional[Dict[str, Any]],
+) -> Dict[str, Any]:
     payload = {
         "question": user_text,
         "user_id": user_id,
         "session_id": session_id,
         "context": context or {},
     }
-    payload = {k: v for k, v in payload.items() if v is not None}
-
-    # Call the agent
-    data = post_agent("guardrails", payload)
+    return {k: v for k, v in payload.items() if v is not None}
 
+def _to_result(data: Any) -> GuardrailsResult:
     # <<< NEW: extract pure assessment, even if wrapped >>>
     res = _coerce_json(data)
 
@@ -75,3 +92,64 @@ def run_guardrails_session(
     )
 
     return GuardrailsResult(allowed=allowed, intent=intent, reason=reason, raw=res)
+
+def _cache_key(user_text: str, context: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not GUARDRAILS_CACHE:
+        return None
+    ctx = {k: v for k, v in (context or {}).items() if k not in GUARDRAILS_CACHE_IGNORE_KEYS}
+    return cache_key({"text": flatten_text(user_text).casefold(), "context": ctx})
+
+def _fastpath_result(user_text: str, context: Optional[Dict[str, Any]]) -> Optional[GuardrailsResult]:
+    hit = preclassify(user_text, context)
+    if not hit:
+        return None
+    reason = f"Local rule '{hit['rule']}' (confidence {hit['confidence']:.2f}) → intent '{hit['intent']}'."
+    return GuardrailsResult(allowed=True, intent=hit["intent"], reason=reason, raw={"source": "fastpath", **hit})
+
+def run_guardrails_session(
+    user_text: str,
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    context: Optional[Dict[str, Any]] = None,
+) -> GuardrailsResult:
+    local = _fastpath_result(user_text, context)
+    if local:
+        return local
+
+    key = _cache_key(user_text, context)
+    if key:
+        hit = _guardrails_cache.get(key)
+        if hit is not None:
+            return GuardrailsResult(**hit)
+
+    payload = _guardrails_payload(user_text, user_id, session_id, context)
+
+    # Call the agent
+    data = post_agent("guardrails", payload)
+    result = _to_result(data)
+    if key:
+        _guardrails_cache.set(key, asdict(result))
+    return result
+
+async def run_guardrails_session_async(
+    user_text: str,
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    context: Optional[Dict[str, Any]] = None,
+) -> GuardrailsResult:
+    local = _fastpath_result(user_text, context)
+    if local:
+        return local
+
+    key = _cache_key(user_text, context)
+    if key:
+        hit = await _guardrails_cache.get_async(key)
+        if hit is not None:
+            return GuardrailsResult(**hit)
+
+    payload = _guardrails_payload(user_text, user_id, session_id, context)
+    data = await post_guardrails_async(payload)  # micro-batched when GUARDRAILS_BATCH=1
+    result = _to_result(data)
+    if key:
+        await _guardrails_cache.set_async(key, asdict(result))
+    return result
@@ -1,20 +1,79 @@
 import sys
 from pathlib import Path
-import requests
 
 # ensure project root is in sys.path
 ROOT_DIR = Path(__file__).resolve().parent.parent.parent
 if str(ROOT_DIR) not in sys.path:
     sys.path.append(str(ROOT_DIR))
 
-from config import AGENT_URLS
-from app.utils.session_store import save_session_message
+import os
+import re
+from typing import Any, AsyncIterator, NamedTuple, Optional, Tuple
 
+from app.utils.agent_client import post_agent, post_agent_async, stream_agent_async
+from app.utils.model_router import model_params
+from app.utils.session_batch import flatten_text
+from app.utils.session_store import save_session_messages, save_session_messages_async
+from app.utils.tiered_cache import TieredCache, cache_key
 
-def call_agent(url: str, payload: dict):
-    resp = requests.post(url, json=payload, timeout=30)
-    resp.raise_for_status()
-    return resp.json()
+# Answer cache (opt-in): same normalized question + model + temperature → same answer.
+# The payload carries nothing session-specific, so hits are shared across students;
+# the turn is still written to the session history as usual.
+NATURAL_CACHE = os.getenv("NATURAL_CACHE", "0") == "1"
+
+_answer_cache = TieredCache(
+    "natural_answer",
+    max_entries=int(os.getenv("NATURAL_CACHE_SIZE", "2000")),
+    ttl_seconds=float(os.getenv("NATURAL_CACHE_TTL", "3600")),
+    redis_ttl_seconds=int(os.getenv("NATURAL_CACHE_REDIS_TTL", "86400")),
+    use_redis=os.getenv("NATURAL_CACHE_REDIS", "1") == "1",
+    max_entry_bytes=int(os.getenv("NATURAL_CACHE_MAX_ENTRY_BYTES", "32768")),
+)
+
+_TRAILING_PUNCT = re.compile(r"[\s?!.…]+$")
+
+
+def _natural_payload(question: str) -> dict:
+    return {
+        "question": question,
+        **model_params("natural", "natural_agent", question),
+    }
+
+
+def _normalize_question(question: str) -> str:
+    # "O que é uma fração?" / "o que é uma  fração" → same key
+    return _TRAILING_PUNCT.sub("", flatten_text(question).casefold())
+
+
+def _answer_cache_key(payload: dict) -> Optional[str]:
+    if not NATURAL_CACHE:
+        return None
+    return cache_key({
+        "question": _normalize_question(payload["question"]),
+        "model_name": payload.get("model_name"),
+        "temperature": payload.get("temperature"),
+    })
+
+
+def _cacheable(answer: Any) -> bool:
+    return isinstance(answer, str) and bool(answer.strip())
+
+
+def _answer_from(natural_resp: Any) -> str | None:
+    return natural_resp.get("answer") if isinstance(natural_resp, dict) else str(natural_resp)
+
+
+class NaturalTurn(NamedTuple):
+    answer: str | None
+    cache_key: Optional[str] = None  # fresh answer to store on commit (None: cache off or already a hit)
+
+
+def _turn_messages(question: str, answer: str | None) -> list:
+    # user + agent of the turn, written in a single Redis round trip
+    return [
+        {"role": "user", "content": question},
+        {"role": "agent", "content": answer},
+    ]
 
 
 def run_natural_session(session_id: str, question: str):
@@ -23,19 +82,76 @@ def run_natural_session(session_id: str, question: str):
     - Calls NaturalAgent
     - Saves history in Redis
     """
-    # 1️⃣ Call Natural Agent directly
-    natural_payload = {
-        "question": question,
-        "model_name": "gemini-1.5-flash",
-        "temperature": 0.4,
-    }
-    natural_resp = call_agent(AGENT_URLS["natural_agent"], natural_payload)
+    payload = _natural_payload(question)
+    key = _answer_cache_key(payload)
+    answer = _answer_cache.get(key) if key else None
+
+    # 1️⃣ Call Natural Agent directly (unless the answer is cached)
+    if answer is None:
+        natural_resp = post_agent("natural_agent", payload)
+        answer = natural_resp.get("answer")
+        if key and _cacheable(answer):
+            _answer_cache.set(key, answer)
+
+    # 2️⃣ Save history in Redis (cache hits too)
+    save_session_messages(session_id, _turn_messages(question, answer))
 
-    # 2️⃣ Save history in Redis
-    save_session_message(session_id, role="user", content=question)
-    save_session_message(session_id, role="agent", content=natural_resp.get("answer"))
+    return {"status": "ok", "answer": answer}
+
+
+async def natural_answer_async(question: str) -> NaturalTurn:
+    """
+    Agent call (or cached answer) only, no side effects (speculative execution commits it
+    later). A fresh answer goes into the shared cache only on commit, i.e. once guardrails
+    allowed the question.
+    """
+    payload = _natural_payload(question)
+    key = _answer_cache_key(payload)
+    if key:
+        cached = await _answer_cache.get_async(key)
+        if cached is not None:
+            return NaturalTurn(cached)
+    natural_resp = await post_agent_async("natural_agent", payload)
+    return NaturalTurn(natural_resp.get("answer"), key)
+
+
+async def commit_natural_turn_async(
+    session_id: str, question: str, answer: str | None, cache_key: Optional[str] = None
+):
+    """Persist a turn computed by natural_answer_async (and cache a fresh answer)."""
+    await save_session_messages_async(session_id, _turn_messages(question, answer))
+    if cache_key and _cacheable(answer):
+        await _answer_cache.set_async(cache_key, answer)
+    return {"status": "ok", "answer": answer}
+
+
+async def run_natural_session_async(session_id: str, question: str):
+    """Async version of run_natural_session (httpx + redis.asyncio)."""
+    turn = await natural_answer_async(question)
+    return await commit_natural_turn_async(session_id, question, *turn)
+
+
+async def stream_natural_session_async(session_id: str, question: str) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Streaming version of run_natural_session_async: yields ("delta", {"text"}) as the
+    agent produces the answer, then persists the assembled turn and yields ("done", ...).
+    If the stream is abandoned (client disconnected), nothing is saved.
+    """
+    payload = _natural_payload(question)
+    key = _answer_cache_key(payload)
+    cached = await _answer_cache.get_async(key) if key else None
+    if cached is not None:
+        yield "delta", {"text": cached}
+        await commit_natural_turn_async(session_id, question, cached)
+        yield "done", {"status": "ok"}
+        return
 
-    return {"status": "ok", "answer": natural_resp.get("answer")}
+    parts = []
+    async for delta in stream_agent_async("natural_agent", payload, _answer_from):
+        parts.append(delta)
+        yield "delta", {"text": delta}
+    await commit_natural_turn_async(session_id, question, "".join(parts), key)
+    yield "done", {"status": "ok"}
 
 
 if __name__ == "__main__":
@@ -15,7 +15,11 @@ BASE_URL = "http://127.0.0.1:9200"
 AGENT_URLS = {
     "natural_agent": f"{BASE_URL}/mirai_agents/natural/ask",
     "guardrails": f"{BASE_URL}/mirai_agents/guardrails/ask",
+    "guardrails_batch": f"{BASE_URL}/mirai_agents/guardrails/batch",  # only used with GUARDRAILS_BATCH=1
     "planner": f"{BASE_URL}/mirai_agents/planner/ask",
     "professor": f"{BASE_URL}/mirai_agents/professor/ask",
+    # streaming (only /run/stream endpoints; missing URL or 404 → one chunk from the /ask endpoint)
+    "natural_agent_stream": f"{BASE_URL}/mirai_agents/natural/stream",
+    "professor_stream": f"{BASE_URL}/mirai_agents/professor/stream",
     "schema_creator": f"{BASE_URL}/mirai_agents/schema_creator/ask",
 }
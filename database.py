@@ -3,6 +3,7 @@ import os
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 load_dotenv()
 
@@ -11,12 +12,54 @@ SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL")
 if not SQLALCHEMY_DATABASE_URI:
     raise RuntimeError("DATABASE_URL não definido no .env")
 
-# Engine + Session
-engine = create_engine(SQLALCHEMY_DATABASE_URI, pool_pre_ping=True, future=True)
+# Pool (por processo/worker) configurável via .env
+DB_POOL_SIZE    = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+_POOL_KWARGS = dict(
+    pool_pre_ping=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+)
+
+# Engine + Session (compartilhados pelo processo inteiro; nunca crie engine por request)
+engine = create_engine(SQLALCHEMY_DATABASE_URI, future=True, **_POOL_KWARGS)
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False, future=True)
 
 Base = declarative_base()
 
+# Engine async (asyncpg) para o caminho async dos routers.
+# ASYNC_DATABASE_URL opcional; senão deriva de DATABASE_URL trocando o driver.
+ASYNC_DATABASE_URI = os.getenv("ASYNC_DATABASE_URL") or (
+    SQLALCHEMY_DATABASE_URI
+    .replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1)
+    .replace("postgresql://", "postgresql+asyncpg://", 1)
+)
+
+_async_engine = None
+_AsyncSessionLocal = None
+
+def get_async_sessionmaker():
+    """Cria (lazy) o engine async e retorna o async_sessionmaker compartilhado."""
+    global _async_engine, _AsyncSessionLocal
+    if _AsyncSessionLocal is None:
+        _async_engine = create_async_engine(ASYNC_DATABASE_URI, **_POOL_KWARGS)
+        _AsyncSessionLocal = async_sessionmaker(bind=_async_engine, autoflush=False, expire_on_commit=False)
+    return _AsyncSessionLocal
+
+async def dispose_engines():
+    """Fecha os pools (sync e async) — chamado no shutdown do lifespan do app."""
+    global _async_engine, _AsyncSessionLocal
+    engine.dispose()
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+        _AsyncSessionLocal = None
+
 def get_db():
     db = SessionLocal()
     try:
@@ -1,11 +1,36 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.routers.natural_workflow_router import router as natural_router
 from app.routers.class_session_workflow_router import router as class_router
 from app.routers.analytics_workflow_router import router as analytics_router
 from app.routers.pipeline_router import router as pipeline_router
+from app.utils.agent_client import close_sessions, close_async_clients, coalesce_stats
+from app.utils.agent_guard import AgentUnavailable, guard_stats
+from app.utils.model_router import routing_report
+from app.workflows.class_session import shutdown_incremental_eval
+from app.utils.finalize_jobs import start_workers, stop_workers
+from app.redis_client import close_redis_clients, get_pool_stats
+from app.utils.tiered_cache import cache_stats
+from app.workflows.guardrails_fastpath import fastpath_report
+from app.workflows.guardrails_runner import speculation_report
+from app.workflows.guardrails_batcher import batcher_stats
+from database import dispose_engines
 
-app = FastAPI(title="Workflow Backend", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # pools (Postgres, agentes) são por processo: criados uma vez, fechados no shutdown
+    start_workers()  # workers de finalize (FINALIZE_WORKERS threads)
+    yield
+    stop_workers()
+    shutdown_incremental_eval()
+    await close_async_clients()
+    close_sessions()
+    await dispose_engines()
+    await close_redis_clients()
+
+app = FastAPI(title="Workflow Backend", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,10 +40,54 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(AgentUnavailable)
+async def agent_unavailable(request: Request, exc: AgentUnavailable):
+    # circuito aberto / sem vaga no agente: 503 com a espera sugerida (os routers deixam passar)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+@app.get("/health/redis")
+def health_redis():
+    # uso dos pools Redis deste worker (dimensionamento de REDIS_MAX_CONNECTIONS)
+    return get_pool_stats()
+
+@app.get("/health/caches")
+def health_caches():
+    # hit/miss por cache (L1 no processo + L2 Redis) deste worker
+    return cache_stats()
+
+@app.get("/health/guardrails-fastpath")
+def health_guardrails_fastpath():
+    # quanto do tráfego as regras locais resolvem sem o agente de guardrails
+    return fastpath_report()
+
+@app.get("/health/speculation")
+def health_speculation():
+    # execução especulativa do pipeline: acertos e chamadas de agente desperdiçadas
+    return speculation_report()
+
+@app.get("/health/guardrails-batch")
+def health_guardrails_batch():
+    # micro-batching do guardrails: lotes enviados, tamanho médio, fallbacks
+    return batcher_stats()
+
+@app.get("/health/agents")
+def health_agents():
+    # por agente: single-flight, estado do circuito, limite de concorrência e balde de retries
+    return {"coalescing": coalesce_stats(), "guards": guard_stats()}
+
+@app.get("/health/model-routing")
+def health_model_routing():
+    # modelo escolhido por workflow (e por qual regra), com a carga do agente em cada decisão
+    return routing_report()
+
 app.include_router(natural_router)
 app.include_router(class_router)
 app.include_router(analytics_router)
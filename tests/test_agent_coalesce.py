@@ -0,0 +1,210 @@
+# tests/test_agent_coalesce.py
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.utils import agent_client as ac
+from app.utils.deadline import Deadline, DeadlineExceeded
+
+
+def _reset(monkeypatch):
+    monkeypatch.setattr(ac, "AGENT_COALESCE", True)
+    monkeypatch.setattr(ac, "_coalesce_stats", {})
+
+
+def test_sync_identical_calls_share_one_request(monkeypatch):
+    _reset(monkeypatch)
+    calls = []
+
+    def fake(agent_key, payload, timeout=None, deadline=None):
+        calls.append(payload)
+        time.sleep(0.1)
+        return {"answer": "ok"}
+
+    monkeypatch.setattr(ac, "_post_agent_once", fake)
+    out = []
+    threads = [
+        threading.Thread(target=lambda: out.append(ac.post_agent("natural", {"b": 1, "a": [1, 2]})))
+        for _ in range(5)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert out == [{"answer": "ok"}] * 5
+    out[0]["answer"] = "mutated"  # cada chamador recebe a sua cópia
+    assert out[1]["answer"] == "ok"
+    assert ac.coalesce_stats()["agents"]["natural"] == {"calls": 5, "saved": 4}
+
+
+def test_async_coalesces_same_payload_only(monkeypatch):
+    _reset(monkeypatch)
+    calls = []
+
+    async def fake(agent_key, payload, timeout=None, deadline=None):
+        calls.append(payload["q"])
+        await asyncio.sleep(0.05)
+        return {"echo": payload["q"]}
+
+    monkeypatch.setattr(ac, "_post_agent_once_async", fake)
+
+    async def main():
+        return await asyncio.gather(*(ac.post_agent_async("natural", {"q": q}) for q in ["x", "x", "y", "x"]))
+
+    out = asyncio.run(main())
+    assert sorted(calls) == ["x", "y"]
+    assert [r["echo"] for r in out] == ["x", "x", "y", "x"]
+    assert ac.coalesce_stats()["saved"] == 2
+
+
+def test_errors_reach_every_waiter_and_flight_is_released(monkeypatch):
+    _reset(monkeypatch)
+    calls = []
+
+    async def boom(agent_key, payload, timeout=None, deadline=None):
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("down")
+
+    monkeypatch.setattr(ac, "_post_agent_once_async", boom)
+
+    async def main():
+        return await asyncio.gather(*(ac.post_agent_async("natural", {"q": 1}) for _ in range(3)), return_exceptions=True)
+
+    out = asyncio.run(main())
+    assert len(calls) == 1 and all(isinstance(e, RuntimeError) for e in out)
+    assert ac._async_flights == {}
+    asyncio.run(main())
+    assert len(calls) == 2  # terminada a chamada, a próxima vai ao agente de novo
+
+
+def _slow_agent(calls, cancelled):
+    async def slow(agent_key, payload, timeout=None, deadline=None):
+        calls.append(payload["q"])
+        try:
+            await asyncio.sleep(0.2)
+        except asyncio.CancelledError:
+            cancelled.append(payload["q"])
+            raise
+        return {"echo": payload["q"]}
+
+    return slow
+
+
+def test_cancelling_the_last_waiter_cancels_the_upstream_call(monkeypatch):
+    _reset(monkeypatch)
+    calls, cancelled = [], []
+    monkeypatch.setattr(ac, "_post_agent_once_async", _slow_agent(calls, cancelled))
+
+    async def main():
+        spec = asyncio.ensure_future(ac.post_agent_async("natural", {"q": "x"}))
+        await asyncio.sleep(0.01)
+        spec.cancel()  # especulação descartada
+        await asyncio.sleep(0.01)
+        assert cancelled == ["x"] and ac._async_flights == {}
+        return await ac.post_agent_async("natural", {"q": "x"})
+
+    assert asyncio.run(main()) == {"echo": "x"}
+    assert calls == ["x", "x"]  # a chamada nova não reaproveita a cancelada
+
+
+def test_cancelling_one_waiter_keeps_the_shared_call(monkeypatch):
+    _reset(monkeypatch)
+    calls, cancelled = [], []
+    monkeypatch.setattr(ac, "_post_agent_once_async", _slow_agent(calls, cancelled))
+
+    async def main():
+        spec = asyncio.ensure_future(ac.post_agent_async("natural", {"q": "x"}))
+        other = asyncio.ensure_future(ac.post_agent_async("natural", {"q": "x"}))
+        await asyncio.sleep(0.01)
+        spec.cancel()
+        return await other
+
+    assert asyncio.run(main()) == {"echo": "x"}
+    assert calls == ["x"] and cancelled == []
+
+
+def test_async_pool_keeps_keepalive_size_but_does_not_cap_in_flight(monkeypatch):
+    monkeypatch.setenv("AGENT_POOL_SIZE_NATURAL", "3")
+    monkeypatch.setattr(ac, "_async_clients", {})
+
+    async def main():
+        client = ac.get_async_client("natural")
+        pool = client._transport._pool
+        try:
+            return pool._max_connections, pool._max_keepalive_connections
+        finally:
+            await client.aclose()
+
+    max_connections, keepalive = asyncio.run(main())
+    assert keepalive == 3
+    assert max_connections is None or max_connections > 1000
+
+
+def test_follower_waits_only_its_own_deadline(monkeypatch):
+    _reset(monkeypatch)
+
+    async def slow(agent_key, payload, timeout=None, deadline=None):
+        await asyncio.sleep(0.3)
+        return {"answer": "ok"}
+
+    monkeypatch.setattr(ac, "_post_agent_once_async", slow)
+
+    async def main():
+        leader = asyncio.ensure_future(ac.post_agent_async("natural", {"q": 1}))
+        await asyncio.sleep(0.01)
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await ac.post_agent_async("natural", {"q": 1}, deadline=Deadline.after(0.05))
+        assert time.monotonic() - started < 0.2
+        return await leader
+
+    assert asyncio.run(main()) == {"answer": "ok"}  # o líder não é afetado
+
+
+def test_sync_follower_waits_only_its_own_deadline(monkeypatch):
+    _reset(monkeypatch)
+
+    def slow(agent_key, payload, timeout=None, deadline=None):
+        time.sleep(0.3)
+        return {"answer": "ok"}
+
+    monkeypatch.setattr(ac, "_post_agent_once", slow)
+    out = []
+    leader = threading.Thread(target=lambda: out.append(ac.post_agent("natural", {"q": 1})))
+    leader.start()
+    time.sleep(0.02)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        ac.post_agent("natural", {"q": 1}, deadline=Deadline.after(0.05))
+    assert time.monotonic() - started < 0.2
+    leader.join()
+    assert out == [{"answer": "ok"}]
+
+
+def test_leader_deadline_does_not_fail_followers_with_budget_left(monkeypatch):
+    _reset(monkeypatch)
+    calls = []
+
+    async def agent(agent_key, payload, timeout=None, deadline=None):
+        calls.append(deadline)
+        await asyncio.sleep(0.05)
+        if deadline is not None and deadline.remaining() < 1:
+            raise DeadlineExceeded("leader budget")
+        return {"answer": "ok"}
+
+    monkeypatch.setattr(ac, "_post_agent_once_async", agent)
+
+    async def main():
+        leader = asyncio.ensure_future(ac.post_agent_async("natural", {"q": 1}, deadline=Deadline.after(0.5)))
+        await asyncio.sleep(0.01)
+        follower = await ac.post_agent_async("natural", {"q": 1}, deadline=Deadline.after(30))
+        with pytest.raises(DeadlineExceeded):
+            await leader
+        return follower
+
+    assert asyncio.run(main()) == {"answer": "ok"}
+    assert len(calls) == 2  # o seguidor refez a chamada com o próprio prazo
@@ -0,0 +1,116 @@
+# tests/test_agent_guard.py
+import asyncio
+import random
+import time
+
+import httpx
+import pytest
+
+from app.utils import agent_client as ac
+from app.utils import agent_guard as ag
+
+
+def test_breaker_opens_fails_fast_and_recovers_through_half_open():
+    br = ag.CircuitBreaker(failures=2, open_seconds=0.05, half_open_probes=1)
+    br.record_failure()
+    assert br.allow()
+    br.record_failure()
+    assert br.state == ag.OPEN and not br.allow()
+    time.sleep(0.06)
+    assert br.allow() and br.state == ag.HALF_OPEN
+    assert not br.allow()  # só uma sonda
+    br.record_success()
+    assert br.state == ag.CLOSED and br.allow()
+
+
+def test_half_open_probe_failure_reopens():
+    br = ag.CircuitBreaker(failures=1, open_seconds=0.01)
+    br.record_failure()
+    time.sleep(0.02)
+    assert br.allow()
+    br.record_failure()
+    assert br.state == ag.OPEN and br.counters["opened"] == 2
+
+
+def test_limiter_backs_off_on_slow_windows_and_grows_back():
+    lim = ag.AdaptiveLimiter(max_limit=8, min_limit=1, tolerance=2.0, window=5)
+    for _ in range(5):
+        lim.on_sample(0.1)
+    for _ in range(20):
+        lim.on_sample(1.0)
+    assert int(lim.limit) < 8
+    low = lim.limit
+    for _ in range(50):
+        lim.on_sample(0.1)
+    assert lim.limit > low
+    assert lim.acquire(0) and lim.in_flight == 1
+    lim.release()
+
+
+def test_limiter_holds_under_healthy_high_variance_latency():
+    # geração de LLM saudável: 2–20 s uniforme, sem erros nem fila
+    rng = random.Random(7)
+    lim = ag.AdaptiveLimiter(max_limit=10, min_limit=1, tolerance=2.0)
+    for _ in range(300):
+        lim.on_sample(rng.uniform(2, 20))
+    assert int(lim.limit) == 10
+    assert lim.counters["decreases"] == 0
+
+
+def test_limiter_cuts_on_overload_signals():
+    lim = ag.AdaptiveLimiter(max_limit=10, min_limit=1)
+    for _ in range(5):
+        lim.on_sample(30.0, overloaded=True)  # 429/5xx/timeout
+    assert int(lim.limit) == 5
+
+
+def test_limiter_rejects_when_full():
+    lim = ag.AdaptiveLimiter(max_limit=1)
+    assert lim.acquire(0)
+    assert not lim.acquire(0.01)
+    assert not asyncio.run(lim.acquire_async(0.01))
+    lim.release()
+    assert asyncio.run(lim.acquire_async(0.01))
+
+
+def test_retry_budget_is_shared_and_refills_with_calls():
+    b = ag.RetryBudget(ratio=0.5, min_tokens=1, max_tokens=2)
+    assert b.withdraw() and not b.withdraw()
+    b.deposit()
+    b.deposit()
+    assert b.withdraw()
+
+
+def test_open_circuit_fails_fast_without_calling_the_agent(monkeypatch):
+    monkeypatch.setattr(ac, "AGENT_COALESCE", False)
+    monkeypatch.setattr(ac, "AGENT_BACKOFF", 0)
+    monkeypatch.setitem(ac.AGENT_URLS, "flaky", "http://flaky.test/ask")
+    monkeypatch.setattr(ag, "_guards", {})
+    calls = []
+
+    def handler(request):
+        calls.append(1)
+        return httpx.Response(503, text="down")
+
+    async def main():
+        guard = ag.get_guard("flaky", 4)
+        guard.breaker.failures = 3
+        ac._async_clients["flaky"] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with pytest.raises(ac.requests.HTTPError):
+            await ac.post_agent_async("flaky", {"q": 1})
+        assert guard.breaker.state == ag.OPEN
+        with pytest.raises(ag.CircuitOpenError):
+            await ac.post_agent_async("flaky", {"q": 1})
+        await ac._async_clients.pop("flaky").aclose()
+
+    asyncio.run(main())
+    assert len(calls) == 3  # retries pararam quando o circuito abriu
+
+
+def test_limiter_ceiling_does_not_follow_the_http_pool_size(monkeypatch):
+    monkeypatch.setattr(ag, "_guards", {})
+    monkeypatch.setenv("AGENT_POOL_SIZE_PLANNER", "2")
+    monkeypatch.setenv("AGENT_CONCURRENCY_MAX_PLANNER", "7")
+    assert ac._guard_for("planner", None).limiter.max_limit == 7
+    assert ac._guard_for("professor", None).limiter.max_limit == ag.AGENT_CONCURRENCY_MAX
+    assert ag.AGENT_CONCURRENCY_MAX >= 40  # o pool de threads limitava a 40 antes do limiter
@@ -0,0 +1,99 @@
+# tests/test_agent_stream.py
+import asyncio
+
+import httpx
+
+from app.utils import agent_client as ac
+from app.utils import agent_guard as ag
+from app.utils.sse import sse_event
+
+
+def _collect(monkeypatch, handler, urls):
+    monkeypatch.setattr(ag, "_guards", {})
+    for key, url in urls.items():
+        monkeypatch.setitem(ac.AGENT_URLS, key, url)
+
+    async def main():
+        ac._async_clients["echo"] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return [d async for d in ac.stream_agent_async("echo", {"q": 1}, lambda r: r.get("answer"))]
+        finally:
+            await ac._async_clients.pop("echo").aclose()
+
+    return asyncio.run(main())
+
+
+def test_relays_sse_deltas_until_done(monkeypatch):
+    body = 'data: {"delta": "Olá"}\n\ndata: {"delta": ", mundo"}\n\ndata: [DONE]\n\ndata: {"delta": "ignored"}\n\n'
+
+    def handler(request):
+        assert request.url.path == "/stream"
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body.encode())
+
+    out = _collect(monkeypatch, handler, {"echo": "http://agent.test/ask", "echo_stream": "http://agent.test/stream"})
+    assert out == ["Olá", ", mundo"]
+
+
+def test_plain_chunked_text_is_relayed(monkeypatch):
+    def handler(request):
+        return httpx.Response(200, headers={"content-type": "text/plain"}, content=b"abc")
+
+    out = _collect(monkeypatch, handler, {"echo": "http://agent.test/ask", "echo_stream": "http://agent.test/stream"})
+    assert "".join(out) == "abc"
+
+
+def test_unsupported_stream_endpoint_falls_back_to_one_chunk(monkeypatch):
+    monkeypatch.setattr(ac, "AGENT_COALESCE", False)
+
+    def handler(request):
+        if request.url.path == "/stream":
+            return httpx.Response(404)
+        return httpx.Response(200, json={"answer": "inteira"})
+
+    out = _collect(monkeypatch, handler, {"echo": "http://agent.test/ask", "echo_stream": "http://agent.test/stream"})
+    assert out == ["inteira"]
+
+
+def test_sse_event_format():
+    assert sse_event("delta", {"text": "é"}) == 'event: delta\ndata: {"text": "é"}\n\n'
+
+
+def _slow_body(chunks, delay):
+    async def body():
+        for c in chunks:
+            await asyncio.sleep(delay)
+            yield c
+    return body()
+
+
+def test_latency_sample_covers_the_whole_stream(monkeypatch):
+    def handler(request):
+        return httpx.Response(200, headers={"content-type": "text/plain"}, content=_slow_body([b"a", b"b", b"c"], 0.05))
+
+    out = _collect(monkeypatch, handler, {"echo": "http://agent.test/ask", "echo_stream": "http://agent.test/stream"})
+    assert "".join(out) == "abc"
+    latencies = list(ag._guards["echo"].latencies)
+    assert len(latencies) == 1 and latencies[0] >= 0.15  # corpo inteiro, não só o 1º byte
+
+
+def test_abandoned_stream_counts_success_without_latency(monkeypatch):
+    monkeypatch.setattr(ag, "_guards", {})
+    monkeypatch.setitem(ac.AGENT_URLS, "echo_stream", "http://agent.test/stream")
+
+    def handler(request):
+        return httpx.Response(200, headers={"content-type": "text/plain"}, content=_slow_body([b"a", b"b"], 0.01))
+
+    async def main():
+        ac._async_clients["echo"] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            stream = ac.stream_agent_async("echo", {"q": 1}, lambda r: r.get("answer"))
+            first = await stream.__anext__()
+            await stream.aclose()  # o cliente do SSE foi embora
+            return first
+        finally:
+            await ac._async_clients.pop("echo").aclose()
+
+    assert asyncio.run(main()) == "a"
+    guard = ag._guards["echo"]
+    assert list(guard.latencies) == [] and guard.breaker.state == ag.CLOSED
+    assert guard.limiter.in_flight == 0
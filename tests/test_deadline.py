@@ -0,0 +1,56 @@
+# tests/test_deadline.py
+import asyncio
+import time
+
+import pytest
+import requests
+
+from app.utils import agent_client as ac
+from app.utils.deadline import Deadline, DeadlineExceeded, deadline_from
+
+
+def test_share_never_outlives_parent():
+    d = Deadline.after(10)
+    part = d.share(0.3)
+    assert 2.5 < part.remaining() <= 3.0
+    assert part.expires_at <= d.expires_at
+    assert deadline_from(0) is None and deadline_from(None) is None
+
+
+def test_hop_timeout_and_retries_come_from_remaining_budget(monkeypatch):
+    monkeypatch.setattr(ac, "AGENT_RETRIES", 3)
+    monkeypatch.setattr(ac, "AGENT_BACKOFF", 0.8)
+    monkeypatch.setattr(ac, "AGENT_MIN_ATTEMPT_SECONDS", 1)
+    assert ac._resolve_timeout(None, Deadline.after(2))[1] <= 2
+    assert ac._retry_delay(0, None) == 0.8
+    assert ac._retry_delay(3, None) is None
+    assert ac._retry_delay(0, Deadline.after(1.5)) is None  # 0.8s de backoff + 1s de tentativa não cabem
+    assert ac._retry_delay(1, Deadline.after(10)) == 1.6
+
+
+def test_expired_deadline_fails_before_calling(monkeypatch):
+    monkeypatch.setattr(ac, "AGENT_COALESCE", False)
+    d = Deadline(time.monotonic() - 1)
+    with pytest.raises(DeadlineExceeded):
+        ac.post_agent("planner", {"q": 1}, deadline=d)
+    with pytest.raises(requests.Timeout):  # DeadlineExceeded é um requests.Timeout
+        asyncio.run(ac.post_agent_async("planner", {"q": 1}, deadline=d))
+
+
+def test_coalesced_waiter_respects_its_own_deadline(monkeypatch):
+    monkeypatch.setattr(ac, "AGENT_COALESCE", True)
+
+    async def slow(agent_key, payload, timeout=None, deadline=None):
+        await asyncio.sleep(0.3)
+        return {"ok": True}
+
+    monkeypatch.setattr(ac, "_post_agent_once_async", slow)
+
+    async def main():
+        leader = asyncio.ensure_future(ac.post_agent_async("planner", {"q": 2}))
+        await asyncio.sleep(0)
+        with pytest.raises(DeadlineExceeded):
+            await ac.post_agent_async("planner", {"q": 2}, deadline=Deadline.after(0.05))
+        return await leader  # a requisição compartilhada segue para quem ainda tem prazo
+
+    assert asyncio.run(main()) == {"ok": True}
@@ -0,0 +1,41 @@
+# tests/test_guardrails_batcher.py
+import asyncio
+
+from app.workflows import guardrails_batcher as gb
+
+
+def _run(monkeypatch, fake, n):
+    monkeypatch.setattr(gb, "post_agent_async", fake)
+    monkeypatch.setattr(gb, "GUARDRAILS_BATCH", True)
+    monkeypatch.setattr(gb, "_batcher", None)
+
+    async def main():
+        return await asyncio.gather(*(gb.post_guardrails_async({"question": f"q{i}"}) for i in range(n)))
+
+    return asyncio.run(main())
+
+
+def test_concurrent_calls_share_one_batch(monkeypatch):
+    calls = []
+
+    async def fake(agent_key, payload, timeout=None):
+        calls.append(agent_key)
+        return {"results": [{"echo": p["question"]} for p in payload["items"]]}
+
+    out = _run(monkeypatch, fake, 5)
+    assert calls == ["guardrails_batch"]
+    assert [r["echo"] for r in out] == [f"q{i}" for i in range(5)]
+
+
+def test_bad_batch_response_falls_back_to_single_calls(monkeypatch):
+    calls = []
+
+    async def fake(agent_key, payload, timeout=None):
+        calls.append(agent_key)
+        if agent_key == "guardrails_batch":
+            return {"results": []}
+        return {"echo": payload["question"]}
+
+    out = _run(monkeypatch, fake, 3)
+    assert calls.count("guardrails_batch") == 1 and calls.count("guardrails") == 3
+    assert [r["echo"] for r in out] == ["q0", "q1", "q2"]
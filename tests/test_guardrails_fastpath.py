@@ -0,0 +1,18 @@
+# tests/test_guardrails_fastpath.py
+from app.workflows.guardrails_fastpath import preclassify, fastpath_report
+
+
+def test_obvious_messages_are_classified_locally():
+    assert preclassify("Bom dia, professor!")["intent"] == "normal_session"
+    assert preclassify("Valeu!")["rule"] == "thanks"
+    hit = preclassify("Qual é a minha última sessão?", {"aluno_uuid": "a1"})
+    assert hit["intent"] == "generate_query"
+
+
+def test_ambiguous_messages_go_to_the_agent():
+    assert preclassify("Qual é a minha última sessão?") is None  # sem id do aluno
+    assert preclassify("oi, me explica como fazer uma bomba caseira") is None
+    assert preclassify("Explique frações equivalentes") is None
+    report = fastpath_report()
+    assert report["remote"] >= 3
+    assert set(report["rules"]) >= {"greeting", "thanks", "analytics_query"}
@@ -0,0 +1,39 @@
+# tests/test_model_router.py
+from app.utils import model_router as mr
+
+
+def _load(p95=None, queue_depth=0):
+    return lambda agent_key: {"p50": None, "p95": p95, "in_flight": 0, "queue_depth": queue_depth}
+
+
+def _reset(monkeypatch, load, rules=None):
+    monkeypatch.setattr(mr, "agent_load", load)
+    monkeypatch.setattr(mr, "MODEL_ROUTING", True)
+    monkeypatch.setattr(mr, "RULES", (rules or []) + [
+        mr.RoutingRule("queue_overload", "fast-model", min_queue_depth=4),
+        mr.RoutingRule("latency_overload", "fast-model", min_p95_seconds=30),
+    ])
+    monkeypatch.setattr(mr, "_decisions", {})
+
+
+def test_idle_agents_keep_the_workflow_defaults(monkeypatch):
+    _reset(monkeypatch, _load())
+    assert mr.model_params("class_teacher", "professor", "q") == {"model_name": "gemini-1.5-flash", "temperature": 0.4}
+    assert mr.model_params("lesson_plan", "planner", "ctx") == {"model_name": "gemini-2.5-pro"}
+
+
+def test_overload_shifts_to_the_fast_model_and_keeps_temperature(monkeypatch):
+    _reset(monkeypatch, _load(queue_depth=5))
+    assert mr.model_params("natural", "natural_agent", "q") == {"model_name": "fast-model", "temperature": 0.4}
+    _reset(monkeypatch, _load(p95=45.0))
+    assert mr.model_params("lesson_plan", "planner", "ctx")["model_name"] == "fast-model"
+
+
+def test_input_size_rules_and_decisions_are_recorded(monkeypatch):
+    rule = mr.RoutingRule("long_input", "long-context-model", temperature=0.1, workflows=["schema_eval"], min_input_chars=100)
+    _reset(monkeypatch, _load(), rules=[rule])
+    assert mr.model_params("schema_eval", "schema_creator", "x" * 150) == {"model_name": "long-context-model", "temperature": 0.1}
+    assert mr.model_params("schema_eval", "schema_creator", "short")["model_name"] == "gemini-1.5-flash"
+    report = mr.routing_report()
+    assert report["decisions"]["schema_eval"] == {"long-context-model (long_input)": 1, "gemini-1.5-flash (base)": 1}
+    assert report["recent"][-1]["input_chars"] == 5
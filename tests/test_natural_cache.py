@@ -0,0 +1,67 @@
+# tests/test_natural_cache.py
+import asyncio
+
+from app.utils import session_store
+from app.utils.session_backends import MemoryBackend
+from app.utils.tiered_cache import TieredCache
+from app.workflows import normal_session as ns
+
+
+def _setup(monkeypatch, enabled=True):
+    monkeypatch.setattr(session_store, "_backend", MemoryBackend())
+    monkeypatch.setattr(ns, "NATURAL_CACHE", enabled)
+    monkeypatch.setattr(ns, "_answer_cache", TieredCache("natural_answer_test", use_redis=False, max_entry_bytes=200))
+    calls = []
+
+    async def fake(agent_key, payload, timeout=None, deadline=None):
+        calls.append(payload["question"])
+        return {"answer": f"resposta {len(calls)}" if payload["question"] != "longa" else "x" * 500}
+
+    monkeypatch.setattr(ns, "post_agent_async", fake)
+    return calls
+
+
+def _ask(*questions, session_id="s1"):
+    async def main():
+        return [(await ns.run_natural_session_async(session_id, q))["answer"] for q in questions]
+    return asyncio.run(main())
+
+
+def test_same_normalized_question_hits_cache_and_still_goes_to_history(monkeypatch):
+    calls = _setup(monkeypatch)
+    out = _ask("O que é uma fração?", "o que é  uma FRAÇÃO", "O que é um número primo?")
+    assert out == ["resposta 1", "resposta 1", "resposta 2"]
+    assert len(calls) == 2
+    history = session_store.get_session_history("s1")
+    assert [m["content"] for m in history if m["role"] == "agent"] == out
+
+
+def test_cache_is_opt_in(monkeypatch):
+    calls = _setup(monkeypatch, enabled=False)
+    _ask("O que é uma fração?", "O que é uma fração?")
+    assert len(calls) == 2
+
+
+def test_oversized_answers_are_not_cached(monkeypatch):
+    calls = _setup(monkeypatch)
+    _ask("longa", "longa")
+    assert len(calls) == 2
+    assert ns._answer_cache.stats()["too_large"] == 2
+
+
+def test_speculative_answer_is_cached_only_on_commit(monkeypatch):
+    calls = _setup(monkeypatch)
+
+    async def main():
+        draft = await ns.natural_answer_async("O que é uma fração?")  # guardrails ainda não liberou
+        assert ns._answer_cache.stats()["sets"] == 0
+        again = await ns.natural_answer_async("O que é uma fração?")  # rascunho descartado: sem hit
+        await ns.commit_natural_turn_async("s1", "O que é uma fração?", *again)
+        return draft
+
+    draft = asyncio.run(main())
+    assert draft.answer == "resposta 1"
+    assert len(calls) == 2
+    assert ns._answer_cache.stats()["sets"] == 1
+    assert _ask("o que é uma fração") == ["resposta 2"]
+    assert len(calls) == 2
@@ -0,0 +1,37 @@
+# tests/test_redis_client.py
+import redis
+import redis.asyncio as aioredis
+
+from app import redis_client
+
+
+def _client(module):
+    pool = module.ConnectionPool.from_url("redis://localhost:6399", max_connections=4)
+    pool._available_connections.append(object())
+    pool._in_use_connections.add(object())
+    pool._in_use_connections.add(object())
+    return module.Redis(connection_pool=pool)
+
+
+def test_pool_stats_count_created_connections_for_sync_and_async(monkeypatch):
+    monkeypatch.setattr(redis_client, "_redis_instances", {False: _client(redis)})
+    monkeypatch.setattr(redis_client, "_async_redis_instances", {False: _client(aioredis)})
+    stats = redis_client.get_pool_stats()
+    expected = {"initialized": True, "max_connections": 4, "created": 3, "in_use": 2, "idle": 1, "utilization": 0.5}
+    assert stats["sync"] == expected
+    assert stats["async"] == expected
+    assert stats["sync_binary"] == {"initialized": False}
+
+
+def test_retry_policy_reaches_every_connection(monkeypatch):
+    monkeypatch.setattr(redis_client, "REDIS_URL", "redis://localhost:6399")
+    monkeypatch.setattr(redis_client, "REDIS_RETRIES", 4)
+    monkeypatch.setattr(redis_client, "_redis_instances", {})
+    monkeypatch.setattr(redis_client, "_async_redis_instances", {})
+    for client in (redis_client.get_redis_client(), redis_client.get_async_redis_client(binary=True)):
+        pool = client.connection_pool
+        assert pool.connection_kwargs["retry"].get_retries() == 4
+        assert "retry_on_timeout" not in pool.connection_kwargs
+        conn = pool.make_connection()  # só cria o objeto, não conecta
+        assert conn.retry.get_retries() == 4
+        assert redis.exceptions.TimeoutError in conn.retry._supported_errors
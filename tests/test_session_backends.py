@@ -0,0 +1,156 @@
+# tests/test_session_backends.py
+import pytest
+
+from app.utils import session_backends
+from app.utils.session_backends import MemoryBackend, RedisListBackend, EVAL_CONSUMER
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """Backends Redis contra um fakeredis (sync + async, texto + binário, mesmo servidor)."""
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    sync = {b: fakeredis.FakeRedis(server=server, decode_responses=not b) for b in (False, True)}
+    aio = {b: fakeredis.aioredis.FakeRedis(server=server, decode_responses=not b) for b in (False, True)}
+    monkeypatch.setattr(session_backends, "get_redis_client", lambda binary=False: sync[binary])
+    monkeypatch.setattr(session_backends, "get_async_redis_client", lambda binary=False: aio[binary])
+    return sync
+
+
+def _turn(i):
+    return [{"role": "user", "content": f"pergunta {i}"}, {"role": "agent", "content": f"resposta {i}"}]
+
+
+def test_memory_read_after_id():
+    b = MemoryBackend()
+    b.append("s1", _turn(0) + _turn(1))
+    items = b.read("s1")
+    assert [eid for eid, _ in items] == ["0", "1", "2", "3"]
+    assert [m["content"] for _, m in b.read("s1", after="1")] == ["pergunta 1", "resposta 1"]
+    assert [eid for eid, _ in b.read("s1", after="0", count=2)] == ["1", "2"]
+    assert b.read("nope") == []
+
+
+def test_memory_compaction_keeps_ids_and_pending_text(monkeypatch):
+    monkeypatch.setattr(session_backends, "SESSION_MAX_ENTRIES", 4)
+    b = MemoryBackend()
+    b.append("s1", _turn(0))
+    b.append_partial_evals("s1", [{"strong_points": "a"}], "1")  # turno 0 já avaliado
+    b.append("s1", _turn(1) + _turn(2))
+    ids = [eid for eid, _ in b.read("s1")]
+    assert ids == ["4", "5"]
+    summary = b.summary("s1")
+    assert summary["compacted_entries"] == "4"
+    assert summary["pending_user_text"] == "pergunta 1"
+    assert b.partial_evals("s1") == ("1", [{"strong_points": "a"}])
+    assert b.get_cursor("s1", EVAL_CONSUMER) == "1"
+
+
+def test_memory_lru_eviction_under_cap():
+    b = MemoryBackend(max_bytes=1)
+    b.append("old", _turn(0))
+    b.append("new", _turn(1))
+    assert b.read("old") == []
+    assert len(b.read("new")) == 2
+    assert b.stats()["evictions"] == 1
+
+
+def test_memory_lock_and_clear():
+    b = MemoryBackend()
+    token = b.acquire_lock("s1")
+    assert token and b.acquire_lock("s1") is None
+    b.release_lock("s1", token)
+    b.append("s1", _turn(0))
+    b.clear("s1")
+    assert b.read("s1") == [] and b.summary("s1") == {}
+
+
+def test_list_read_uses_registered_script(fake_redis):
+    b = RedisListBackend()
+    b.append("s1", _turn(0) + _turn(1))
+    client = fake_redis[True]
+    client.eval = None  # o texto do script não é reenviado a cada leitura
+    assert [eid for eid, _ in b.read("s1")] == ["0", "1", "2", "3"]
+    script = session_backends._script(client, session_backends._LIST_READ_LUA)
+    assert [m["content"] for _, m in b.read("s1", after="1")] == ["pergunta 1", "resposta 1"]
+    assert session_backends._script(client, session_backends._LIST_READ_LUA) is script
+    assert client.script_exists(script.sha) == [True]
+
+
+def test_partial_evals_are_not_written_for_a_cleared_session(fake_redis):
+    for b in (MemoryBackend(), RedisListBackend()):
+        b.append("s1", _turn(0))
+        assert b.append_partial_evals("s1", [{"strong_points": "a"}], "1") is True
+        b.clear("s1")
+        assert b.append_partial_evals("s1", [{"strong_points": "b"}], "3") is False
+        assert b.partial_evals("s1") == (None, [])
+
+
+@pytest.mark.parametrize("backend", ["memory", "redis", "redis_stream"])
+def test_window_append_trims_without_compacting(backend, request):
+    if backend != "memory":
+        request.getfixturevalue("fake_redis")
+    b = session_backends.make_backend(backend)
+    for i in range(3):
+        b.append("ctx", _turn(i), max_len=4, ttl_seconds=60, compact=False)
+    items = b.read("ctx")
+    assert [m["content"] for _, m in items] == ["pergunta 1", "resposta 1", "pergunta 2", "resposta 2"]
+    assert "summary" not in b.summary("ctx") and "pending_user_text" not in b.summary("ctx")
+    assert [m["content"] for _, m in b.read("ctx", after=items[1][0])] == ["pergunta 2", "resposta 2"]
+
+
+def test_list_window_append_is_one_round_trip_with_ttl(fake_redis):
+    b = RedisListBackend()
+    client = fake_redis[True]
+    b.append("ctx", _turn(0) + _turn(1) + _turn(2), max_len=4, ttl_seconds=60, compact=False)
+    assert client.llen("session:ctx") == 4
+    assert 0 < client.ttl("session:ctx") <= 60
+    assert not client.exists("session:ctx:bytes")
+    assert [eid for eid, _ in b.read("ctx")] == ["2", "3", "4", "5"]  # ids seguem estáveis
+
+
+def test_turn_write_is_one_pipelined_round_trip(fake_redis, monkeypatch):
+    client = fake_redis[True]
+    pipelines = []
+    pipeline = client.pipeline
+
+    def counting_pipeline(transaction=True):
+        pipe = pipeline(transaction=transaction)
+        pipelines.append((transaction, pipe))
+        return pipe
+
+    def no_direct_command(*args, **kwargs):
+        raise AssertionError(f"command outside the pipeline: {args[:1]}")
+
+    monkeypatch.setattr(client, "pipeline", counting_pipeline)
+    monkeypatch.setattr(client, "execute_command", no_direct_command)
+    RedisListBackend().append("s1", _turn(0) + [{"role": "agent", "content": "aula"}], ttl_seconds=60)
+
+    assert [t for t, _ in pipelines] == [True]  # MULTI/EXEC: RPUSH + INCRBY + EXPIREs juntos
+    assert fake_redis[False].llen("session:s1") == 3
+    assert 0 < fake_redis[False].ttl("session:s1") <= 60
+
+
+@pytest.mark.parametrize("backend", ["memory", "redis"])
+def test_expired_lock_owner_cannot_touch_the_new_owners_lock(backend, request, monkeypatch):
+    if backend != "memory":
+        request.getfixturevalue("fake_redis")
+    b = session_backends.make_backend(backend)
+    b.append("s1", _turn(0))
+    old = b.acquire_lock("s1", ttl_seconds=1)
+    if backend == "memory":
+        b._locks["s1"] = (old, 0.0)  # expirou
+    else:
+        request.getfixturevalue("fake_redis")[False].delete("session:s1:eval_lock")  # expirou
+    new = b.acquire_lock("s1")
+    assert new and new != old
+
+    b.release_lock("s1", old)  # o dono antigo terminou atrasado
+    assert not b.refresh_lock("s1", old)
+    assert b.append_partial_evals("s1", [{"strong_points": "velho"}], "1", lock_token=old) is False
+    assert b.acquire_lock("s1") is None  # o lock do novo dono continua lá
+
+    assert b.refresh_lock("s1", new)
+    assert b.append_partial_evals("s1", [{"strong_points": "novo"}], "1", lock_token=new)
+    b.release_lock("s1", new)
+    assert b.acquire_lock("s1")
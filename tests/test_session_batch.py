@@ -0,0 +1,55 @@
+# tests/test_session_batch.py
+from app.utils.session_batch import BatchPacker, chunk_text, estimate_tokens, topic_overlap, topic_terms
+
+
+def _pack(texts, **kw):
+    packer = BatchPacker(**kw)
+    out = []
+    for t in texts:
+        out += packer.add(t)
+    return out + packer.flush(), packer
+
+
+def test_whole_utterances_fill_batches_in_order():
+    batches, packer = _pack(["a" * 10, "b" * 10, "c" * 10], max_chars=21)
+    assert batches == ["a" * 10 + "\n" + "b" * 10, "c" * 10]
+    assert packer.batches == 2
+
+
+def test_repeated_utterances_and_whitespace_are_dropped():
+    batches, packer = _pack(["Olá,\n\n professor!", "olá, professor!", "  "], max_chars=100)
+    assert batches == ["Olá, professor!"]
+    assert packer.repeats == 1
+
+
+def test_long_utterance_splits_on_sentences_then_words():
+    text = "Primeira frase curta. " + " ".join(["palavra"] * 10)
+    batches, _ = _pack([text], max_chars=30)
+    assert batches[0] == "Primeira frase curta."
+    assert all(len(b) <= 30 for b in batches)
+    assert " ".join(" ".join(b.split("\n")) for b in batches) == text
+
+
+def test_token_budget_caps_batch_size():
+    batches, packer = _pack(["x" * 30, "y" * 30], max_chars=1000, max_tokens=10)
+    assert packer.limit == 40
+    assert all(estimate_tokens(b) <= 10 for b in batches)
+
+
+def test_chunk_text_has_no_overlap():
+    text = "Uma frase. " * 50
+    chunks = chunk_text(text, max_chars=100)
+    assert all(len(c) <= 100 for c in chunks)
+    assert sum(c.count("Uma frase.") for c in chunks) == 50
+
+
+def test_topic_terms_ignore_accents_and_filler_words():
+    assert topic_terms("Explique frações equivalentes, por favor") == {"fracoes", "equivalentes", "favor"}
+    assert topic_terms("e depois?") == set()
+
+
+def test_topic_overlap_tracks_topic_changes():
+    plan = topic_terms("Explique frações equivalentes")
+    assert topic_overlap(topic_terms("como somar frações?"), plan) == 0.5
+    assert topic_overlap(topic_terms("Agora fotossíntese"), plan) == 0.0
+    assert topic_overlap(topic_terms("e depois?"), plan) is None
@@ -0,0 +1,44 @@
+# tests/test_session_codec.py
+import json
+from datetime import datetime
+
+import pytest
+
+from app.utils import session_codec
+from app.utils.session_codec import encode_entry, decode_entry
+
+TS = datetime(2025, 3, 1, 12, 30, 15, 250000)
+
+
+def test_json_roundtrip():
+    raw = encode_entry("user", "Olá, professor!", ts=TS)
+    assert raw.startswith(b"{")
+    entry = decode_entry(raw)
+    assert entry == {"timestamp": TS.isoformat(), "role": "user", "content": "Olá, professor!", "extra": {}}
+
+
+def test_decode_accepts_str_from_old_entries():
+    old = json.dumps({"timestamp": TS.isoformat(), "role": "agent", "content": "oi", "extra": {}})
+    assert decode_entry(old)["content"] == "oi"
+
+
+def test_msgpack_roundtrip_and_smaller(monkeypatch):
+    pytest.importorskip("msgpack")
+    monkeypatch.setattr(session_codec, "SESSION_ENCODING", "msgpack")
+    raw = encode_entry("agent", "[PROFESSOR]\nAula de frações", ts=TS)
+    assert raw[:1] == session_codec.MSGPACK_V1
+    entry = decode_entry(raw)
+    assert entry["role"] == "agent"
+    assert entry["content"] == "[PROFESSOR]\nAula de frações"
+    assert entry["timestamp"] == TS.isoformat()
+    assert entry["extra"] == {}
+
+    monkeypatch.setattr(session_codec, "SESSION_ENCODING", "json")
+    assert len(raw) < len(encode_entry("agent", "[PROFESSOR]\nAula de frações", ts=TS))
+
+
+def test_msgpack_keeps_extra_and_unknown_roles(monkeypatch):
+    pytest.importorskip("msgpack")
+    monkeypatch.setattr(session_codec, "SESSION_ENCODING", "msgpack")
+    entry = decode_entry(encode_entry("tool", "x", extra={"k": 1}, ts=TS))
+    assert entry["role"] == "tool" and entry["extra"] == {"k": 1}
@@ -0,0 +1,90 @@
+# tests/test_tiered_cache.py
+import asyncio
+import time
+
+import pytest
+
+from app.utils import tiered_cache
+from app.utils.tiered_cache import LocalCache, TieredCache, cache_key
+
+
+def test_cache_key_is_canonical():
+    assert cache_key({"a": 1, "b": {"x": 2}}) == cache_key({"b": {"x": 2}, "a": 1})
+    assert cache_key({"a": 1}) != cache_key({"a": 2})
+
+
+def test_local_cache_lru_and_ttl():
+    c = LocalCache(max_entries=2, ttl_seconds=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    c.get("a")          # "a" passa a ser o mais recente
+    c.set("c", 3)       # descarta "b"
+    assert c.get("b") is None and c.get("a") == 1 and c.get("c") == 3
+    c.set("d", 4, ttl_seconds=0.01)
+    time.sleep(0.02)
+    assert c.get("d") is None
+
+
+def test_tiered_cache_counters_without_redis():
+    cache = TieredCache("test_local_only", max_entries=10, use_redis=False, max_entry_bytes=50)
+    assert cache.get("k") is None
+    cache.set("k", {"v": 1})
+    cache.set("big", {"v": "x" * 100})
+    assert cache.get("k") == {"v": 1}
+    assert cache.get("big") is None
+    stats = cache.stats()
+    assert stats["hits_local"] == 1 and stats["misses"] == 2 and stats["too_large"] == 1
+    assert stats["hit_rate"] == round(1 / 3, 3)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    sync = fakeredis.FakeRedis(server=server, decode_responses=True)
+    aio = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+    monkeypatch.setattr(tiered_cache, "REDIS_URL", "redis://fake")
+    monkeypatch.setattr(tiered_cache, "get_redis_client", lambda binary=False: sync)
+    monkeypatch.setattr(tiered_cache, "get_async_redis_client", lambda binary=False: aio)
+    return sync
+
+
+def test_l2_is_off_without_redis_url(monkeypatch):
+    monkeypatch.setattr(tiered_cache, "REDIS_URL", None)
+
+    def no_redis(binary=False):
+        raise AssertionError("L2 should not be used")
+
+    monkeypatch.setattr(tiered_cache, "get_redis_client", no_redis)
+    cache = TieredCache("test_no_url")
+    cache.set("k", 1)
+    assert cache.get("k") == 1 and cache.get("other") is None
+    stats = cache.stats()
+    assert stats["redis_errors"] == 0 and stats["redis_enabled"] is False
+
+
+def test_redis_failures_are_logged_once(monkeypatch, capsys):
+    monkeypatch.setattr(tiered_cache, "REDIS_URL", "redis://down")
+
+    def down(binary=False):
+        raise ConnectionError("refused")
+
+    monkeypatch.setattr(tiered_cache, "get_redis_client", down)
+    cache = TieredCache("test_redis_down")
+    for i in range(3):
+        assert cache.get(f"k{i}") is None
+    assert cache.stats()["redis_errors"] == 3
+    assert capsys.readouterr().out.count("[WARN]") == 1
+
+
+def test_corrupted_l2_value_is_a_miss(fake_redis):
+    cache = TieredCache("test_corrupt")
+    fake_redis.set("cache:test_corrupt:k", '{"plan": "trunc')
+    assert cache.get("k") is None
+    assert asyncio.run(cache.get_async("k")) is None
+    stats = cache.stats()
+    assert stats["decode_errors"] == 2 and stats["misses"] == 2
+    cache.set("k", {"plan": "ok"})
+    cache.local.delete("k")
+    assert cache.get("k") == {"plan": "ok"}  # regravado, volta a servir do L2
+    assert cache.stats()["hits_redis"] == 1
@@ -0,0 +1,50 @@
+# guardrails_batch_agent.py
+"""
+Stand-in guardrails agent for local tests (no LLM): same response body as the real
+agent, plus the batch endpoint used by app/workflows/guardrails_batcher.py.
+
+    python -m utils.guardrails_batch_agent        # serves on 127.0.0.1:9200 (config.BASE_URL)
+
+POST /mirai_agents/guardrails/ask    {"question": ...}            → {"assessment": {...}}
+POST /mirai_agents/guardrails/batch  {"items": [{"question": ...}]} → {"results": [{"assessment": {...}}, ...]}
+"""
+import re
+from typing import Any, Dict, List
+
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+app = FastAPI(title="Guardrails stand-in")
+
+_HARMFUL = re.compile(r"\b(bomba|arma|drogas?|hack(ear)?|bomb|weapon)\b", re.IGNORECASE)
+_STUDY = re.compile(r"\b(aula|estudar|explique|explica|exerc[ií]cio|lesson|study|explain)\b", re.IGNORECASE)
+
+
+class BatchRequest(BaseModel):
+    items: List[Dict[str, Any]]
+
+
+def _assess(payload: Dict[str, Any]) -> Dict[str, Any]:
+    question = payload.get("question") or ""
+    harmful = bool(_HARMFUL.search(question))
+    classe = "sessao_de_estudos" if _STUDY.search(question) else "conversa_sem_query"
+    return {"assessment": {"pergunta_nociva": harmful, "classificacao_pergunta": classe}}
+
+
+@app.post("/mirai_agents/guardrails/ask")
+def ask(payload: Dict[str, Any]):
+    return _assess(payload)
+
+
+@app.post("/mirai_agents/guardrails/batch")
+def batch(req: BatchRequest):
+    return {"results": [_assess(p) for p in req.items]}
+
+
+def main():
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=9200)
+
+
+if __name__ == "__main__":
+    main()